@@ -0,0 +1,150 @@
+import asyncio
+import threading
+from typing import AsyncIterator, Optional
+from app.core.grbl_controller import (
+    GRBLController, MachineStatus, EVENT_STATUS, EVENT_CLOSED, REALTIME_COMMANDS, get_default_grbl
+)
+
+
+class AsyncGRBLController:
+    """
+    GRBLController 的 asyncio 封装，供 FastAPI 等异步代码调用
+
+    GRBLController 的命令需要阻塞等待 ok，这里把它们放到线程池中执行，事件循环只等待结果；
+    状态报告和流式发送的进度由串口读取线程通过 loop.call_soon_threadsafe 交给事件循环，
+    因此在写字机执行任务期间，其它请求（上传、识别等）可以照常处理。
+    """
+
+    def __init__(self, controller: GRBLController = None):
+        """
+        参数:
+            controller: 被封装的同步控制器，默认为 get_default_grbl() 返回的实例
+        """
+        self.controller = controller or get_default_grbl()
+
+    async def _run(self, func, *args):
+        """在线程池中执行同步方法"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def connect(self, port: str) -> bool:
+        return await self._run(self.controller.connect, port)
+
+    async def disconnect(self) -> None:
+        await self._run(self.controller.disconnect)
+
+    async def send(self, cmd: str, timeout: float = 5) -> Optional[list]:
+        """
+        发送一条命令并等待回复
+
+        参数:
+            cmd: G-code 或 $ 命令；也可以是实时命令 '?'、'!'、'~'、'\\x18'，实时命令不等待 ok
+            timeout: 等待回复的超时时间（秒）
+
+        返回:
+            与 GRBLController._send_grbl_command 相同：收到的回复行列表，未连接或串口错误时为 None
+        """
+        if cmd in REALTIME_COMMANDS and cmd != '?':
+            return ["sent"] if self.controller._send_realtime(cmd) else None
+        return await self._run(self.controller._send_grbl_command, cmd, True, True, timeout)
+
+    async def status(self, max_age: float = None, timeout: float = 1.0) -> Optional[MachineStatus]:
+        """
+        获取状态快照
+
+        参数:
+            max_age: 允许的快照最大时长（秒）；已有快照足够新时直接返回，否则发送 '?' 等待新的状态报告。
+                     为 None 时，正在轮询状态就直接返回最新快照，否则查询一次
+            timeout: 等待状态报告的超时时间（秒）
+
+        返回:
+            MachineStatus，设备未连接或超时时返回最近一次的快照（可能为 None）
+        """
+        controller = self.controller
+        current = controller.get_status()
+        if current is not None:
+            if max_age is None and controller.status_poller is not None:
+                return current
+            if max_age is not None and current.age <= max_age:
+                return current
+        reader = controller.reader
+        if not controller.connected or reader is None:
+            return current
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(status):
+            if not future.done():
+                future.set_result(status)
+
+        def on_event(event):
+            # 在串口读取线程中执行，读取线程已先更新了控制器的快照
+            if event.kind == EVENT_STATUS:
+                loop.call_soon_threadsafe(set_result, controller.get_status())
+            elif event.kind == EVENT_CLOSED:
+                loop.call_soon_threadsafe(set_result, None)
+
+        reader.add_listener(on_event)
+        try:
+            if not controller._send_realtime('?'):
+                return current
+            status = await asyncio.wait_for(future, timeout)
+            return status or controller.get_status()
+        except asyncio.TimeoutError:
+            return controller.get_status()
+        finally:
+            reader.remove_listener(on_event)
+
+    async def stream_gcode(self, gcode_content, check_bounds: bool = True, stop_on_error: bool = True,
+                           timeout: float = 30) -> AsyncIterator[dict]:
+        """
+        流式发送 G-code，异步产出进度
+
+        产出:
+            每收到一个 ok/error 产出一次 {'acked': 已回复行数, 'total': 总行数或 None, 'line_number': 行号, 'done': False}；
+            结束时产出 {'done': True, 'result': GRBLController.stream_gcode 的返回值}。
+            调用方提前结束迭代（break 或任务被取消）时会停止发送后续行。
+        """
+        loop = asyncio.get_running_loop()
+        progress = asyncio.Queue()
+        # 每次发送单独的取消标志：工作线程拿到串口锁之前取消也不会丢失
+        cancel_event = threading.Event()
+
+        def on_progress(acked, total, line_number):
+            loop.call_soon_threadsafe(progress.put_nowait, {
+                'acked': acked, 'total': total, 'line_number': line_number, 'done': False
+            })
+
+        def run():
+            try:
+                result = self.controller.stream_gcode(
+                    gcode_content, progress_callback=on_progress, check_bounds=check_bounds,
+                    stop_on_error=stop_on_error, timeout=timeout, cancel_event=cancel_event
+                )
+            except Exception as e:
+                result = {'success': False, 'sent': 0, 'acked': 0, 'errors': [], 'error': f"流式发送出错: {e}"}
+            loop.call_soon_threadsafe(progress.put_nowait, {'done': True, 'result': result})
+
+        worker = threading.Thread(target=run, name="grbl-async-stream", daemon=True)
+        worker.start()
+        finished = False
+        try:
+            while True:
+                item = await progress.get()
+                if item['done']:
+                    finished = True
+                yield item
+                if finished:
+                    return
+        finally:
+            if not finished:
+                cancel_event.set()
+
+
+# 创建默认实例
+default_async_grbl = AsyncGRBLController()
+
+# 定义一个函数，用于获取默认实例
+def get_default_async_grbl():
+    return default_async_grbl
@@ -6,6 +6,7 @@ import diskcache as dc
 import threading
 import json
 import base64
+import io
 from typing import Any, Optional, Union, Dict, List
 import cv2
 import numpy as np
@@ -225,6 +226,48 @@ class CacheSystem:
             return False
 
 
+    def save_ndarray(self, data_id: str, array: np.ndarray, expire: int = None) -> bool:
+        """
+        保存NumPy数组到缓存（无损压缩，适合墨迹层这类大部分为0的蒙版）
+
+        参数:
+            data_id: 数据ID
+            array: NumPy数组
+            expire: 过期时间（秒）
+
+        返回:
+            bool: 是否成功
+        """
+        try:
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, array=array)
+            key = f"ndarray:{data_id}"
+            return self.set(key, buffer.getvalue(), expire)
+        except Exception as e:
+            print(f"数组保存失败: {e}")
+            return False
+
+    def get_ndarray(self, data_id: str) -> Optional[np.ndarray]:
+        """
+        获取NumPy数组
+
+        参数:
+            data_id: 数据ID
+
+        返回:
+            NumPy数组或None
+        """
+        key = f"ndarray:{data_id}"
+        data = self.get(key)
+        if data is None:
+            return None
+        try:
+            with np.load(io.BytesIO(data)) as npz:
+                return npz["array"]
+        except Exception as e:
+            print(f"数组读取失败: {e}")
+            return None
+
     def save_json(self, data_id: str, data: Dict, expire: int = None) -> bool:
         """
         保存JSON数据到缓存
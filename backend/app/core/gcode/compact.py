@@ -0,0 +1,258 @@
+import math
+import re
+from typing import Iterable, Iterator, List, Union
+from app.core.gcode.parser import MM_PER_INCH, clean_line, parse_words
+from app.core.gcode.text_to_gcode import DEFAULT_Z_PEN_DOWN, DEFAULT_Z_PEN_UP
+
+# 两笔之间的空程不超过该距离 (mm) 时不抬笔，直接画过去；笔迹宽度约 0.5mm，这么短的连线看不出来
+DEFAULT_MAX_GAP = 0.3
+
+# 可以单独删除的字：字母 + 数值，例如 G1、X10.000、F1000
+_TOKEN_PATTERN = re.compile(r"^[A-Z][-+]?(\d+\.?\d*|\.\d+)$")
+_MOTION_CODES = {0.0, 1.0, 2.0, 3.0}
+# 只包含这些 G 代码的行可以逐字删减
+_SIMPLE_CODES = _MOTION_CODES | {90.0, 91.0, 20.0, 21.0}
+# 执行后当前位置不再确定的 G 代码
+_RESET_POSITION_CODES = {10.0, 28.0, 30.0, 92.0}
+_EPSILON = 1e-6
+
+
+def _is_plain_move(gcodes: List[float], words: dict, axes: set) -> bool:
+    """只包含给定坐标字的 G0/G1 移动"""
+    return bool(words) and set(words) <= axes and set(gcodes) <= {0.0, 1.0, 90.0}
+
+
+def merge_pen_lifts(lines: Iterable[str], max_gap: float = DEFAULT_MAX_GAP,
+                    z_pen_down: float = DEFAULT_Z_PEN_DOWN, z_pen_up: float = DEFAULT_Z_PEN_UP,
+                    stats: dict = None) -> Iterator[str]:
+    """
+    去掉距离很近的两笔之间的抬笔
+
+    匹配 抬笔 -> 若干 XY 空程 -> 落笔 的片段，落笔高度与抬笔前相同、且抬笔处到落笔处的距离不超过 max_gap 时，
+    整个片段换成一条 G1 直线，以当前进给速度直接画过去。片段中的注释行（如单元格分隔）保留。
+    只处理绝对坐标 (G90) 下的片段；还没有设置过 F 时不合并，避免 G1 没有进给速度。
+    英制单位 (G20) 下坐标先换算为毫米再与 max_gap 和落笔/抬笔高度比较。
+
+    参数:
+        lines: G-code 行
+        max_gap: 允许直接画过去的最大距离 (mm)，为 0 时不合并
+        z_pen_down, z_pen_up: 落笔/抬笔 Z 值 (mm)
+        stats: 可选的统计字典，处理结束后写入 {'pen_lifts_removed'}
+
+    产出:
+        处理后的 G-code 行
+    """
+    if stats is None:
+        stats = {}
+    stats['pen_lifts_removed'] = 0
+
+    def is_down(z):
+        z *= scale
+        return abs(z - z_pen_down) < abs(z - z_pen_up)
+
+    scale = 1.0                # 单位换算比例，G20 时为 25.4；position 等坐标使用程序单位
+    position = [0.0, 0.0, z_pen_up]
+    absolute = True
+    feed = None
+    pending: List[str] = []    # 抬笔之后缓存的行，第一行为抬笔
+    lift_from = None           # 抬笔时的 XY
+    lift_z = None              # 抬笔的目标 Z
+    target = None              # 空程的终点 XY
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        gcodes, words = parse_words(line)
+        if 90.0 in gcodes:
+            absolute = True
+        if 91.0 in gcodes:
+            absolute = False
+
+        if pending:
+            if not clean_line(line):
+                pending.append(line)
+                continue
+            if absolute and _is_plain_move(gcodes, words, {'X', 'Y'}):
+                target = (words.get('X', target[0]), words.get('Y', target[1]))
+                pending.append(line)
+                continue
+            if absolute and _is_plain_move(gcodes, words, {'Z'}) and abs(words['Z'] - position[2]) < _EPSILON \
+                    and math.hypot(target[0] - lift_from[0], target[1] - lift_from[1]) * scale <= max_gap:
+                yield from (kept for kept in pending if not clean_line(kept))
+                yield f"G1 X{target[0]:.3f} Y{target[1]:.3f}"
+                stats['pen_lifts_removed'] += 1
+                position[0], position[1] = target
+                pending = []
+                continue
+            # 不能合并，原样输出缓存的行
+            yield from pending
+            pending = []
+            position = [target[0], target[1], lift_z]
+
+        # 单位切换（G20/G21 不是普通移动，上面已经结束了缓存的片段），当前位置换算为新单位
+        new_scale = MM_PER_INCH if 20.0 in gcodes else 1.0 if 21.0 in gcodes else scale
+        if new_scale != scale:
+            position = [value * scale / new_scale for value in position]
+            scale = new_scale
+
+        if absolute and max_gap > 0 and feed is not None and _is_plain_move(gcodes, words, {'Z'}) \
+                and is_down(position[2]) and not is_down(words['Z']):
+            pending = [line]
+            lift_from = (position[0], position[1])
+            lift_z = words['Z']
+            target = lift_from
+            continue
+
+        if 'F' in words:
+            feed = words['F']
+        if set(gcodes) & _RESET_POSITION_CODES:
+            position = [position[0], position[1], z_pen_up]  # 之后的落笔状态不确定，等下一次落笔
+        else:
+            for k, axis in enumerate('XYZ'):
+                if axis in words:
+                    position[k] = words[axis] if absolute else position[k] + words[axis]
+        yield line
+    yield from pending
+
+
+def _apply_modal(gcodes: List[float], modal: dict) -> bool:
+    """按一行的 G 代码更新模态，返回单位是否改变"""
+    units = modal['units']
+    for code in gcodes:
+        if code in _MOTION_CODES:
+            modal['motion'] = code
+        elif code in (90.0, 91.0):
+            modal['absolute'] = code == 90.0
+        elif code in (20.0, 21.0):
+            modal['units'] = code
+    return units is not None and modal['units'] != units
+
+
+def compact_gcode(lines: Iterable[str], stats: dict = None) -> Iterator[str]:
+    """
+    删除冗余的模态字和无效移动，得到更紧凑的程序
+
+    删除的内容:
+        - 与当前模态相同的 G0/G1/G2/G3、G90/G91、G20/G21 和 F 字
+        - G0/G1 中与当前位置相同的坐标字，例如重复的同高度 Z 移动
+        - 删减后没有剩下任何字的行
+    注释、$ 命令和包含其它 G 代码（G4、G92 等）的行原样输出，只用来更新模态。
+    单位 (G20/G21) 改变后，之前记录的位置和进给速度不再能与新的数值比较，重新记录。
+    删除运动字后的行依赖前面行的模态，因此应作为发送前的最后一步处理。
+
+    参数:
+        lines: G-code 行
+        stats: 可选的统计字典，处理结束后写入 {'words_removed'}
+
+    产出:
+        处理后的 G-code 行
+    """
+    if stats is None:
+        stats = {}
+    stats['words_removed'] = 0
+    # 开始时的模态未知，第一次出现的字都保留
+    modal = {'motion': None, 'absolute': None, 'units': None, 'feed': None}
+    position = [None, None, None]
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        tokens = line.upper().split()
+        gcodes, words = parse_words(line)
+        if clean_line(line) != line or not set(gcodes) <= _SIMPLE_CODES \
+                or not all(_TOKEN_PATTERN.match(token) for token in tokens):
+            if _apply_modal(gcodes, modal):
+                modal['feed'] = None
+            if 'F' in words:
+                modal['feed'] = words['F']
+            if clean_line(line):
+                position = [None, None, None]
+            yield line
+            continue
+
+        # 同一行的模态字对整行生效，与字的顺序无关，先更新模态再逐字处理
+        previous = dict(modal)
+        if _apply_modal(gcodes, modal):
+            position = [None, None, None]
+            modal['feed'] = None
+        line_motion = modal['motion']
+        modal['motion'] = previous['motion']
+        kept = []
+        for token in tokens:
+            letter, value = token[0], float(token[1:])
+            if letter == 'G':
+                if value in _MOTION_CODES:
+                    continue  # 最后再决定是否保留
+                key = 'absolute' if value in (90.0, 91.0) else 'units'
+                if previous[key] == (value == 90.0 if key == 'absolute' else value) or token in kept:
+                    continue
+            elif letter == 'F':
+                if modal['feed'] is not None and abs(value - modal['feed']) < _EPSILON:
+                    continue
+                modal['feed'] = value
+            elif letter in 'XYZ':
+                k = 'XYZ'.index(letter)
+                if modal['absolute'] is not False:
+                    if line_motion in (0.0, 1.0) and position[k] is not None and abs(value - position[k]) < _EPSILON:
+                        continue
+                    position[k] = value
+                else:
+                    if line_motion in (0.0, 1.0) and abs(value) < _EPSILON:
+                        continue
+                    if position[k] is not None:
+                        position[k] += value
+            kept.append(token)
+        if line_motion != modal['motion']:
+            kept.insert(0, 'G%g' % line_motion)
+            modal['motion'] = line_motion
+
+        stats['words_removed'] += len(tokens) - len(kept)
+        if kept:
+            yield " ".join(kept)
+
+
+def optimize_pen_lifts(gcode: Union[str, Iterable[str]], max_gap: float = DEFAULT_MAX_GAP,
+                       z_pen_down: float = DEFAULT_Z_PEN_DOWN, z_pen_up: float = DEFAULT_Z_PEN_UP,
+                       compact: bool = True) -> tuple:
+    """
+    合并近距离的抬笔，并删除冗余的模态字，得到更短的程序
+
+    参数:
+        gcode: G-code 字符串、行列表或生成器
+        max_gap: 允许直接画过去的最大距离 (mm)，为 0 时不合并抬笔
+        z_pen_down, z_pen_up: 落笔/抬笔 Z 值
+        compact: 是否删除冗余的模态字和无效移动
+
+    返回:
+        (处理后的 G-code 行列表, 报告字典)
+        报告: {'lines_in', 'lines_out', 'lines_saved', 'pen_lifts_removed', 'words_removed', 'round_trips_saved'}
+        round_trips_saved 为少发送的有效行数，逐行发送时每行都要等 GRBL 回复一次 ok
+    """
+    lines = gcode.strip().split('\n') if isinstance(gcode, str) else gcode
+    counts = {'lines_in': 0, 'sent_in': 0}
+
+    def count(source):
+        for line in source:
+            if line.strip():
+                counts['lines_in'] += 1
+                if clean_line(line):
+                    counts['sent_in'] += 1
+            yield line
+
+    stats = {'words_removed': 0}
+    output = merge_pen_lifts(count(lines), max_gap, z_pen_down, z_pen_up, stats)
+    if compact:
+        output = compact_gcode(output, stats)
+    result = list(output)
+    sent_out = sum(1 for line in result if clean_line(line))
+    report = {
+        'lines_in': counts['lines_in'],
+        'lines_out': len(result),
+        'lines_saved': counts['lines_in'] - len(result),
+        'pen_lifts_removed': stats['pen_lifts_removed'],
+        'words_removed': stats['words_removed'],
+        'round_trips_saved': counts['sent_in'] - sent_out,
+    }
+    return result, report
@@ -0,0 +1,281 @@
+import math
+from typing import Dict, List, NamedTuple, Tuple, Union
+import numpy as np
+from app.core.gcode.parser import ParsedProgram, parse_gcode
+from app.core.gcode.text_to_gcode import DEFAULT_Z_PEN_DOWN, DEFAULT_Z_PEN_UP
+
+# GRBL 1.1 规划缓冲区的块数 (ATmega328p)
+DEFAULT_PLANNER_BLOCKS = 15
+# 规划器允许的最小拐角速度 (mm/s)，与 GRBL 的 MINIMUM_JUNCTION_SPEED 一致
+MINIMUM_JUNCTION_SPEED = 0.0
+# 没有设置 F 时 G1 使用的进给速度 (mm/min)；GRBL 实际会报 error:22，这里按较慢的速度估算
+FALLBACK_FEED_RATE = 100.0
+
+
+class MotionSettings(NamedTuple):
+    """估算用到的GRBL运动参数"""
+    max_rate: Tuple[float, float, float]        # $110-$112 各轴最大速度 (mm/min)，也是 G0 的速度
+    acceleration: Tuple[float, float, float]    # $120-$122 各轴加速度 (mm/s^2)
+    junction_deviation: float                   # $11 拐角偏差 (mm)
+    arc_tolerance: float                        # $12 圆弧细分误差 (mm)
+
+    @classmethod
+    def from_grbl_settings(cls, settings: Dict[int, float]):
+        """
+        由 GRBLController.get_grbl_settings() 返回的 {编号: 数值} 构造，缺少的项使用 GRBL 默认值
+        """
+        default = DEFAULT_MOTION_SETTINGS
+        return cls(
+            max_rate=tuple(settings.get(110 + k, default.max_rate[k]) for k in range(3)),
+            acceleration=tuple(settings.get(120 + k, default.acceleration[k]) for k in range(3)),
+            junction_deviation=settings.get(11, default.junction_deviation),
+            arc_tolerance=settings.get(12, default.arc_tolerance),
+        )
+
+
+# GRBL 1.1 的出厂默认值
+DEFAULT_MOTION_SETTINGS = MotionSettings(
+    max_rate=(500.0, 500.0, 500.0),
+    acceleration=(10.0, 10.0, 10.0),
+    junction_deviation=0.01,
+    arc_tolerance=0.002,
+)
+
+
+class SegmentTiming(NamedTuple):
+    """一行移动的估算结果"""
+    line_number: int       # 在原程序中的行号
+    length: float          # 移动距离 (mm)
+    time: float            # 估算用时 (s)
+    pen_down: bool         # 是否落笔书写
+
+
+def _arc_points(block, arc_tolerance: float) -> np.ndarray:
+    """
+    按 GRBL 的方式把 XY 平面圆弧细分为折线 (mc_arc)：每段弦的弓高不超过 arc_tolerance
+
+    返回:
+        细分后的点（不含起点），N x 3
+    """
+    x0, y0, z0 = block.start
+    x1, y1, z1 = block.end
+    cx, cy = block.center
+    radius = math.hypot(x0 - cx, y0 - cy)
+    a0 = math.atan2(y0 - cy, x0 - cx)
+    a1 = math.atan2(y1 - cy, x1 - cx)
+    clockwise = block.motion == 'G2'
+    sweep = a1 - a0
+    if clockwise:
+        if sweep >= -1e-9:
+            sweep -= 2 * math.pi
+    elif sweep <= 1e-9:
+        sweep += 2 * math.pi
+    if radius <= arc_tolerance:
+        segments = 1
+    else:
+        segments = max(1, int(abs(sweep) * radius / math.sqrt(arc_tolerance * (2 * radius - arc_tolerance))))
+    t = np.arange(1, segments + 1) / segments
+    angles = a0 + sweep * t
+    points = np.column_stack([cx + radius * np.cos(angles), cy + radius * np.sin(angles), z0 + (z1 - z0) * t])
+    points[-1] = (x1, y1, z1)
+    return points
+
+
+def _trapezoid_times(lengths, entry, exit_, nominal, accel):
+    """梯形速度曲线下每段的用时，速度单位 mm/s（向量化）"""
+    accelerate = (nominal ** 2 - entry ** 2) / (2 * accel)
+    decelerate = (nominal ** 2 - exit_ ** 2) / (2 * accel)
+    cruise = lengths - accelerate - decelerate
+    # 距离不足以加速到额定速度时为三角形曲线
+    peak = np.sqrt(np.maximum((2 * accel * lengths + entry ** 2 + exit_ ** 2) / 2, 0.0))
+    peak = np.minimum(peak, nominal)
+    triangle = (peak - entry) / accel + (peak - exit_) / accel
+    trapezoid = (nominal - entry) / accel + (nominal - exit_) / accel + np.maximum(cruise, 0.0) / np.maximum(nominal, 1e-9)
+    return np.where(cruise > 0, trapezoid, triangle)
+
+
+def estimate_gcode(gcode: Union[str, List[str], ParsedProgram], settings: Union[MotionSettings, Dict[int, float]] = None,
+                   start: Tuple[float, float, float] = (0.0, 0.0, 0.0),
+                   z_pen_down: float = DEFAULT_Z_PEN_DOWN, z_pen_up: float = DEFAULT_Z_PEN_UP,
+                   planner_blocks: int = DEFAULT_PLANNER_BLOCKS, per_segment: bool = True) -> dict:
+    """
+    估算 G-code 程序的执行时间和移动距离
+
+    按 GRBL 规划器的方式模拟：每段直线（圆弧先按 $12 细分）的额定速度受 F 和各轴最大速度限制，
+    加速度受各轴加速度限制；相邻两段之间的拐角速度由拐角偏差 ($11) 决定；
+    每段的入口速度还要保证在规划缓冲区 (planner_blocks 段) 内能减速到 0，
+    然后前后两遍求出每段的入口/出口速度，按梯形速度曲线计算用时。
+
+    参数:
+        gcode: G-code 字符串、行列表或 parse_gcode 返回的 ParsedProgram
+        settings: MotionSettings 或 get_grbl_settings() 返回的 {编号: 数值}，默认使用GRBL出厂设置
+        start: 开始时的位置 (mm)，gcode 已经是 ParsedProgram 时不使用
+        z_pen_down, z_pen_up: 落笔/抬笔 Z 值，Z 更接近落笔值的 XY 移动计为书写
+        planner_blocks: 规划缓冲区块数
+        per_segment: 是否返回每行的用时
+
+    返回:
+        {
+            'total_time_s': 总用时,
+            'motion_time_s': 移动用时,
+            'dwell_time_s': G4 暂停用时,
+            'pen_down_mm': 落笔书写距离,
+            'pen_up_mm': 抬笔空程距离,
+            'pen_down_time_s': 书写用时,
+            'pen_up_time_s': 空程用时（含抬笔/落笔的 Z 轴移动）,
+            'z_mm': Z 轴移动距离,
+            'pen_lifts': 抬笔次数,
+            'segments': [SegmentTiming, ...]（per_segment 为 False 时为 None）
+        }
+    """
+    if settings is None:
+        settings = DEFAULT_MOTION_SETTINGS
+    elif not isinstance(settings, MotionSettings):
+        settings = MotionSettings.from_grbl_settings(settings)
+    if isinstance(gcode, ParsedProgram):
+        program = gcode
+    else:
+        if isinstance(gcode, str):
+            gcode = gcode.strip().split('\n')
+        program = parse_gcode(gcode, start=start)
+
+    pen_threshold = (z_pen_down + z_pen_up) / 2
+    pen_down_below = z_pen_down < z_pen_up
+
+    def is_down(z):
+        return z <= pen_threshold if pen_down_below else z >= pen_threshold
+
+    # 1. 展开为直线段
+    points = [program.start]
+    owners = []        # 每段所属的行在 motion_blocks 中的下标
+    feeds = []         # 每段的请求速度 (mm/min)，G0 为 inf
+    motion_blocks = []
+    dwell = 0.0
+    pen_lifts = 0
+    for block in program.blocks:
+        if 4.0 in block.gcodes:
+            dwell += block.words.get('P', 0.0)
+        if block.motion is None:
+            continue
+        if block.start != points[-1]:
+            # G92 等改变了坐标，从新的位置继续
+            points.append(block.start)
+            owners.append(-1)
+            feeds.append(math.inf)
+        index = len(motion_blocks)
+        motion_blocks.append(block)
+        if is_down(block.start[2]) and not is_down(block.end[2]):
+            pen_lifts += 1
+        rate = math.inf if block.motion == 'G0' else (block.feed or FALLBACK_FEED_RATE)
+        if block.center is not None:
+            arc = _arc_points(block, settings.arc_tolerance)
+            points.extend(map(tuple, arc))
+            owners.extend([index] * len(arc))
+            feeds.extend([rate] * len(arc))
+        else:
+            points.append(block.end)
+            owners.append(index)
+            feeds.append(rate)
+
+    result = {
+        'total_time_s': dwell,
+        'motion_time_s': 0.0,
+        'dwell_time_s': dwell,
+        'pen_down_mm': 0.0,
+        'pen_up_mm': 0.0,
+        'pen_down_time_s': 0.0,
+        'pen_up_time_s': 0.0,
+        'z_mm': 0.0,
+        'pen_lifts': pen_lifts,
+        'segments': [] if per_segment else None,
+    }
+    if not owners:
+        return result
+
+    points = np.array(points, dtype=np.float64)
+    owners = np.array(owners)
+    feeds = np.array(feeds, dtype=np.float64) / 60.0
+    deltas = np.diff(points, axis=0)
+    lengths = np.sqrt((deltas ** 2).sum(axis=1))
+    # 坐标跳变（owner 为 -1）和零长度的段不产生移动
+    moving = (owners >= 0) & (lengths > 1e-9)
+    deltas, lengths, feeds, owners = deltas[moving], lengths[moving], feeds[moving], owners[moving]
+    starts = points[:-1][moving]
+    if not len(lengths):
+        return result
+    units = deltas / lengths[:, None]
+
+    # 2. 每段的额定速度和加速度（受各轴限制）
+    max_rate = np.array(settings.max_rate, dtype=np.float64) / 60.0
+    acceleration = np.array(settings.acceleration, dtype=np.float64)
+    abs_units = np.abs(units)
+    with np.errstate(divide='ignore'):
+        axis_rate = np.where(abs_units > 1e-12, max_rate / abs_units, np.inf).min(axis=1)
+        accel = np.where(abs_units > 1e-12, acceleration / abs_units, np.inf).min(axis=1)
+    nominal = np.minimum(feeds, axis_rate)
+
+    # 3. 拐角速度，与 GRBL planner 的 junction deviation 公式一致
+    n = len(lengths)
+    junction = np.full(n, MINIMUM_JUNCTION_SPEED)   # 第 0 段从静止开始
+    if n > 1:
+        cos_theta = -(units[1:] * units[:-1]).sum(axis=1)
+        cos_theta = np.clip(cos_theta, -1.0, 1.0)
+        sin_half = np.sqrt(np.maximum(0.5 * (1.0 - cos_theta), 0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v2 = accel[1:] * settings.junction_deviation * sin_half / (1.0 - sin_half)
+        v2 = np.where(cos_theta > 0.999999, MINIMUM_JUNCTION_SPEED ** 2, v2)   # 原路折返
+        v2 = np.where(cos_theta < -0.999999, np.inf, v2)                         # 直线延续
+        junction[1:] = np.sqrt(v2)
+    # 入口速度不超过前后两段的额定速度
+    max_entry = junction.copy()
+    max_entry[1:] = np.minimum(max_entry[1:], np.minimum(nominal[1:], nominal[:-1]))
+    max_entry[0] = 0.0
+    # 规划缓冲区只有 planner_blocks 段，入口速度必须保证在缓冲区内的距离上能减速停下
+    cumulative = np.concatenate([[0.0], np.cumsum(lengths)])
+    ahead = cumulative[np.minimum(np.arange(n) + planner_blocks, n)] - cumulative[:n]
+    max_entry = np.minimum(max_entry, np.sqrt(2 * accel * ahead))
+
+    # 4. 反向、正向两遍，求可达的入口/出口速度
+    entry = max_entry.tolist()
+    lengths_list = lengths.tolist()
+    accel_list = accel.tolist()
+    next_entry = 0.0  # 程序结束时停止
+    for i in range(n - 1, -1, -1):
+        limit = math.sqrt(next_entry * next_entry + 2 * accel_list[i] * lengths_list[i])
+        if entry[i] > limit:
+            entry[i] = limit
+        next_entry = entry[i]
+    for i in range(n - 1):
+        limit = math.sqrt(entry[i] * entry[i] + 2 * accel_list[i] * lengths_list[i])
+        if entry[i + 1] > limit:
+            entry[i + 1] = limit
+    entry = np.array(entry)
+    exit_ = np.append(entry[1:], 0.0)
+    times = _trapezoid_times(lengths, entry, exit_, nominal, accel)
+
+    # 5. 汇总
+    xy_lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+    z0 = starts[:, 2]
+    z1 = z0 + deltas[:, 2]
+    if pen_down_below:
+        down = (z0 <= pen_threshold) & (z1 <= pen_threshold)
+    else:
+        down = (z0 >= pen_threshold) & (z1 >= pen_threshold)
+    motion_time = float(times.sum())
+    result['motion_time_s'] = motion_time
+    result['total_time_s'] = motion_time + dwell
+    result['pen_down_mm'] = float(xy_lengths[down].sum())
+    result['pen_up_mm'] = float(xy_lengths[~down].sum())
+    result['pen_down_time_s'] = float(times[down].sum())
+    result['pen_up_time_s'] = float(times[~down].sum())
+    result['z_mm'] = float(np.abs(deltas[:, 2]).sum())
+    if per_segment:
+        block_lengths = np.bincount(owners, weights=lengths, minlength=len(motion_blocks))
+        block_times = np.bincount(owners, weights=times, minlength=len(motion_blocks))
+        block_down = np.zeros(len(motion_blocks), dtype=bool)
+        block_down[owners] = down
+        result['segments'] = [
+            SegmentTiming(block.line_number, float(length), float(t), bool(d))
+            for block, length, t, d in zip(motion_blocks, block_lengths, block_times, block_down)
+        ]
+    return result
@@ -0,0 +1,290 @@
+import math
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# 一个 G-code 字：字母 + 数值
+_WORD_PATTERN = re.compile(r"([A-Z])\s*([-+]?\d*\.?\d+)")
+_COMMENT_PATTERN = re.compile(r"\(.*?\)")
+
+MM_PER_INCH = 25.4
+
+# 坐标字不表示普通移动终点的 G 代码：G4 暂停、G10 设置坐标系、G28/G30 回参考点（坐标为途经点）、
+# G28.1/G30.1 记录位置、G92 设置当前坐标
+_NON_MOTION_AXIS_CODES = {4.0, 10.0, 28.0, 28.1, 30.0, 30.1, 92.0}
+# 运动模态
+_MOTION_CODES = {0.0, 1.0, 2.0, 3.0, 38.2, 38.3, 38.4, 38.5, 80.0}
+_MOTION_NAMES = {0.0: 'G0', 1.0: 'G1', 2.0: 'G2', 3.0: 'G3'}
+
+
+def strip_comment(line: str) -> str:
+    """去掉行内的 ( ) 注释和 ; 之后的注释"""
+    if '(' not in line and ';' not in line:
+        return line
+    return _COMMENT_PATTERN.sub("", line.split(';', 1)[0]).strip()
+
+
+def clean_line(line: str) -> str:
+    """去掉注释和首尾空白，得到实际发送给 GRBL 的内容；整行都是注释或 '%' 时返回空字符串"""
+    line = strip_comment(line).strip()
+    if line.startswith('%'):
+        return ""
+    return line
+
+
+def _scan_words(text: str) -> Tuple[List[float], Dict[str, float]]:
+    """
+    把已去掉注释的一行拆成字
+
+    生成的程序中字之间都有空格，先按空格切分直接转换数值；
+    遇到 "G1X10" 这类不带空格或字母与数值分开的写法时，再用正则表达式解析整行。
+    """
+    text = text.upper()
+    gcodes = []
+    words = {}
+    try:
+        for token in text.split():
+            letter = token[0]
+            value = token[1:]
+            # float() 还接受 nan/inf/1e5/1_0 等写法，这些交给正则表达式按 G-code 规则解析
+            if not ('A' <= letter <= 'Z') or not value.lstrip('+-').replace('.', '', 1).isdigit():
+                raise ValueError(token)
+            if letter == 'G':
+                gcodes.append(float(value))
+            else:
+                words[letter] = float(value)
+        return gcodes, words
+    except ValueError:
+        pass
+    gcodes = []
+    words = {}
+    for letter, value in _WORD_PATTERN.findall(text):
+        if letter == 'G':
+            gcodes.append(float(value))
+        else:
+            words[letter] = float(value)
+    return gcodes, words
+
+
+def parse_words(line: str) -> Tuple[List[float], Dict[str, float]]:
+    """
+    解析一行 G-code 的字
+
+    返回:
+        (G 代码列表, 其它字 {字母: 数值})
+    """
+    return _scan_words(strip_comment(line))
+
+
+def arc_center(start: Tuple[float, float], end: Tuple[float, float], words: Dict[str, float],
+               clockwise: bool, scale: float = 1.0) -> Optional[Tuple[float, float]]:
+    """
+    计算 XY 平面圆弧的圆心
+
+    参数:
+        start, end: 起点和终点 (mm)
+        words: 该行的字，使用 I/J（圆心相对起点的偏移）或 R（半径，负值表示大于半圆的圆弧）
+        clockwise: G2 为 True
+        scale: 把 I/J/R 换算为毫米的比例（英制单位时为 25.4）
+
+    返回:
+        圆心坐标，R 格式下半径不足以连接起点和终点时返回 None
+    """
+    if 'R' not in words:
+        return start[0] + words.get('I', 0.0) * scale, start[1] + words.get('J', 0.0) * scale
+    radius = words['R'] * scale
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    chord = math.hypot(dx, dy)
+    if chord == 0 or abs(radius) < chord / 2 - 1e-9:
+        return None
+    h = math.sqrt(max(radius * radius - chord * chord / 4, 0.0))
+    # 圆心在弦中垂线上；顺时针小圆弧的圆心在弦的右侧
+    side = -1.0 if clockwise else 1.0
+    if radius < 0:
+        side = -side
+    mx, my = (start[0] + end[0]) / 2, (start[1] + end[1]) / 2
+    return mx - side * h * dy / chord, my + side * h * dx / chord
+
+
+def arc_extents(start: Tuple[float, float], end: Tuple[float, float], center: Tuple[float, float],
+                clockwise: bool) -> Tuple[float, float, float, float]:
+    """
+    计算 XY 平面圆弧的外接矩形
+
+    除了起点和终点，圆弧经过 0°/90°/180°/270° 方向时，对应的圆上最外侧的点也在范围内。
+    起点与终点重合时视为整圆。
+
+    返回:
+        (min_x, min_y, max_x, max_y)
+    """
+    cx, cy = center
+    radius = math.hypot(start[0] - cx, start[1] - cy)
+    a0 = math.atan2(start[1] - cy, start[0] - cx)
+    a1 = math.atan2(end[1] - cy, end[0] - cx)
+    if clockwise:
+        a0, a1 = a1, a0  # 统一为从 a0 逆时针转到 a1
+    sweep = (a1 - a0) % (2 * math.pi)
+    if sweep < 1e-12:
+        sweep = 2 * math.pi
+    xs = [start[0], end[0]]
+    ys = [start[1], end[1]]
+    for k, (px, py) in enumerate(((cx + radius, cy), (cx, cy + radius), (cx - radius, cy), (cx, cy - radius))):
+        if (k * math.pi / 2 - a0) % (2 * math.pi) <= sweep:
+            xs.append(px)
+            ys.append(py)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+class GCodeBlock:
+    """解析后的一行 G-code"""
+
+    __slots__ = ('line_number', 'text', 'gcodes', 'words', 'motion', 'start', 'end', 'center', 'extents', 'feed')
+
+    def __init__(self, line_number, text, gcodes, words):
+        self.line_number = line_number  # 在原程序中的行号（从 1 开始）
+        self.text = text                # 去掉注释后实际发送的内容
+        self.gcodes = gcodes            # 该行的 G 代码
+        self.words = words              # 其它字 {字母: 数值}，单位与程序一致
+        self.motion = None              # 该行产生的移动: 'G0'/'G1'/'G2'/'G3'，没有移动时为 None
+        self.start = None               # 移动起点 (x, y, z)，单位 mm
+        self.end = None                 # 移动终点 (x, y, z)，单位 mm
+        self.center = None              # 圆弧圆心 (x, y)，单位 mm
+        self.extents = None             # 移动经过的 XY 范围 (min_x, min_y, max_x, max_y)
+        self.feed = None                # 该行生效的进给速度 (mm/min)，还没有设置过 F 时为 None
+
+    def __repr__(self):
+        return f"GCodeBlock({self.line_number}, {self.text!r})"
+
+
+class ParsedProgram:
+    """
+    解析后的 G-code 程序
+
+    只保留有实际内容的行（注释行和空行被去掉），每行记录了原行号、发送内容和模拟得到的移动；
+    边界检查和发送都直接使用这里的结果，不再重复解析。
+    """
+
+    def __init__(self, blocks: List[GCodeBlock], start, end, extents, errors):
+        self.blocks = blocks
+        self.start = start        # 模拟的起始位置 (x, y, z)
+        self.end = end            # 程序结束时的位置 (x, y, z)
+        self.extents = extents    # 所有移动经过的 XY 范围 (min_x, min_y, max_x, max_y)，没有移动时为 None
+        self.errors = errors      # 无法解析的行 [(行号, 内容, 原因), ...]
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __iter__(self) -> Iterator[GCodeBlock]:
+        return iter(self.blocks)
+
+    def lines(self) -> List[str]:
+        """要发送的行"""
+        return [block.text for block in self.blocks]
+
+    def motions(self) -> Iterator[GCodeBlock]:
+        """产生移动的行"""
+        return (block for block in self.blocks if block.motion is not None)
+
+
+def parse_gcode(gcode: Union[str, Iterable[str]], start: Tuple[float, float, float] = (0.0, 0.0, 0.0)) -> ParsedProgram:
+    """
+    一次遍历解析整个 G-code 程序，并模拟执行过程中的位置
+
+    跟踪的模态: 运动模式 (G0/G1/G2/G3)、坐标模式 (G90/G91)、单位 (G20/G21)、平面 (G17/G18/G19)。
+    坐标统一换算为毫米；G92 会把当前位置设为给定值，之后的绝对坐标以此为准。
+    只计算 XY 平面 (G17) 的圆弧范围，其它平面的圆弧只按端点计算。
+
+    参数:
+        gcode: G-code 字符串、行列表或生成器
+        start: 开始时的位置 (mm)
+
+    返回:
+        ParsedProgram
+    """
+    lines = gcode.split('\n') if isinstance(gcode, str) else gcode
+    blocks = []
+    errors = []
+    position = tuple([float(v) for v in start] + [0.0] * (3 - len(start)))
+    start = position
+    absolute = True
+    scale = 1.0                   # 单位换算比例，G20 时为 25.4
+    plane = 17
+    motion = 0.0                  # 当前运动模态，GRBL 上电默认为 G0
+    feed = None                   # 当前进给速度 (mm/min)
+    min_x = min_y = math.inf
+    max_x = max_y = -math.inf
+
+    for line_number, raw in enumerate(lines, start=1):
+        text = clean_line(raw)
+        if not text:
+            continue
+        gcodes, words = _scan_words(text)
+        block = GCodeBlock(line_number, text, gcodes, words)
+        blocks.append(block)
+
+        non_motion = False
+        for code in gcodes:
+            if code == 90.0:
+                absolute = True
+            elif code == 91.0:
+                absolute = False
+            elif code == 20.0:
+                scale = MM_PER_INCH
+            elif code == 21.0:
+                scale = 1.0
+            elif code in (17.0, 18.0, 19.0):
+                plane = int(code)
+            elif code in _MOTION_CODES:
+                motion = None if code == 80.0 else code
+            elif code in _NON_MOTION_AXIS_CODES:
+                non_motion = code
+        if 'F' in words:
+            feed = words['F'] * scale
+        block.feed = feed
+        has_axis = 'X' in words or 'Y' in words or 'Z' in words
+        if not has_axis:
+            continue
+        if non_motion is not False:
+            if non_motion == 92.0:
+                position = tuple(words[axis] * scale if axis in words else position[k] for k, axis in enumerate('XYZ'))
+            continue
+        if motion is None:
+            errors.append((line_number, text, "没有有效的运动模式"))
+            continue
+
+        x0, y0, z0 = position
+        if absolute:
+            x1 = words['X'] * scale if 'X' in words else x0
+            y1 = words['Y'] * scale if 'Y' in words else y0
+            z1 = words['Z'] * scale if 'Z' in words else z0
+        else:
+            x1 = x0 + words.get('X', 0.0) * scale
+            y1 = y0 + words.get('Y', 0.0) * scale
+            z1 = z0 + words.get('Z', 0.0) * scale
+        position = (x1, y1, z1)
+        block.start = (x0, y0, z0)
+        block.end = position
+        block.motion = _MOTION_NAMES.get(motion) or 'G%g' % motion
+        center = None
+        if (motion == 2.0 or motion == 3.0) and plane == 17:
+            center = arc_center((x0, y0), (x1, y1), words, motion == 2.0, scale)
+            if center is None:
+                errors.append((line_number, text, "圆弧半径不足以连接起点和终点"))
+        if center is not None:
+            block.center = center
+            lo_x, lo_y, hi_x, hi_y = arc_extents((x0, y0), (x1, y1), center, motion == 2.0)
+        else:
+            # 直线移动，逐项比较比 min/max 快，百万行程序时差别明显
+            lo_x, hi_x = (x0, x1) if x0 < x1 else (x1, x0)
+            lo_y, hi_y = (y0, y1) if y0 < y1 else (y1, y0)
+        block.extents = (lo_x, lo_y, hi_x, hi_y)
+        if lo_x < min_x:
+            min_x = lo_x
+        if lo_y < min_y:
+            min_y = lo_y
+        if hi_x > max_x:
+            max_x = hi_x
+        if hi_y > max_y:
+            max_y = hi_y
+
+    extents = (min_x, min_y, max_x, max_y) if min_x <= max_x else None
+    return ParsedProgram(blocks, start, position, extents, errors)
@@ -0,0 +1,257 @@
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from app.core.gcode.parser import MM_PER_INCH, parse_words
+
+# 默认简化容差 (mm)，远小于笔迹宽度，肉眼看不出差别
+DEFAULT_TOLERANCE = 0.05
+# 坐标字不表示移动终点的 G 代码，这些行不补运动指令
+_NON_MOTION_AXIS_CODES = {4.0, 10.0, 28.0, 28.1, 30.0, 30.1, 92.0}
+# 半径超过该值 (mm) 的圆弧按直线处理
+MAX_ARC_RADIUS = 500.0
+# 拟合圆弧时每段原始线段最多对应的圆心角，转角更大的点更像拐角而不是曲线
+MAX_SEGMENT_SWEEP = np.pi / 4
+# 拟合圆弧至少需要的点数（三段线段），三个点总能确定一个圆，拐角也会被当成圆弧
+MIN_ARC_POINTS = 4
+
+
+def rdp(points: np.ndarray, tolerance: float) -> List[int]:
+    """
+    Ramer–Douglas–Peucker 折线简化
+
+    参数:
+        points: N x 2 坐标数组
+        tolerance: 允许的最大偏差
+
+    返回:
+        保留的点的下标（升序，包含首尾）
+    """
+    n = len(points)
+    if n < 3:
+        return list(range(n))
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[start + 1:end]
+        a, b = points[start], points[end]
+        dx, dy = b - a
+        length = np.hypot(dx, dy)
+        if length < 1e-12:
+            distances = np.hypot(segment[:, 0] - a[0], segment[:, 1] - a[1])
+        else:
+            distances = np.abs(dx * (segment[:, 1] - a[1]) - dy * (segment[:, 0] - a[0])) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.nonzero(keep)[0].tolist()
+
+
+def _circle_through(p0, p1, p2) -> Optional[Tuple[float, float, float]]:
+    """三点确定的圆 (圆心x, 圆心y, 半径)，三点共线时返回 None"""
+    ax, ay = p0
+    bx, by = p1
+    cx, cy = p2
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-12:
+        return None
+    ux = ((ax * ax + ay * ay) * (by - cy) + (bx * bx + by * by) * (cy - ay) + (cx * cx + cy * cy) * (ay - by)) / d
+    uy = ((ax * ax + ay * ay) * (cx - bx) + (bx * bx + by * by) * (ax - cx) + (cx * cx + cy * cy) * (bx - ax)) / d
+    return ux, uy, float(np.hypot(ax - ux, ay - uy))
+
+
+def _fit_arc(points: np.ndarray, tolerance: float) -> Optional[Tuple[float, float, bool]]:
+    """
+    检查一段点是否可以用一段圆弧表示
+
+    圆由首点、中点和尾点确定；所有点到圆的径向偏差不超过 tolerance，且点沿同一方向绕圆心前进、总转角小于一周。
+    相邻两点之间圆弧相对原线段的拱高也不能超过 tolerance，每段的圆心角不超过 MAX_SEGMENT_SWEEP，
+    否则直角拐角、U 形等少量点的折线会被替换成明显偏离原路径的圆弧。
+
+    返回:
+        (圆心x, 圆心y, 是否顺时针)，不能拟合时返回 None
+    """
+    if len(points) < MIN_ARC_POINTS:
+        return None
+    circle = _circle_through(points[0], points[len(points) // 2], points[-1])
+    if circle is None:
+        return None
+    cx, cy, radius = circle
+    if radius > MAX_ARC_RADIUS or radius < tolerance:
+        return None
+    offsets = points - (cx, cy)
+    if np.abs(np.hypot(offsets[:, 0], offsets[:, 1]) - radius).max() > tolerance:
+        return None
+    # 相邻两点相对圆心的转角方向必须一致
+    cross = offsets[:-1, 0] * offsets[1:, 1] - offsets[:-1, 1] * offsets[1:, 0]
+    dot = (offsets[:-1] * offsets[1:]).sum(axis=1)
+    angles = np.arctan2(cross, dot)
+    moving = np.abs(angles) > 1e-9
+    if not moving.any():
+        return None
+    clockwise = angles[moving][0] < 0
+    if (angles[moving] < 0).any() if not clockwise else (angles[moving] > 0).any():
+        return None
+    if abs(angles.sum()) >= 2 * np.pi - 1e-6:
+        return None
+    if np.abs(angles).max() > MAX_SEGMENT_SWEEP:
+        return None
+    # 拱高: 圆弧在每段弦上鼓出的距离
+    chords = np.hypot(*np.diff(points, axis=0).T)
+    sagitta = radius - np.sqrt(np.maximum(radius * radius - chords * chords / 4, 0.0))
+    if sagitta.max() > tolerance:
+        return None
+    return cx, cy, bool(clockwise)
+
+
+def simplify_polyline(points: np.ndarray, tolerance: float, fit_arcs: bool = True) -> List[tuple]:
+    """
+    简化一条折线，并在可能的地方用圆弧代替多段直线
+
+    参数:
+        points: N x 2 坐标数组 (mm)，第一个点为当前位置
+        tolerance: 允许的最大偏差 (mm)，原始点到结果路径的距离不超过该值
+        fit_arcs: 是否拟合圆弧
+
+    返回:
+        移动列表，不含起点: ('G1', x, y) 或 ('G2'/'G3', x, y, i, j)
+    """
+    keep = rdp(points, tolerance)
+    moves = []
+    k = 0
+    while k < len(keep) - 1:
+        best = None
+        if fit_arcs:
+            # 贪心地把尽可能多的 RDP 顶点合并为一段圆弧，至少替换两段直线；原始点不足时 _fit_arc 不拟合
+            end = k + 2
+            while end < len(keep):
+                arc = _fit_arc(points[keep[k]:keep[end] + 1], tolerance)
+                if arc is None:
+                    break
+                best = (end, arc)
+                end += 1
+        if best is not None:
+            end, (cx, cy, clockwise) = best
+            start_point = points[keep[k]]
+            x, y = points[keep[end]]
+            moves.append(('G2' if clockwise else 'G3', x, y, cx - start_point[0], cy - start_point[1]))
+            k = end
+        else:
+            x, y = points[keep[k + 1]]
+            moves.append(('G1', x, y))
+            k += 1
+    return moves
+
+
+def simplify_gcode(lines: Iterable[str], tolerance: float = DEFAULT_TOLERANCE, fit_arcs: bool = True,
+                   stats: dict = None) -> Iterator[str]:
+    """
+    G-code 后处理：合并连续的 G1 直线移动（RDP 简化 + G2/G3 圆弧拟合），逐行产出
+
+    只缓存当前这一段连续的 G1 移动，可以直接串在 text_to_gcode 后面流式处理。
+    其它指令原样输出；相对坐标 (G91) 下的移动不做处理。英制单位 (G20) 下容差换算为英寸。
+
+    参数:
+        lines: G-code 行（字符串列表或生成器）
+        tolerance: 允许的最大偏差 (mm)
+        fit_arcs: 是否拟合圆弧
+        stats: 可选的统计字典，处理结束后写入 {'lines_in', 'lines_out', 'arcs'}
+
+    产出:
+        简化后的 G-code 行
+    """
+    if stats is None:
+        stats = {}
+    stats.update({'lines_in': 0, 'lines_out': 0, 'arcs': 0})
+    position = (0.0, 0.0)
+    absolute = True
+    scale = 1.0             # 单位换算比例，G20 时为 25.4
+    motion = None           # 原程序中的模态运动指令
+    emitted_motion = None   # 已输出程序中的模态运动指令
+    run: List[Tuple[float, float]] = []   # 当前连续 G1 段的点，第一个点为起点
+    run_feed = None
+
+    def flush_run():
+        nonlocal emitted_motion
+        if len(run) < 2:
+            return
+        moves = simplify_polyline(np.array(run, dtype=np.float64), tolerance / scale, fit_arcs)
+        current = run[0]
+        for n, move in enumerate(moves):
+            feed = f" F{run_feed:g}" if n == 0 and run_feed is not None else ""
+            if move[0] == 'G1':
+                yield f"G1 X{move[1]:.3f} Y{move[2]:.3f}{feed}"
+            else:
+                # I/J 相对于输出后（保留三位小数）的起点计算，保证 GRBL 校验圆弧半径时误差足够小
+                cx = current[0] + move[3]
+                cy = current[1] + move[4]
+                sx, sy = round(current[0], 3), round(current[1], 3)
+                yield f"{move[0]} X{move[1]:.3f} Y{move[2]:.3f} I{cx - sx:.3f} J{cy - sy:.3f}{feed}"
+                stats['arcs'] += 1
+            emitted_motion = move[0]
+            current = (move[1], move[2])
+            stats['lines_out'] += 1
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        stats['lines_in'] += 1
+        gcodes, words = parse_words(line)
+        codes = set(gcodes)
+        if 90.0 in codes:
+            absolute = True
+        if 91.0 in codes:
+            absolute = False
+        for code in gcodes:
+            if code in (0.0, 1.0, 2.0, 3.0):
+                motion = f"G{int(code)}"
+
+        is_linear = (
+            absolute and motion == 'G1' and ('X' in words or 'Y' in words)
+            and not (set(words) - {'X', 'Y', 'F'}) and not (codes - {1.0, 90.0})
+        )
+        if is_linear:
+            feed = words.get('F')
+            if run and feed is not None and feed != run_feed:
+                # 进给速度变化，结束当前段
+                last = run[-1]
+                yield from flush_run()
+                run.clear()
+                run.append(last)
+            if not run:
+                run.append(position)
+            if len(run) == 1:
+                run_feed = feed
+            position = (words.get('X', position[0]), words.get('Y', position[1]))
+            run.append(position)
+            continue
+
+        yield from flush_run()
+        run.clear()
+        run_feed = None
+        # 单位在当前段输出之后才切换，G20/G21 不会出现在连续 G1 段内
+        if 20.0 in codes:
+            scale = MM_PER_INCH
+        elif 21.0 in codes:
+            scale = 1.0
+        # 原行依赖模态运动指令，而输出中的模态已经被圆弧改变时，补上运动指令；
+        # 只有 Z 的行也要补，否则会按 G2/G3 执行（GRBL 会报错）。G92 等坐标字另有含义的行不能加运动指令
+        if ('X' in words or 'Y' in words or 'Z' in words) and not (codes & {0.0, 1.0, 2.0, 3.0}) \
+                and not (codes & _NON_MOTION_AXIS_CODES) and motion is not None and motion != emitted_motion:
+            line = f"{motion} {line}"
+        if codes & {0.0, 1.0, 2.0, 3.0}:
+            emitted_motion = motion
+        if 'X' in words or 'Y' in words:
+            if absolute:
+                position = (words.get('X', position[0]), words.get('Y', position[1]))
+            else:
+                position = (position[0] + words.get('X', 0.0), position[1] + words.get('Y', 0.0))
+        yield line
+        stats['lines_out'] += 1
+    yield from flush_run()
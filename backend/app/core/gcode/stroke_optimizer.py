@@ -0,0 +1,381 @@
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+from app.core.gcode.text_to_gcode import DEFAULT_Z_PEN_DOWN, DEFAULT_Z_PEN_UP, CELL_COMMENT_PATTERN
+from app.core.gcode.parser import parse_words
+
+# 抬笔快速移动的估算速度 (mm/min)，用于估算节省的时间
+DEFAULT_RAPID_RATE = 3000
+# 2-opt 优化的默认时间上限（秒）
+DEFAULT_TIME_LIMIT = 0.2
+# 坐标字不表示移动终点的 G 代码（G92 的坐标即设置后的当前位置）
+_NON_MOTION_AXIS_CODES = {4.0, 10.0, 28.0, 28.1, 30.0, 30.1, 92.0}
+
+
+
+class _Stroke:
+    """一段落笔笔画：落笔 -> 若干书写移动 -> 抬笔"""
+
+    def __init__(self, start, pen_down_line, cell, feed):
+        self.start = start
+        self.end = start
+        self.pen_down_line = pen_down_line
+        self.pen_up_line = None
+        self.cell = cell
+        self.feed = feed          # 第一段书写移动时生效的进给速度
+        self.end_feed = feed      # 笔画结束时生效的进给速度
+        self.lines = []           # 原始书写行
+        self.moves = []           # (G 代码, 终点, 圆弧参数 {I, J} 或 {R})
+        self.reversible = True
+
+    def emit(self, reverse: bool, current_feed: Optional[float]) -> List[str]:
+        """生成本笔画的 G-code 行（不含前面的空程移动）"""
+        lines = [self.pen_down_line]
+        if not reverse:
+            body = list(self.lines)
+            if body and self.feed is not None and self.feed != current_feed and 'F' not in parse_words(body[0])[1]:
+                body[0] = f"{body[0]} F{self.feed:g}"
+            lines.extend(body)
+        else:
+            points = [self.start] + [end for _, end, _ in self.moves]
+            for k in range(len(self.moves) - 1, -1, -1):
+                gcode, _, arc = self.moves[k]
+                target = points[k]
+                if gcode in (2.0, 3.0):
+                    code = "G3" if gcode == 2.0 else "G2"
+                    if 'R' in arc:
+                        arc_words = f" R{arc['R']:.3f}"
+                    else:
+                        # 圆心不变，新的 I/J 相对于反向后的起点（原来的终点）
+                        center = (points[k][0] + arc.get('I', 0.0), points[k][1] + arc.get('J', 0.0))
+                        new_start = points[k + 1]
+                        arc_words = f" I{center[0] - new_start[0]:.3f} J{center[1] - new_start[1]:.3f}"
+                    line = f"{code} X{target[0]:.3f} Y{target[1]:.3f}{arc_words}"
+                else:
+                    line = f"G1 X{target[0]:.3f} Y{target[1]:.3f}"
+                if k == len(self.moves) - 1 and self.feed is not None and self.feed != current_feed:
+                    line += f" F{self.feed:g}"
+                lines.append(line)
+        lines.append(self.pen_up_line)
+        return lines
+
+
+def _distance(a, b) -> float:
+    return float(np.hypot(a[0] - b[0], a[1] - b[1]))
+
+
+def _route_travel(starts: np.ndarray, ends: np.ndarray, order: np.ndarray, flipped: np.ndarray, origin) -> float:
+    """按给定顺序和方向书写时的抬笔空程总长度"""
+    entry = np.where(flipped[:, None], ends[order], starts[order])
+    exit_ = np.where(flipped[:, None], starts[order], ends[order])
+    previous = np.vstack([np.asarray(origin, dtype=np.float64)[None, :], exit_[:-1]])
+    return float(np.hypot(*(entry - previous).T).sum())
+
+
+def _nearest_neighbour(starts: np.ndarray, ends: np.ndarray, reversible: np.ndarray, origin) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    最近邻构造初始路径，可反向书写的笔画可以从终点开始
+
+    笔画端点放进均匀网格，每一步只搜索当前位置附近的几圈网格；
+    附近没有剩余端点时（通常只发生在最后少量笔画）退回到对所有剩余笔画的向量化搜索。
+    """
+    n = len(starts)
+    # 候选入口: (x, y, 笔画编号, 是否反向)
+    entries = [(x, y, k, False) for k, (x, y) in enumerate(starts.tolist())]
+    entries += [(x, y, k, True) for k, (x, y) in enumerate(ends.tolist()) if reversible[k]]
+    all_points = np.vstack([starts, ends])
+    span = max(float(np.ptp(all_points[:, 0])), float(np.ptp(all_points[:, 1])), 1e-6)
+    cell = span / max(1.0, np.sqrt(n))
+    min_x, min_y = float(all_points[:, 0].min()), float(all_points[:, 1].min())
+    grid: Dict[Tuple[int, int], list] = {}
+    for entry in entries:
+        grid.setdefault((int((entry[0] - min_x) // cell), int((entry[1] - min_y) // cell)), []).append(entry)
+
+    remaining = np.ones(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    flipped = np.zeros(n, dtype=bool)
+    cx, cy = float(origin[0]), float(origin[1])
+    for k in range(n):
+        gx, gy = int((cx - min_x) // cell), int((cy - min_y) // cell)
+        best = None
+        best_d = np.inf
+        for ring in range(4):
+            for ix in range(gx - ring, gx + ring + 1):
+                for iy in range(gy - ring, gy + ring + 1):
+                    if max(abs(ix - gx), abs(iy - gy)) != ring:
+                        continue
+                    bucket = grid.get((ix, iy))
+                    if not bucket:
+                        continue
+                    alive = [e for e in bucket if remaining[e[2]]]
+                    if len(alive) != len(bucket):
+                        grid[(ix, iy)] = alive
+                    for entry in alive:
+                        d = (entry[0] - cx) ** 2 + (entry[1] - cy) ** 2
+                        if d < best_d:
+                            best, best_d = entry, d
+            # 更外圈的端点距离至少为 ring * cell
+            if best is not None and best_d <= (ring * cell) ** 2:
+                break
+        else:
+            if best is None or best_d > (3 * cell) ** 2:
+                best = None
+        if best is None:
+            d_start = np.hypot(starts[:, 0] - cx, starts[:, 1] - cy)
+            d_end = np.hypot(ends[:, 0] - cx, ends[:, 1] - cy)
+            d_start[~remaining] = np.inf
+            d_end[~(remaining & reversible)] = np.inf
+            i_start, i_end = int(np.argmin(d_start)), int(np.argmin(d_end))
+            best = (0, 0, i_end, True) if d_end[i_end] < d_start[i_start] else (0, 0, i_start, False)
+
+        index, reverse = best[2], best[3]
+        order[k], flipped[k] = index, reverse
+        remaining[index] = False
+        cx, cy = (starts[index] if reverse else ends[index]).tolist()
+    return order, flipped
+
+
+def _two_opt(starts: np.ndarray, ends: np.ndarray, reversible: np.ndarray, order: np.ndarray, flipped: np.ndarray,
+             origin, deadline: float, window: int = 1000) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    2-opt 改进：把路径中的一段整体倒序，段内每个笔画同时反向书写；路径终点是开放的
+
+    对固定的 i，向量化地计算 j in [i, i + window) 的收益，取收益最大的一次倒序，直到没有改进或超时
+    """
+    n = len(order)
+    origin = np.asarray(origin, dtype=np.float64)
+    entry = np.where(flipped[:, None], ends[order], starts[order])
+    exit_ = np.where(flipped[:, None], starts[order], ends[order])
+    all_reversible = bool(reversible.all())
+    blocked = None if all_reversible else np.cumsum(~reversible[order])  # 前 k+1 个位置中不可反向的笔画数量
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(n):
+            if (i & 63) == 0 and time.perf_counter() >= deadline:
+                break
+            stop = min(n, i + window)
+            a = origin if i == 0 else exit_[i - 1]
+            b = entry[i]
+            out_j = exit_[i:stop]
+            # 段后的下一个入口；段延伸到路径末尾时后面没有笔画，相关的两项为 0
+            next_in = entry[i + 1:stop + 1] if stop < n else np.vstack([entry[i + 1:stop], out_j[-1:]])
+            b_to_next = np.hypot(b[0] - next_in[:, 0], b[1] - next_in[:, 1])
+            out_to_next = np.hypot(out_j[:, 0] - next_in[:, 0], out_j[:, 1] - next_in[:, 1])
+            if stop == n:
+                b_to_next[-1] = 0.0
+                out_to_next[-1] = 0.0
+            gain = np.hypot(a[0] - out_j[:, 0], a[1] - out_j[:, 1]) + b_to_next - _distance(a, b) - out_to_next
+            if not all_reversible:
+                # 区间 [i, j] 中有不可反向的笔画时不能倒序
+                before = blocked[i - 1] if i > 0 else 0
+                gain[blocked[i:stop] - before > 0] = np.inf
+            best = int(np.argmin(gain))
+            if gain[best] < -1e-9:
+                j = i + best + 1
+                order[i:j] = order[i:j][::-1].copy()
+                flipped[i:j] = ~flipped[i:j][::-1]
+                entry[i:j], exit_[i:j] = exit_[i:j][::-1].copy(), entry[i:j][::-1].copy()
+                improved = True
+    return order, flipped
+
+
+def _optimize_block(strokes: List[_Stroke], origin, time_budget: float) -> Tuple[List[Tuple[_Stroke, bool]], float, float]:
+    """
+    优化一组笔画的书写顺序，time_budget 为 2-opt 改进的时间上限（秒）
+
+    返回:
+        ([(笔画, 是否反向), ...], 优化前空程, 优化后空程)
+    """
+    starts = np.array([s.start for s in strokes], dtype=np.float64)
+    ends = np.array([s.end for s in strokes], dtype=np.float64)
+    reversible = np.array([s.reversible for s in strokes], dtype=bool)
+    identity = np.arange(len(strokes))
+    before = _route_travel(starts, ends, identity, np.zeros(len(strokes), dtype=bool), origin)
+
+    order, flipped = _nearest_neighbour(starts, ends, reversible, origin)
+    order, flipped = _two_opt(starts, ends, reversible, order, flipped, origin, time.perf_counter() + time_budget)
+    after = _route_travel(starts, ends, order, flipped, origin)
+    if after >= before:
+        # 原顺序已经足够好
+        return [(s, False) for s in strokes], before, before
+    return [(strokes[k], bool(f)) for k, f in zip(order, flipped)], before, after
+
+
+def optimize_stroke_order(gcode: Union[str, Iterable[str]], group_by_cell: bool = True, origin=(0.0, 0.0),
+                          z_pen_down: float = DEFAULT_Z_PEN_DOWN, z_pen_up: float = DEFAULT_Z_PEN_UP,
+                          rapid_rate: float = DEFAULT_RAPID_RATE, time_limit: float = DEFAULT_TIME_LIMIT) -> Tuple[List[str], dict]:
+    """
+    重新排列笔画顺序（允许反向书写），减少抬笔空程
+
+    程序按 Z 轴抬笔/落笔移动切分为笔画；抬笔时的 G0/G1 空程移动会按新的顺序重新生成。
+    遇到其它指令（单位、坐标模式、抬笔状态下的 Z 移动、M 代码、普通注释等）时，前后的笔画分别优化，指令本身保持原位。
+    使用相对坐标 (G91) 的程序不做优化，原样返回。
+
+    参数:
+        gcode: G-code 字符串或行列表（也可以是 text_to_gcode 返回的生成器）
+        group_by_cell: 为 True 时只在同一个单元格（"(cell N)" 注释）内调整顺序，单元格之间保持原顺序；
+                       为 False 时所有笔画一起优化，单元格注释被丢弃
+        origin: 程序开始时笔的位置 (mm)
+        z_pen_down, z_pen_up: 落笔/抬笔 Z 值，用于判断 Z 轴移动是落笔还是抬笔
+        rapid_rate: 抬笔快速移动速度 (mm/min)，用于估算节省的时间
+        time_limit: 2-opt 改进的时间上限（秒）
+
+    返回:
+        (优化后的 G-code 行列表, 报告字典)
+        报告: {'strokes', 'travel_before_mm', 'travel_after_mm', 'time_saved_s', 'elapsed_s', 'optimized'}
+    """
+    started = time.perf_counter()
+    lines = gcode.strip().split('\n') if isinstance(gcode, str) else list(gcode)
+    parsed = []
+    for raw in lines:
+        line = raw.strip()
+        if line:
+            parsed.append((line,) + parse_words(line))
+    report = {
+        'strokes': 0,
+        'travel_before_mm': 0.0,
+        'travel_after_mm': 0.0,
+        'time_saved_s': 0.0,
+        'elapsed_s': 0.0,
+        'optimized': False,
+    }
+    if any(91.0 in gcodes for _, gcodes, _ in parsed):
+        print("G-code 使用了相对坐标 (G91)，跳过笔画顺序优化")
+        report['elapsed_s'] = time.perf_counter() - started
+        return [line for line, _, _ in parsed], report
+
+    def is_pen_move(words):
+        return 'Z' in words and 'X' not in words and 'Y' not in words
+
+    def is_pen_down(words):
+        return abs(words['Z'] - z_pen_down) < abs(words['Z'] - z_pen_up)
+
+    # 2-opt 的时间上限按笔画数量分配给各组
+    total_strokes = sum(1 for _, _, words in parsed if is_pen_move(words) and is_pen_down(words))
+
+    output = []
+    block: List[_Stroke] = []
+    pending_travel = []     # 笔画之间的空程移动，后面还有笔画时由新顺序重新生成，否则原样输出
+    # origin: 优化后程序中笔的实际位置；original: 原程序中笔的位置，用于计算优化前的空程
+    state = {'origin': tuple(origin), 'original': tuple(origin), 'feed': None}
+
+    def flush():
+        """优化并输出当前积累的笔画"""
+        nonlocal block
+        if not block:
+            return
+        report['travel_before_mm'] += _route_travel(
+            np.array([s.start for s in block], dtype=np.float64), np.array([s.end for s in block], dtype=np.float64),
+            np.arange(len(block)), np.zeros(len(block), dtype=bool), state['original']
+        )
+        if group_by_cell:
+            groups = []
+            for s in block:
+                if groups and groups[-1][0] == s.cell:
+                    groups[-1][1].append(s)
+                else:
+                    groups.append((s.cell, [s]))
+        else:
+            groups = [(None, block)]
+
+        current = state['origin']
+        current_feed = state['feed']
+        for group_cell, strokes in groups:
+            ordered, _, after = _optimize_block(strokes, current, time_limit * len(strokes) / max(1, total_strokes))
+            report['travel_after_mm'] += after
+            if group_cell is not None:
+                output.append(f"(cell {group_cell})")
+            for s, reverse in ordered:
+                entry = s.end if reverse else s.start
+                if _distance(entry, current) > 1e-9:
+                    output.append(f"G0 X{entry[0]:.3f} Y{entry[1]:.3f}")
+                output.extend(s.emit(reverse, current_feed))
+                current = s.start if reverse else s.end
+                current_feed = s.feed if reverse else s.end_feed
+        state['origin'] = current
+        state['feed'] = current_feed
+        report['strokes'] += len(block)
+        block = []
+
+    position = tuple(origin)
+    feed = None
+    motion = 0.0
+    cell = None
+    stroke = None
+    for line, gcodes, words in parsed:
+        for code in gcodes:
+            if code in (0.0, 1.0, 2.0, 3.0):
+                motion = code
+        if 'F' in words:
+            feed = words['F']
+
+        cell_match = CELL_COMMENT_PATTERN.match(line)
+        if cell_match:
+            cell = cell_match.group(1)
+            continue
+
+        if stroke is not None:
+            if is_pen_move(words) and not is_pen_down(words):
+                stroke.pen_up_line = line
+                stroke.end_feed = feed
+                block.append(stroke)
+                stroke = None
+                continue
+            if ('X' in words or 'Y' in words) and motion in (1.0, 2.0, 3.0) and 'Z' not in words:
+                target = (words.get('X', position[0]), words.get('Y', position[1]))
+                arc = {k: words[k] for k in ('I', 'J', 'R') if k in words}
+                stroke.moves.append((motion, target, arc))
+                stroke.lines.append(line)
+                if stroke.feed is None:
+                    stroke.feed = feed
+                elif feed != stroke.feed:
+                    stroke.reversible = False  # 笔画中途改变了进给速度
+                position = target
+                stroke.end = target
+                continue
+            # 笔画中的其它指令（例如 M 代码、落笔状态下的 G0）原样保留，但这个笔画不能反向；
+            # 带 X/Y 的行同样会改变笔的位置，笔画终点要随之更新，否则空程的计算是错的
+            stroke.lines.append(line)
+            stroke.reversible = False
+            if ('X' in words or 'Y' in words) and not (set(gcodes) & _NON_MOTION_AXIS_CODES - {92.0}):
+                position = (words.get('X', position[0]), words.get('Y', position[1]))
+                stroke.end = position
+            continue
+
+        if is_pen_move(words) and is_pen_down(words):
+            # 落笔，前面的空程移动由新的顺序重新生成
+            pending_travel = []
+            stroke = _Stroke(position, line, cell, None)
+            continue
+        if ('X' in words or 'Y' in words) and 'Z' not in words and motion in (0.0, 1.0) and not (set(words) - {'X', 'Y', 'F'}):
+            pending_travel.append(line)
+            position = (words.get('X', position[0]), words.get('Y', position[1]))
+            continue
+
+        # 其它指令：先输出之前的笔画和空程，指令本身保持原位
+        flush()
+        if pending_travel:
+            output.extend(pending_travel)
+            pending_travel = []
+            state['origin'] = position
+        output.append(line)
+        if 'X' in words or 'Y' in words:
+            position = (words.get('X', position[0]), words.get('Y', position[1]))
+            state['origin'] = (words.get('X', state['origin'][0]), words.get('Y', state['origin'][1]))
+        state['original'] = position
+        state['feed'] = feed
+
+    flush()
+    if stroke is not None:
+        # 程序在落笔状态下结束，最后一个不完整的笔画原样输出
+        output.append(stroke.pen_down_line)
+        output.extend(stroke.lines)
+    output.extend(pending_travel)
+
+    saved = report['travel_before_mm'] - report['travel_after_mm']
+    report['time_saved_s'] = saved / rapid_rate * 60 if rapid_rate > 0 else 0.0
+    report['optimized'] = saved > 0
+    report['elapsed_s'] = time.perf_counter() - started
+    return output, report
@@ -0,0 +1,205 @@
+import json
+import re
+from typing import Iterable, Iterator, List, Sequence, Tuple
+import cv2
+import numpy as np
+
+# 注意：本模块只负责生成 G-code，不导入 grbl_controller（导入它会创建默认实例并尝试打开串口），
+# 生成的行可以直接交给 GRBLController.execute_gcode 执行。
+
+# 默认落笔/抬笔 Z 值，与 GRBLController 的默认值一致
+DEFAULT_Z_PEN_DOWN = -2.0
+DEFAULT_Z_PEN_UP = 0.0
+# 默认书写进给速度 (mm/min)
+DEFAULT_FEED_RATE = 1000
+
+
+class PixelToMachineTransform:
+    """
+    校正后图片像素坐标 -> 写字机坐标 (mm) 的标定变换
+
+    内部为 3x3 齐次矩阵，可以是仿射变换或单应性变换。
+    像素坐标系 y 轴向下（左手坐标系），GRBL 为右手坐标系，标定时需要把 y 轴方向对齐。
+    """
+
+    def __init__(self, matrix):
+        """
+        参数:
+            matrix: 3x3 变换矩阵（或 2x3 仿射矩阵），把 (像素x, 像素y, 1) 映射到 (X, Y, w)
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.shape == (2, 3):
+            matrix = np.vstack([matrix, [0.0, 0.0, 1.0]])
+        if matrix.shape != (3, 3):
+            raise ValueError(f"变换矩阵的形状应为 3x3 或 2x3，实际为 {matrix.shape}")
+        self.matrix = matrix
+
+    @classmethod
+    def from_scale(cls, mm_per_pixel: float, origin_mm: Tuple[float, float] = (0.0, 0.0), flip_y: bool = True):
+        """
+        由比例和原点构造变换：图片左上角对应 origin_mm，每个像素对应 mm_per_pixel 毫米
+
+        参数:
+            mm_per_pixel: 每个像素对应的毫米数
+            origin_mm: 图片左上角在写字机坐标系中的位置
+            flip_y: 是否翻转 y 轴（像素 y 向下，机器 Y 向上时为 True）
+        """
+        sy = -mm_per_pixel if flip_y else mm_per_pixel
+        return cls([
+            [mm_per_pixel, 0.0, origin_mm[0]],
+            [0.0, sy, origin_mm[1]],
+            [0.0, 0.0, 1.0],
+        ])
+
+    @classmethod
+    def from_point_pairs(cls, pixel_points: Sequence[Sequence[float]], machine_points: Sequence[Sequence[float]]):
+        """
+        由标定点对构造变换
+
+        3 对点时求仿射变换，4 对及以上时用最小二乘求单应性变换（例如表格的四个角点）
+
+        参数:
+            pixel_points: 校正后图片上的像素坐标 [(x, y), ...]
+            machine_points: 对应的写字机坐标 (mm) [(X, Y), ...]
+        """
+        src = np.asarray(pixel_points, dtype=np.float32)
+        dst = np.asarray(machine_points, dtype=np.float32)
+        if len(src) != len(dst) or len(src) < 3:
+            raise ValueError("标定至少需要 3 对一一对应的点")
+        if len(src) == 3:
+            return cls(cv2.getAffineTransform(src, dst))
+        matrix, _ = cv2.findHomography(src, dst, 0)
+        if matrix is None:
+            raise ValueError("无法由标定点计算变换矩阵，请检查标定点是否共线")
+        return cls(matrix)
+
+    def apply(self, points) -> np.ndarray:
+        """
+        变换一组像素坐标
+
+        参数:
+            points: [(x, y), ...] 或 N x 2 数组
+
+        返回:
+            N x 2 的写字机坐标数组 (mm)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        mapped = points @ self.matrix[:, :2].T + self.matrix[:, 2]
+        return mapped[:, :2] / mapped[:, 2:3]
+
+    def __call__(self, x: float, y: float) -> Tuple[float, float]:
+        mapped = self.apply([(x, y)])[0]
+        return float(mapped[0]), float(mapped[1])
+
+    def to_dict(self) -> dict:
+        return {"matrix": self.matrix.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["matrix"])
+
+    def save(self, path: str) -> None:
+        """保存标定结果到 JSON 文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str):
+        """从 JSON 文件加载标定结果"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+# 单元格分隔注释 "(cell N)"
+CELL_COMMENT_PATTERN = re.compile(r"^\(cell\s+(.+)\)$")
+
+
+def cell_comment(cell_id) -> str:
+    """单元格分隔注释，后续的优化步骤据此按单元格分组"""
+    return f"(cell {cell_id})"
+
+
+def pen_move(z: float) -> str:
+    """抬笔/落笔的 Z 轴移动，格式与 GRBLController._move_z 发送的命令一致"""
+    return f"G90 G0 Z{z:.3f}"
+
+
+def strokes_to_gcode(cell_strokes: Iterable[Tuple[int, List[List[Tuple[float, float]]]]],
+                     transform: PixelToMachineTransform,
+                     z_pen_down: float = DEFAULT_Z_PEN_DOWN,
+                     z_pen_up: float = DEFAULT_Z_PEN_UP,
+                     feed_rate: float = DEFAULT_FEED_RATE,
+                     return_home: bool = True) -> Iterator[str]:
+    """
+    把笔画转换为 G-code，逐行产出
+
+    参数:
+        cell_strokes: 可迭代的 (tableCellId, 笔画列表)，笔画坐标为校正后图片的像素坐标；
+                      可以是生成器，每个单元格的笔画用到时才计算
+        transform: 像素 -> 写字机坐标的标定变换
+        z_pen_down: 落笔 Z 值
+        z_pen_up: 抬笔 Z 值
+        feed_rate: 书写进给速度 (mm/min)
+        return_home: 结束后是否回到 X0 Y0
+
+    产出:
+        不带换行符的 G-code 行
+    """
+    yield "G21"
+    yield "G90"
+    yield pen_move(z_pen_up)
+    for cell_id, strokes in cell_strokes:
+        if not strokes:
+            continue
+        yield cell_comment(cell_id)
+        for stroke in strokes:
+            points = transform.apply(stroke)
+            yield f"G0 X{points[0][0]:.3f} Y{points[0][1]:.3f}"
+            yield pen_move(z_pen_down)
+            feed = f" F{feed_rate:g}"
+            for x, y in points[1:]:
+                yield f"G1 X{x:.3f} Y{y:.3f}{feed}"
+                feed = ""  # F 是模态的，只在每段第一行给出
+            yield pen_move(z_pen_up)
+    if return_home:
+        yield "G0 X0.000 Y0.000"
+
+
+def text_to_gcode(corrected_table_info: dict, tdtr_cells: list, transform: PixelToMachineTransform,
+                  quality: str = None, use_font_metrics: bool = False, **gcode_options) -> Iterator[str]:
+    """
+    由校正后的表格信息和前端填写的 tdtr_cells 生成手写 G-code，逐行产出
+
+    每个单元格的笔画渲染完就立即转换为 G-code，多页任务也不会先在内存中拼出整段程序。
+
+    参数:
+        corrected_table_info: 校正后的表格识别结果（SingleTable.get_corrected_table_info 的返回值）
+        tdtr_cells: 前端传入的 tdtr_cells
+        transform: 像素 -> 写字机坐标的标定变换
+        quality: 提取笔画时栅格字形的渲染质量，默认与 gen_handwriter_image 相同
+        use_font_metrics: 是否按手写字体的真实字宽排版，需要与生成预览图时一致
+        gcode_options: 传给 strokes_to_gcode 的参数（z_pen_down、z_pen_up、feed_rate、return_home）
+
+    产出:
+        不带换行符的 G-code 行，可直接传给 GRBLController.execute_gcode
+    """
+    # 延迟导入，只生成 G-code 的调用方（例如解析已有程序）不需要加载 handright
+    from app.core.handword_gen.hw_converter import iter_handwriter_strokes, DEFAULT_QUALITY
+
+    tr_tables_info = corrected_table_info['data']['prism_tablesInfo'][0]['cellInfos']
+    tr_word_info = corrected_table_info['data']['prism_wordsInfo']
+    cell_strokes = iter_handwriter_strokes(
+        tr_tables_info, tr_word_info, tdtr_cells,
+        quality=quality or DEFAULT_QUALITY, use_font_metrics=use_font_metrics
+    )
+    return strokes_to_gcode(cell_strokes, transform, **gcode_options)
+
+
+def write_gcode(lines: Iterable[str], path: str) -> int:
+    """把 G-code 行逐行写入文件，返回写入的行数"""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + '\n')
+            count += 1
+    return count
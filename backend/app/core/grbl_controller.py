@@ -2,12 +2,283 @@ import serial
 import serial.tools.list_ports
 import time
 import re
+import queue
+import threading
+from collections import deque
+from typing import NamedTuple, Optional, Tuple
+from app.core.gcode.parser import ParsedProgram, parse_gcode, clean_line
+from app.core.gcode.estimator import estimate_gcode
+
+# GRBL 串口接收缓冲区大小（字节），字符计数流式发送时在途字节数不能超过该值
+GRBL_RX_BUFFER_SIZE = 127
+
+# GRBL 实时命令，单字节发送，不进入接收缓冲区，也没有 ok 回复
+REALTIME_COMMANDS = {'?', '!', '~', '\x18'}
+
+# 状态轮询频率 (Hz)
+DEFAULT_STATUS_POLL_HZ = 5
+MIN_STATUS_POLL_HZ = 1
+MAX_STATUS_POLL_HZ = 20
+
+# 串口事件类型
+EVENT_OK = 'ok'              # 命令执行成功
+EVENT_ERROR = 'error'        # 命令执行失败，code 为错误码
+EVENT_ALARM = 'alarm'        # 报警，code 为报警码
+EVENT_STATUS = 'status'      # 状态报告 <...>
+EVENT_MESSAGE = 'message'    # 其它反馈信息，例如 [MSG:...]、$ 设置、欢迎信息
+EVENT_CLOSED = 'closed'      # 串口已关闭或读取出错，用于唤醒正在等待的发送方
+
+
+class GrblEvent(NamedTuple):
+    """串口读取线程解析出的一条GRBL消息"""
+    kind: str                 # 事件类型，见 EVENT_*
+    line: str                 # 原始内容（已去掉换行符）
+    code: Optional[int]       # error/alarm 的编号，其它事件为 None
+    timestamp: float          # 收到的时间 (time.time())
+
+
+def parse_grbl_line(line, timestamp=None):
+    """把GRBL返回的一行内容解析为 GrblEvent"""
+    timestamp = time.time() if timestamp is None else timestamp
+    if line == 'ok':
+        return GrblEvent(EVENT_OK, line, None, timestamp)
+    if line.startswith('error'):
+        match = re.match(r"error:(\d+)", line)
+        return GrblEvent(EVENT_ERROR, line, int(match.group(1)) if match else None, timestamp)
+    if line.startswith('ALARM'):
+        match = re.match(r"ALARM:(\d+)", line)
+        return GrblEvent(EVENT_ALARM, line, int(match.group(1)) if match else None, timestamp)
+    if line.startswith('<') and line.endswith('>'):
+        return GrblEvent(EVENT_STATUS, line, None, timestamp)
+    return GrblEvent(EVENT_MESSAGE, line, None, timestamp)
+
+
+class MachineStatus(NamedTuple):
+    """
+    GRBL状态报告的快照 (不可变)
+
+    例: <Run|MPos:10.000,20.000,-1.000|Bf:15,128|FS:500,0|Ov:100,100,100|WCO:0.000,0.000,0.000>
+    GRBL 的每条报告只包含 MPos 和 WPos 其中之一，WCO 也只是间隔若干条报告才发送一次，
+    另一个坐标由最近一次收到的 WCO 换算得到。
+    """
+    state: str                                   # Idle / Run / Hold / Jog / Alarm / Door / Check / Home / Sleep
+    substate: Optional[int]                      # 例如 Hold:0 中的 0
+    mpos: Tuple[float, float, float]             # 机械坐标
+    wpos: Tuple[float, float, float]             # 工作坐标
+    wco: Tuple[float, float, float]              # 工作坐标偏移 (WPos = MPos - WCO)
+    feed: float                                  # 当前进给速度
+    spindle: float                               # 当前主轴转速
+    planner_free: Optional[int]                  # 规划缓冲区剩余块数 (Bf 第一项)
+    rx_free: Optional[int]                       # 串口接收缓冲区剩余字节数 (Bf 第二项)
+    overrides: Optional[Tuple[int, int, int]]    # 进给/快速移动/主轴倍率 (%)
+    pins: str                                    # 触发的输入引脚 (Pn)，没有时为空字符串
+    timestamp: float                             # 收到报告的时间 (time.time())
+    raw: str                                     # 原始报告
+
+    @property
+    def age(self):
+        """距离收到该报告经过的时间（秒）"""
+        return time.time() - self.timestamp
+
+
+def _parse_floats(text):
+    return tuple(float(v) for v in text.split(','))
+
+
+def parse_status_report(line, previous=None, timestamp=None):
+    """
+    解析GRBL状态报告 <...>
+
+    Args:
+        line: 状态报告行
+        previous: 上一次的 MachineStatus，用于沿用报告中省略的 WCO 和倍率
+        timestamp: 收到的时间，默认为当前时间
+
+    Returns:
+        MachineStatus，格式不正确时返回 None
+    """
+    line = line.strip()
+    if not (line.startswith('<') and line.endswith('>')):
+        return None
+    fields = line[1:-1].split('|')
+    state, _, sub = fields[0].partition(':')
+    values = {}
+    for field in fields[1:]:
+        key, _, value = field.partition(':')
+        values[key] = value
+    try:
+        wco = _parse_floats(values['WCO']) if 'WCO' in values else (previous.wco if previous else (0.0, 0.0, 0.0))
+        if 'MPos' in values:
+            mpos = _parse_floats(values['MPos'])
+            wpos = tuple(m - o for m, o in zip(mpos, wco))
+        elif 'WPos' in values:
+            wpos = _parse_floats(values['WPos'])
+            mpos = tuple(w + o for w, o in zip(wpos, wco))
+        else:
+            return None
+        feed, spindle = 0.0, 0.0
+        if 'FS' in values:
+            feed, spindle = _parse_floats(values['FS'])[:2]
+        elif 'F' in values:
+            feed = float(values['F'])
+        planner_free = rx_free = None
+        if 'Bf' in values:
+            planner_free, rx_free = (int(v) for v in values['Bf'].split(',')[:2])
+        if 'Ov' in values:
+            overrides = tuple(int(v) for v in values['Ov'].split(',')[:3])
+        else:
+            overrides = previous.overrides if previous else None
+    except (ValueError, TypeError):
+        return None
+    return MachineStatus(
+        state=state,
+        substate=int(sub) if sub.isdigit() else None,
+        mpos=mpos,
+        wpos=wpos,
+        wco=wco,
+        feed=feed,
+        spindle=spindle,
+        planner_free=planner_free,
+        rx_free=rx_free,
+        overrides=overrides,
+        pins=values.get('Pn', ''),
+        timestamp=time.time() if timestamp is None else timestamp,
+        raw=line,
+    )
+
+
+class GrblStatusPoller(threading.Thread):
+    """
+    状态轮询线程
+
+    按固定频率发送实时命令 '?'。'?' 是单字节实时命令，GRBL收到后立即回复状态报告，
+    不进入接收缓冲区，也不会排在运动指令后面；回复由串口读取线程解析后更新控制器的状态快照。
+    """
+
+    def __init__(self, controller, rate_hz=DEFAULT_STATUS_POLL_HZ):
+        super().__init__(name="grbl-status-poller", daemon=True)
+        self.controller = controller
+        self.interval = 1.0 / rate_hz
+        self._stop_event = threading.Event()
+
+    def stop(self, timeout=1):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.controller.connected:
+                self.controller._send_realtime('?')
+
+
+class GrblSerialReader(threading.Thread):
+    """
+    后台串口读取线程
+
+    持续读取串口，把每一行解析为 GrblEvent:
+        ok / error / alarm / message 按到达顺序放入 responses 队列，由发送方依次取出与自己发送的命令对应；
+        status 状态报告只保留最新的一条 (latest_status)，并唤醒等待状态报告的线程。
+    另外每个事件都会依次调用已注册的监听函数（在读取线程中执行，监听函数应尽快返回）。
+    """
+
+    def __init__(self, ser):
+        super().__init__(name="grbl-serial-reader", daemon=True)
+        self.ser = ser
+        self.responses = queue.Queue()
+        self.latest_status: Optional[GrblEvent] = None
+        self._status_condition = threading.Condition()
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.error = None
+
+    def add_listener(self, callback):
+        """注册事件监听函数 callback(event)"""
+        with self._listeners_lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._listeners_lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def stop(self, timeout=2):
+        """停止读取线程（串口超时为 1 秒，线程最多在一次超时后退出）"""
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def wait_for_status(self, after=0.0, timeout=1.0):
+        """
+        等待一条在 after 时刻之后收到的状态报告
+
+        Returns:
+            GrblEvent 或 None（超时）
+        """
+        deadline = time.time() + timeout
+        with self._status_condition:
+            while self.latest_status is None or self.latest_status.timestamp < after:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.is_alive():
+                    return None
+                self._status_condition.wait(remaining)
+            return self.latest_status
+
+    def _dispatch(self, event):
+        if event.kind == EVENT_STATUS:
+            with self._status_condition:
+                self.latest_status = event
+                self._status_condition.notify_all()
+        else:
+            self.responses.put(event)
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"串口事件监听函数出错: {e}")
+
+    def run(self):
+        partial = b""
+        while not self._stop_event.is_set():
+            try:
+                chunk = self.ser.readline()
+            except (serial.SerialException, OSError, TypeError, AttributeError) as e:
+                # 串口被关闭或拔出
+                if not self._stop_event.is_set():
+                    self.error = f"串口读取错误: {e}"
+                    print(self.error)
+                break
+            if not chunk:
+                continue  # 读取超时，检查是否需要退出
+            partial += chunk
+            if not partial.endswith(b'\n'):
+                continue  # 超时返回了半行，等待剩余部分
+            line = partial.decode('utf-8', errors='ignore').strip()
+            partial = b""
+            if line:
+                self._dispatch(parse_grbl_line(line))
+        self._dispatch(GrblEvent(EVENT_CLOSED, "", None, time.time()))
+        with self._status_condition:
+            self._status_condition.notify_all()
+
 
 # 单位固定位mm
 # 右手坐标系
 class GRBLController:
-    def __init__(self, default_port="COM3", default_baudrate=115200):
+    def __init__(self, default_port="COM3", default_baudrate=115200, serial_factory=None, auto_connect=True):
+        """
+        Args:
+            default_port: 默认串口
+            default_baudrate: 默认波特率
+            serial_factory: 打开串口的函数 factory(port, baudrate, timeout=1)，默认为 serial.Serial；
+                            测试时可以传入 grbl_simulator.simulated_serial_factory() 使用模拟设备
+            auto_connect: 初始化时是否立即连接默认串口
+        """
         self.ser = None
+        self.serial_factory = serial_factory or serial.Serial
         self.port = default_port
         self.baudrate = default_baudrate
         self.connected = False
@@ -42,12 +313,102 @@ class GRBLController:
 
         self.grbl_buffer = [] # 用于存储GRBL的响应
 
+        # 后台串口读取线程，连接后启动
+        self.reader = None
+        # 串口命令锁，保证一条命令的发送和等待回复不会与其它线程交错
+        self._command_lock = threading.RLock()
+        # 已发送但不再等待回复的命令数量（例如超时或不等待 ok 的命令），它们的回复到达时直接丢弃
+        self._orphan_responses = 0
+
+        # 最近一次的状态报告快照 (MachineStatus)，由读取线程更新，读取时不需要访问串口
+        self.status: Optional[MachineStatus] = None
+        self.status_poll_hz = DEFAULT_STATUS_POLL_HZ # 连接后自动开始轮询的频率，为 0 或 None 时不自动轮询
+        self.status_poller = None
+        # 正在进行的流式发送的取消标志，置位后停止发送后续行；每次发送使用新的标志
+        self._stream_cancel = threading.Event()
+        # GRBL设置 ($$) 的缓存 {编号: 数值}，连接后第一次用到时读取
+        self.grbl_settings = None
+
         # 尝试连接默认端口
-        self.connect(self.port)
+        if auto_connect:
+            self.connect(self.port)
         print(f"初始化完成，连接状态: {self.connected}")
 
         
 
+    def _start_reader(self):
+        """启动后台串口读取线程"""
+        self._stop_reader()
+        self._orphan_responses = 0
+        self.reader = GrblSerialReader(self.ser)
+        self.reader.add_listener(self._on_serial_event)
+        self.reader.start()
+
+    def _stop_reader(self):
+        self.stop_status_polling()
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+
+    def _wait_for_response(self, timeout, accept_status=False):
+        """
+        从读取线程的回复队列中等待一条命令的回复
+
+        Args:
+            timeout: 超时时间（秒）
+            accept_status: 是否把状态报告也当作回复（用于 '?' 查询）
+
+        Returns:
+            (lines, event): 收到的所有行，以及结束等待的事件（ok/error/alarm/closed/status），超时时 event 为 None
+        """
+        lines = []
+        deadline = time.time() + timeout
+        start = time.time()
+        while True:
+            if accept_status and self.reader.latest_status is not None and self.reader.latest_status.timestamp >= start:
+                event = self.reader.latest_status
+                lines.append(event.line)
+                return lines, event
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return lines, None
+            try:
+                event = self.reader.responses.get(timeout=min(remaining, 0.05) if accept_status else remaining)
+            except queue.Empty:
+                continue
+            if event.kind in (EVENT_OK, EVENT_ERROR) and self._orphan_responses > 0:
+                # 属于之前已放弃等待的命令
+                self._orphan_responses -= 1
+                continue
+            if event.kind == EVENT_CLOSED:
+                return lines, event
+            lines.append(event.line)
+            if event.kind in (EVENT_OK, EVENT_ERROR, EVENT_ALARM):
+                return lines, event
+
+    def _drain_responses(self):
+        """丢弃回复队列中尚未取出的消息，返回丢弃的消息"""
+        drained = []
+        if self.reader is None:
+            return drained
+        while True:
+            try:
+                drained.append(self.reader.responses.get_nowait())
+            except queue.Empty:
+                return drained
+
+    def _send_realtime(self, char):
+        """发送GRBL实时命令（单字节，不换行，不等待回复）"""
+        if not self.ser or not self.ser.is_open:
+            return False
+        try:
+            self.ser.write(char.encode('latin-1'))
+            return True
+        except serial.SerialException as e:
+            print(f"串口错误: {e}")
+            self.disconnect()
+            return False
+
     def _send_ser_msg(self, msg, wait_for_response=True, timeout=5):
         """
         内部函数，发送消息到串口，用于在确认连接前给写字机发送消息
@@ -71,89 +432,91 @@ class GRBLController:
             'error': None
         }
         
-        if not self.ser or not self.ser.is_open:
+        if not self.ser or not self.ser.is_open or self.reader is None:
             result['error'] = "串口未连接或未打开"
             return result
             
         try:
-            self.ser.reset_input_buffer()  # 清除输入缓存
-            self.ser.write((msg + '\n').encode('utf-8'))
-            
-            # 模式1：不等待响应，直接返回成功
-            if not wait_for_response:
-                result['success'] = True
-                return result
-            
-            # 模式2：等待响应，带超时
-            start_time = time.time()
-            
-            while True:
-                # 检查是否超时
-                if time.time() - start_time > timeout:
-                    result['error'] = f"等待响应超时（{timeout}秒）"
+            with self._command_lock:
+                if msg in REALTIME_COMMANDS:
+                    self.ser.write(msg.encode('latin-1'))
+                else:
+                    self.ser.write((msg + '\n').encode('utf-8'))
+
+                # 模式1：不等待响应，直接返回成功
+                if not wait_for_response:
+                    if msg not in REALTIME_COMMANDS:
+                        self._orphan_responses += 1
+                    result['success'] = True
                     return result
-                
-                # 检查是否有数据可读
-                if self.ser.in_waiting > 0:
-                    line = self.ser.readline().decode('utf-8').strip()
-                    result['data'].append(line)
-                    
-                    if line == 'ok':
-                        result['success'] = True
-                        return result
-                    elif line == 'error':
-                        result['error'] = "GRBL命令测试失败"
-                        return result
-                    # 继续读取，直到收到 'ok' 或 'error'
-                
-                # 短暂休眠，避免CPU占用过高
-                time.sleep(0.01)
-                
+
+                # 模式2：等待读取线程收到回复，带超时
+                lines, event = self._wait_for_response(timeout, accept_status=(msg == '?'))
+                result['data'] = lines
+                if event is None:
+                    if msg not in REALTIME_COMMANDS:
+                        self._orphan_responses += 1
+                    result['error'] = f"等待响应超时（{timeout}秒）"
+                elif event.kind in (EVENT_OK, EVENT_STATUS):
+                    result['success'] = True
+                elif event.kind == EVENT_CLOSED:
+                    result['error'] = self.reader.error or "串口已关闭"
+                else:
+                    result['error'] = "GRBL命令测试失败"
+                return result
+
         except serial.SerialException as e:
             result['error'] = f"串口错误: {e}"
             self.disconnect()
             return result
 
     def _send_grbl_command(self, cmd, quiet=False, wait_for_ok=True, timeout=5):
-        if not self.connected or not self.ser:
+        if not self.connected or not self.ser or self.reader is None:
             if not quiet:
                 print("错误：设备未连接。")
             return None
 
         try:
-            self.ser.reset_input_buffer() # 清除输入缓存
-            self.ser.write((cmd + '\n').encode('utf-8'))
-            if not quiet:
-                print(f"发送: {cmd}")
-
-            if wait_for_ok:
-                responses = []
-                start_time = time.time()
-                while True:
-                    if self.ser.in_waiting > 0:
-                        line = self.ser.readline().decode('utf-8').strip()
-                        if not quiet:
-                            print(f"接收: {line}")
-                        responses.append(line)
-                        if 'ok' in line or 'error' in line:
-                            # 如果是状态查询，我们需要解析位置
-                            self._parse_status_report(responses)
-                            return responses
-                    if time.time() - start_time > timeout:
-                        if not quiet:
-                            print(f"错误：等待GRBL响应 '{cmd}' 超时。")
-                        return ["error:timeout"] + responses # 返回错误信息和已收到的响应
-                return responses # Fallback, should be covered by timeout
-            else:
-                time.sleep(0.1) # 短暂等待，确保命令已发送
-                # 即使不等待ok，也尝试读取一下，避免缓冲区填满
-                
-                if self.ser.in_waiting > 0:
-                    line = self.ser.readline().decode('utf-8').strip()
+            with self._command_lock:
+                if cmd in REALTIME_COMMANDS:
+                    # 实时命令不进入接收缓冲区，'?' 的回复是状态报告
+                    self.ser.write(cmd.encode('latin-1'))
                     if not quiet:
-                        print(f"接收 (no wait): {line}")
-                    self._parse_status_report([line]) # 尝试解析
-                return ["sent"] # 表示已发送
+                        print(f"发送实时命令: {cmd!r}")
+                    if cmd != '?' or not wait_for_ok:
+                        return ["sent"]
+                    status = self.reader.wait_for_status(after=time.time() - 0.001, timeout=timeout)
+                    if status is None:
+                        return ["error:timeout"]
+                    self._parse_status_report([status.line])
+                    return [status.line]
+
+                self.ser.write((cmd + '\n').encode('utf-8'))
+                if not quiet:
+                    print(f"发送: {cmd}")
+                if cmd.startswith('$') and '=' in cmd:
+                    self.grbl_settings = None # 设置被修改，下次重新读取
+
+                if not wait_for_ok:
+                    # 回复到达时由 _wait_for_response 丢弃
+                    self._orphan_responses += 1
+                    return ["sent"] # 表示已发送
+
+                responses, event = self._wait_for_response(timeout)
+                if not quiet:
+                    for line in responses:
+                        print(f"接收: {line}")
+                if event is None:
+                    self._orphan_responses += 1
+                    if not quiet:
+                        print(f"错误：等待GRBL响应 '{cmd}' 超时。")
+                    return ["error:timeout"] + responses # 返回错误信息和已收到的响应
+                if event.kind == EVENT_CLOSED:
+                    if not quiet:
+                        print(f"错误：{self.reader.error or '串口已关闭'}")
+                    return ["error:closed"] + responses
+                self._parse_status_report(responses)
+                return responses
         except serial.SerialException as e:
             if not quiet:
                 print(f"串口错误: {e}")
@@ -164,21 +527,68 @@ class GRBLController:
                 print(f"发送命令时发生未知错误: {e}")
             return None
 
+    def _on_serial_event(self, event):
+        """读取线程的事件监听：收到状态报告时更新状态快照"""
+        if event.kind == EVENT_STATUS:
+            self._update_status(event.line, event.timestamp)
+
+    def _update_status(self, line, timestamp=None):
+        """
+        解析状态报告并更新快照和当前位置，返回新的快照（解析失败时返回 None）
+
+        使用相机坐标时（camera_override_active）只更新快照，当前位置以相机为准，不被轮询覆盖
+        """
+        status = parse_status_report(line, previous=self.status, timestamp=timestamp)
+        if status is None:
+            return None
+        # 读取线程可能已经更新了更新的快照，不用旧报告覆盖
+        if self.status is None or status.timestamp >= self.status.timestamp:
+            self.status = status
+            if not self.camera_override_active:
+                self.current_x, self.current_y, self.current_z = status.mpos
+        return status
+
     def _parse_status_report(self, responses):
         """解析GRBL的状态报告，特别是MPos"""
         # 示例: <Idle|MPos:10.000,20.000,-1.000|FS:0,0|WCO:0.000,0.000,0.000>
         # 示例: <Run|MPos:10.123,20.456,-1.000|FS:500,0>
         for resp_line in responses:
-            if 'MPos:' in resp_line:
-                match = re.search(r"MPos:([-\d\.]+),([-\d\.]+),([-\d\.]+)", resp_line)
-                if match:
-                    self.current_x = float(match.group(1))
-                    self.current_y = float(match.group(2))
-                    self.current_z = float(match.group(3))
-
+            if resp_line.startswith('<') and 'Pos:' in resp_line:
+                if self.status is not None and self.status.raw == resp_line.strip():
+                    return True # 读取线程已经解析过
+                if self._update_status(resp_line) is not None:
                     return True
         return False
 
+    def start_status_polling(self, rate_hz=None):
+        """
+        开始按固定频率轮询状态，之后通过 get_status() 读取最新快照
+
+        Args:
+            rate_hz: 轮询频率，默认为 status_poll_hz，范围 1-20 Hz
+        """
+        rate_hz = rate_hz or self.status_poll_hz or DEFAULT_STATUS_POLL_HZ
+        if not (MIN_STATUS_POLL_HZ <= rate_hz <= MAX_STATUS_POLL_HZ):
+            print(f"错误：状态轮询频率应在 {MIN_STATUS_POLL_HZ}-{MAX_STATUS_POLL_HZ} Hz 之间。")
+            return False
+        if not self.connected or self.reader is None:
+            print("错误：设备未连接。")
+            return False
+        self.stop_status_polling()
+        self.status_poller = GrblStatusPoller(self, rate_hz)
+        self.status_poller.start()
+        return True
+
+    def stop_status_polling(self):
+        """停止状态轮询"""
+        if self.status_poller is not None:
+            self.status_poller.stop()
+            self.status_poller = None
+
+    def get_status(self):
+        """返回最近一次的状态快照 MachineStatus（不访问串口），还没有收到过状态报告时返回 None"""
+        return self.status
+
     # 1. 查看当前有多少可以连接的com口，并返回
     def list_available_ports(self):
         ports = serial.tools.list_ports.comports()
@@ -204,19 +614,22 @@ class GRBLController:
             print("设备已连接。")
             return True
         try:
-            self.ser = serial.Serial(port, self.baudrate, timeout=1)
-            time.sleep(2) # 等待GRBL初始化
+            self.ser = self.serial_factory(port, self.baudrate, timeout=1)
+            time.sleep(getattr(self.ser, 'boot_delay', 2)) # 等待GRBL初始化（模拟设备不需要等待）
             if not self.ser:
                 print("错误：未能打开串口。")
                 return False
 
             self.ser.flushInput()
             self.ser.flushOutput()
+            self.grbl_settings = None
+            # 之后串口只由读取线程读取
+            self._start_reader()
 
             # 发送一个软复位或唤醒字符 (GRBL通常在连接后需要一个换行符或Ctrl-X)
-            self._send_ser_msg("\r\n\r\n", wait_for_response="false") # 发送几个换行符尝试唤醒
+            self.ser.write(b"\r\n\r\n") # 发送几个换行符尝试唤醒
             time.sleep(0.5)
-            self.ser.flushInput() # 清空可能的回显
+            self._drain_responses() # 清空可能的回显
 
             # 尝试发送一个简单的命令并检查响应
             initial_status = self._send_ser_msg("?") # 查询状态
@@ -228,8 +641,11 @@ class GRBLController:
                 self.set_units_to_mm() # 确保单位是mm
                 self._send_grbl_command("G90", quiet=False) # 设置为绝对坐标模式
                 self.query_grbl_position() # 获取初始位置
+                if self.status_poll_hz:
+                    self.start_status_polling(self.status_poll_hz)
                 return True
             else:
+                self._stop_reader()
                 self.ser.close()
                 self.ser = None
                 self.connected = False
@@ -243,6 +659,7 @@ class GRBLController:
             self.connected = False
             self.status_message = f"连接失败: {e}"
             print(self.status_message)
+            self._stop_reader()
             if self.ser:
                 self.ser.close()
                 self.ser = None
@@ -257,9 +674,11 @@ class GRBLController:
                 self._send_grbl_command("M5", quiet=True, wait_for_ok=False) # Spindle Off (Pen Up if controlled by spindle)
                 time.sleep(0.1)
                 self._send_grbl_command("$X", quiet=True, wait_for_ok=False) # Unlock
+                self._stop_reader()
                 self.ser.close()
             except Exception as e:
                 print(f"关闭串口时发生错误: {e}")
+        self._stop_reader()
         self.ser = None
         self.connected = False
         self.status_message = "未连接"
@@ -409,6 +828,11 @@ class GRBLController:
 
     def query_grbl_position(self):
         """向GRBL查询当前位置并更新内部GRBL坐标 (如果相机覆盖未激活)"""
+        poller = self.status_poller
+        if poller is not None and self.status is not None and self.status.age < 2 * poller.interval:
+            # 轮询得到的快照足够新，不需要再查询
+            self.current_x, self.current_y, self.current_z = self.status.mpos
+            return self.current_x, self.current_y, self.current_z
         response = self._send_grbl_command("?", quiet=True) # '?'是状态查询命令
         if response:
             if not self._parse_status_report(response): #尝试解析
@@ -419,73 +843,68 @@ class GRBLController:
 
 
     # 10. 提供gcode执行器
+    def _parse_gcode(self, gcode_content):
+        """把 G-code 解析为 ParsedProgram（已经解析过的直接返回），从当前位置开始模拟"""
+        if isinstance(gcode_content, ParsedProgram):
+            return gcode_content
+        if isinstance(gcode_content, str):
+            gcode_content = gcode_content.strip().split('\n')
+        return parse_gcode(gcode_content, start=(self.current_x, self.current_y, self.current_z))
+
     def _check_gcode_bounds(self, gcode_lines):
         """
         在执行前检查这个任务执行会不会超出可移动的范围。
-        这是一个简化的检查，只检查G0/G1的X,Y绝对坐标。
-        更复杂的G-code (如G2/G3圆弧，G91相对坐标) 需要更复杂的解析器。
+        支持 G90/G91、G20/G21 和 G2/G3 圆弧（按圆弧实际经过的范围检查）。
+
+        Args:
+            gcode_lines: G-code 行列表、字符串，或 parse_gcode 返回的 ParsedProgram（避免重复解析）
         """
-        temp_x, temp_y = self.current_x, self.current_y # 从当前位置开始模拟
-        is_absolute_mode = True # 假设G90启动
+        program = self._parse_gcode(gcode_lines)
+        for line_number, line, reason in program.errors:
+            print(f"G-code 边界检查警告：第 {line_number} 行 '{line}' {reason}。")
+        if program.extents is None:
+            return True
+        min_x, min_y, max_x, max_y = program.extents
+        if self._is_within_xy_bounds(min_x, min_y) and self._is_within_xy_bounds(max_x, max_y):
+            return True
+        # 找出第一条超出范围的移动
+        for block in program.motions():
+            bx0, by0, bx1, by1 = block.extents
+            if not (self._is_within_xy_bounds(bx0, by0) and self._is_within_xy_bounds(bx1, by1)):
+                print(f"G-code 边界检查失败：第 {block.line_number} 行 '{block.text}' 将导致超出范围。")
+                print(f"模拟位置: X={block.end[0]}, Y={block.end[1]}，移动范围: X({bx0}, {bx1}), Y({by0}, {by1})")
+                return False
+        return False
 
-        for line_num, line_content in enumerate(gcode_lines):
-            line = line_content.strip().upper()
-            if not line or line.startswith('(') or line.startswith('%'): # 跳过空行和注释
-                continue
+    def execute_gcode(self, gcode_content, streaming=False, progress_callback=None):
+        """
+        执行G-code
 
-            if "G90" in line:
-                is_absolute_mode = True
-            elif "G91" in line:
-                is_absolute_mode = False
-
-            # 简化解析: 查找 G0, G1, G00, G01
-            # (G0 X10 Y20 F300)
-            match = re.search(r"G0?[01]\s+", line)
-            if match:
-                x_val, y_val = None, None
-                x_match = re.search(r"X([-\d\.]+)", line)
-                y_match = re.search(r"Y([-\d\.]+)", line)
-
-                if x_match: x_val = float(x_match.group(1))
-                if y_match: y_val = float(y_match.group(1))
-
-                next_x, next_y = temp_x, temp_y
-
-                if is_absolute_mode:
-                    if x_val is not None: next_x = x_val
-                    if y_val is not None: next_y = y_val
-                else: # Relative mode
-                    if x_val is not None: next_x += x_val
-                    if y_val is not None: next_y += y_val
-                
-                if not self._is_within_xy_bounds(next_x, next_y):
-                    print(f"G-code 边界检查失败：第 {line_num+1} 行 '{line_content.strip()}' 将导致超出范围。")
-                    print(f"模拟位置: X={next_x}, Y={next_y}")
-                    return False
-                temp_x, temp_y = next_x, next_y # 更新模拟位置
-        return True
+        Args:
+            gcode_content: G-code 字符串、行列表或 ParsedProgram（streaming 为 True 时也可以是生成器）
+            streaming: 是否使用字符计数协议流式发送（见 stream_gcode），默认逐行等待 ok
+            progress_callback: 流式发送时的进度回调，见 stream_gcode
 
-    def execute_gcode(self, gcode_content):
-        if isinstance(gcode_content, str):
-            gcode_lines = gcode_content.strip().split('\n')
-        elif isinstance(gcode_content, list):
-            gcode_lines = gcode_content
-        else:
+        Returns:
+            bool: 是否全部执行成功
+        """
+        if streaming:
+            return self.stream_gcode(gcode_content, progress_callback=progress_callback)['success']
+
+        if not isinstance(gcode_content, (str, list, ParsedProgram)):
             print("错误: G-code内容格式无效，应为字符串或列表。")
             return False
 
-        if not self._check_gcode_bounds(gcode_lines):
+        program = self._parse_gcode(gcode_content)
+        if not self._check_gcode_bounds(program):
             print("G-code 任务未执行，因超出可移动范围。请检查G-code或可移动范围设置。")
             return False
 
         print("开始执行G-code...")
         success_count = 0
-        for i, line in enumerate(gcode_lines):
-            line = line.strip()
-            if not line or line.startswith('(') or line.startswith('%'): # 跳过空行和注释
-                continue
-
-            print(f"执行G-code行 {i+1}/{len(gcode_lines)}: {line}")
+        for block in program: # 空行和注释已在解析时去掉
+            line = block.text
+            print(f"执行G-code行 {block.line_number}: {line}")
             response = self._send_grbl_command(line, quiet=True) # Gcode执行时可以安静点，只在出错时打印
             if not response or 'ok' not in response[-1].lower():
                 print(f"错误：执行G-code行 '{line}' 失败。响应: {response}")
@@ -499,6 +918,169 @@ class GRBLController:
         self.query_grbl_position() # 执行完毕后更新一下位置
         return True
 
+    @staticmethod
+    def _clean_gcode_line(line):
+        """去掉注释和首尾空白，减少占用GRBL接收缓冲区的字节数；整行都是注释时返回空字符串"""
+        return clean_line(line)
+
+    def stream_gcode(self, gcode_content, progress_callback=None, check_bounds=True, stop_on_error=True, timeout=30,
+                     cancel_event=None):
+        """
+        使用字符计数协议流式发送G-code
+
+        记录已发送但还没有收到 ok/error 的行占用的字节数，只要GRBL的接收缓冲区 (127 字节) 还放得下下一行就立即发送，
+        使规划缓冲区始终有指令可执行；GRBL 按发送顺序逐行回复，回复按顺序与在途的行一一对应。
+
+        Args:
+            gcode_content: G-code 字符串、行列表、生成器或 parse_gcode 返回的 ParsedProgram；check_bounds 为 False 时生成器按需读取，不会一次性展开
+            progress_callback: 进度回调 callback(acked, total, line_number)，每收到一个 ok/error 调用一次；
+                               total 为有效行数，输入为生成器且不做边界检查时为 None
+            check_bounds: 发送前是否检查移动范围
+            stop_on_error: 收到 error 后是否停止发送后续行（已在途的行仍会执行完）
+            timeout: 等待GRBL回复的超时时间（秒），从最近一次收到回复开始计算
+            cancel_event: 可选的 threading.Event，置位后停止发送后续行；由调用方创建，
+                          在其它线程中发送开始之前置位也不会丢失。不传时使用新的标志，可通过 cancel_stream() 取消
+
+        Returns:
+            dict: 执行结果
+                {
+                    'success': bool,  # 是否全部执行成功
+                    'sent': int,      # 已发送的行数
+                    'acked': int,     # 收到 ok 的行数
+                    'errors': list,   # 失败的行 [{'line_number': 行号, 'line': 内容, 'response': GRBL回复}, ...]
+                    'error': str      # 导致中止的错误信息（如果有）
+                }
+        """
+        result = {
+            'success': False,
+            'sent': 0,
+            'acked': 0,
+            'errors': [],
+            'error': None
+        }
+        if not self.connected or not self.ser or self.reader is None:
+            result['error'] = "设备未连接"
+            print("错误：设备未连接。")
+            return result
+
+        if isinstance(gcode_content, str):
+            gcode_content = gcode_content.strip().split('\n')
+        if check_bounds:
+            # 解析一次，边界检查和发送共用解析结果
+            gcode_content = self._parse_gcode(gcode_content)
+            if not self._check_gcode_bounds(gcode_content):
+                result['error'] = "超出可移动范围"
+                print("G-code 任务未执行，因超出可移动范围。请检查G-code或可移动范围设置。")
+                return result
+        total = None
+        if isinstance(gcode_content, ParsedProgram):
+            total = len(gcode_content)
+            numbered_lines = ((block.line_number, block.text) for block in gcode_content)
+        else:
+            if isinstance(gcode_content, (list, tuple)):
+                total = sum(1 for line in gcode_content if self._clean_gcode_line(line))
+            numbered_lines = ((i + 1, self._clean_gcode_line(line)) for i, line in enumerate(gcode_content))
+
+        in_flight = deque()  # (行号, 内容, 占用字节数)
+        buffered = 0
+        halted = False
+
+        def handle_response():
+            """读取并处理一行回复，返回 False 表示超时"""
+            nonlocal buffered, halted
+            try:
+                event = self.reader.responses.get(timeout=timeout)
+            except queue.Empty:
+                return False
+            response = event.line
+            if event.kind in (EVENT_OK, EVENT_ERROR):
+                if self._orphan_responses > 0:
+                    self._orphan_responses -= 1
+                    return True  # 之前放弃等待的命令的回复
+                if not in_flight:
+                    return True  # 不属于本次任务的回复
+                line_number, line, length = in_flight.popleft()
+                buffered -= length
+                if response == 'ok':
+                    result['acked'] += 1
+                else:
+                    result['errors'].append({'line_number': line_number, 'line': line, 'response': response})
+                    print(f"错误：G-code第 {line_number} 行 '{line}' 执行失败。响应: {response}")
+                    if stop_on_error:
+                        halted = True
+                if progress_callback:
+                    progress_callback(result['acked'] + len(result['errors']), total, line_number)
+            elif event.kind == EVENT_ALARM:
+                result['error'] = f"GRBL报警: {response}"
+                halted = True
+            elif event.kind == EVENT_CLOSED:
+                result['error'] = self.reader.error or "串口已关闭"
+                halted = True
+            return True
+
+        if cancel_event is None:
+            cancel_event = threading.Event()
+        print("开始流式执行G-code...")
+        self._command_lock.acquire() # 流式发送期间其它线程的命令需要等待，否则回复无法与行对应
+        self._stream_cancel = cancel_event
+        try:
+            for line_number, line in numbered_lines:
+                if cancel_event.is_set():
+                    result['error'] = "已取消"
+                    halted = True
+                if halted:
+                    break
+                if not line:
+                    continue
+                data = (line + '\n').encode('utf-8')
+                if len(data) > GRBL_RX_BUFFER_SIZE:
+                    result['errors'].append({'line_number': line_number, 'line': line, 'response': "行过长，超出GRBL接收缓冲区"})
+                    result['error'] = f"第 {line_number} 行超出GRBL接收缓冲区大小"
+                    halted = True
+                    break
+                # 缓冲区放不下时，等待最早发送的行被确认
+                while buffered + len(data) > GRBL_RX_BUFFER_SIZE and not halted:
+                    if not handle_response():
+                        result['error'] = f"等待GRBL响应超时（{timeout}秒）"
+                        halted = True
+                if halted:
+                    break
+                self.ser.write(data)
+                in_flight.append((line_number, line, len(data)))
+                buffered += len(data)
+                result['sent'] += 1
+
+            # 等待所有在途的行执行完
+            while in_flight:
+                if not handle_response():
+                    result['error'] = result['error'] or f"等待GRBL响应超时（{timeout}秒）"
+                    break
+                if halted and result['error']:
+                    break
+        except serial.SerialException as e:
+            result['error'] = f"串口错误: {e}"
+            print(result['error'])
+            self.disconnect()
+            return result
+        finally:
+            self._command_lock.release()
+
+        result['success'] = result['error'] is None and not result['errors'] and not in_flight
+        if result['success']:
+            print(f"G-code 流式执行完成。共成功执行 {result['acked']} 行有效指令。")
+        else:
+            print(f"G-code 流式执行未完成: {result['error'] or '部分行执行失败'}")
+        self.query_grbl_position() # 执行完毕后更新一下位置
+        return result
+
+    def cancel_stream(self):
+        """
+        停止正在进行的流式发送（可从其它线程调用），已发送到GRBL缓冲区的行仍会执行完
+
+        只作用于已经开始的发送；需要在发送开始之前就能取消时，向 stream_gcode 传入 cancel_event
+        """
+        self._stream_cancel.set()
+
     # 11. 提供电机使能和失能的接口
     def enable_motors(self):
         # GRBL通常在发送运动指令时自动使能电机。
@@ -559,11 +1141,23 @@ class GRBLController:
             return
         try:
             print("发送软复位 (Ctrl-X)...")
-            self.ser.write(b'\x18') # Ctrl-X character
-            time.sleep(1) # 等待GRBL重启
-            self.ser.flushInput()
-            # GRBL 重启后会打印欢迎信息
-            welcome_msg = self.ser.read_until(b"Grbl").decode('utf-8', errors='ignore')
+            with self._command_lock:
+                self._drain_responses()
+                self.ser.write(b'\x18') # Ctrl-X character
+                # GRBL 重启后会清空缓冲区（之前未回复的命令不会再有回复），并打印欢迎信息
+                self._orphan_responses = 0
+                welcome_msg = ""
+                deadline = time.time() + 3
+                while time.time() < deadline:
+                    try:
+                        event = self.reader.responses.get(timeout=max(0.0, deadline - time.time()))
+                    except queue.Empty:
+                        break
+                    if event.kind == EVENT_CLOSED:
+                        break
+                    if event.kind == EVENT_MESSAGE and event.line.startswith("Grbl"):
+                        welcome_msg = event.line
+                        break
             if "Grbl" in welcome_msg:
                 print("GRBL软复位成功。")
                 # 可能需要重新设置单位和模式
@@ -576,16 +1170,52 @@ class GRBLController:
         except Exception as e:
             print(f"软复位时发生错误: {e}")
 
-    def get_grbl_settings(self):
-        """查询并打印所有GRBL设置 ($$)"""
-        response = self._send_grbl_command("$$")
-        if response:
-            print("GRBL 设置:")
+    def get_grbl_settings(self, refresh=False, quiet=False):
+        """
+        查询并打印所有GRBL设置 ($$)
+
+        结果会被缓存，之后再调用直接返回缓存（通过本控制器修改 $ 设置或重新连接后会重新读取）。
+
+        Args:
+            refresh: 是否忽略缓存重新查询
+            quiet: 是否不打印设置
+
+        Returns:
+            dict: {编号: 数值}，例如 {110: 500.0, 120: 10.0}；查询失败时返回 None
+        """
+        if self.grbl_settings is not None and not refresh:
+            return self.grbl_settings
+        response = self._send_grbl_command("$$", quiet=quiet)
+        if response and response[-1] == 'ok':
+            settings = {}
+            if not quiet:
+                print("GRBL 设置:")
             for line in response:
-                if line.startswith("$") and "=" in line: # 过滤掉 'ok'
-                    print(line)
-        else:
-            print("查询GRBL设置失败。")
+                match = re.match(r"\$(\d+)=([-\d\.]+)", line) # 过滤掉 'ok'
+                if match:
+                    settings[int(match.group(1))] = float(match.group(2))
+                    if not quiet:
+                        print(line)
+            self.grbl_settings = settings
+            return settings
+        print("查询GRBL设置失败。")
+        return None
+
+    def estimate_gcode(self, gcode_content, per_segment=False):
+        """
+        估算G-code任务的执行时间和移动距离（见 gcode.estimator.estimate_gcode）
+
+        使用GRBL中实际的速度、加速度设置（读取一次后缓存）；未连接时按GRBL出厂设置估算。
+
+        Args:
+            gcode_content: G-code 字符串、行列表或 ParsedProgram
+            per_segment: 是否返回每行的用时
+        """
+        settings = self.get_grbl_settings(quiet=True) if self.connected else None
+        return estimate_gcode(
+            self._parse_gcode(gcode_content), settings,
+            z_pen_down=self.z_pen_down_value, z_pen_up=self.z_pen_up_value, per_segment=per_segment
+        )
 
 # 创建默认实例
 default_grbl = GRBLController()
@@ -0,0 +1,346 @@
+import threading
+import time
+from collections import deque
+import serial
+from typing import Callable, Dict, Iterable, Union
+from app.core.gcode.parser import parse_words
+
+# 与GRBL 1.1 (ATmega328p) 一致的缓冲区大小
+RX_BUFFER_SIZE = 127
+PLANNER_BLOCKS = 15
+WELCOME_MESSAGE = "Grbl 1.1h ['$' for help]"
+
+# 默认的GRBL设置 ($$)
+DEFAULT_SETTINGS = {
+    0: 10, 1: 25, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 10: 1, 11: 0.010, 12: 0.002, 13: 0,
+    20: 0, 21: 0, 22: 0, 23: 0, 24: 25.0, 25: 500.0, 26: 250, 27: 1.0, 30: 1000, 31: 0, 32: 0,
+    100: 250.0, 101: 250.0, 102: 250.0, 110: 500.0, 111: 500.0, 112: 500.0,
+    120: 10.0, 121: 10.0, 122: 10.0, 130: 200.0, 131: 200.0, 132: 200.0,
+}
+# 模拟器接受的字母，其它字母返回 error:20
+_SUPPORTED_LETTERS = set("GMXYZFIJKRPSTNL")
+# 需要等规划缓冲区执行完才回复 ok 的指令（GRBL 中的同步指令）
+_SYNC_GCODES = {4.0, 10.0, 28.0, 30.0, 92.0}
+
+
+class SimulatedGrbl:
+    """
+    模拟的GRBL设备，可以代替 serial.Serial 传给 GRBLController(serial_factory=...)
+
+    模拟的行为:
+        - 127 字节的串口接收缓冲区：超出部分被丢弃并计入 overflow_bytes（真实设备上会造成丢行）
+        - 15 块的规划缓冲区：运动指令放入规划缓冲区后立即回复 ok，缓冲区满时暂停读取后续行；
+          $ 命令、G4/G10/G28/G30/G92 等同步指令要等缓冲区执行完才回复
+        - 实时命令：'?' 立即回复状态报告，'!' 暂停，'~' 继续，Ctrl-X 复位（清空缓冲区并输出欢迎信息）
+        - 每块的执行时间由 exec_time 指定，可以是秒数或 callable(line) -> 秒数
+        - error_lines 中的行（按去掉首尾空白后的内容匹配）回复 error:20，用于测试出错处理
+
+    只实现 GRBLController 用到的 serial.Serial 接口: write / readline / flushInput / flushOutput /
+    reset_input_buffer / in_waiting / is_open / close。
+    """
+
+    # 模拟器不需要像真实设备那样在打开串口后等待 GRBL 启动
+    boot_delay = 0
+
+    def __init__(self, port: str = "SIM", baudrate: int = 115200, timeout: float = 1,
+                 exec_time: Union[float, Callable[[str], float]] = 0.001,
+                 planner_blocks: int = PLANNER_BLOCKS, rx_buffer_size: int = RX_BUFFER_SIZE,
+                 settings: Dict[int, float] = None, error_lines: Iterable[str] = ()):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.exec_time = exec_time
+        self.planner_blocks = planner_blocks
+        self.rx_buffer_size = rx_buffer_size
+        self.settings = dict(DEFAULT_SETTINGS if settings is None else settings)
+        self.error_lines = set(error_lines)
+        self.is_open = True
+
+        self._lock = threading.Condition()
+        self._rx = bytearray()           # 串口接收缓冲区
+        self._planner = deque()          # 规划缓冲区 [(行内容, 终点)]
+        self._output = deque()           # 待读取的回复
+        self._hold = False
+        self._executing = None           # 正在执行的块
+        self._position = [0.0, 0.0, 0.0]
+        self._planned_position = [0.0, 0.0, 0.0]  # 已进入规划缓冲区的最后一块的终点
+        self._absolute = True
+        self._feed = 0.0
+        self._reset_count = 0
+
+        # 统计
+        self.lines_received = 0
+        self.blocks_executed = 0
+        self.max_rx_used = 0
+        self.overflow_bytes = 0
+        self.planner_starved = 0         # 执行完一块后规划缓冲区为空、只能停下等待的次数
+        self.executed = []               # 执行完的运动块 [(行内容, 终点)]，用于检查实际走过的路径
+
+        self._output.append(WELCOME_MESSAGE)
+        self._protocol_thread = threading.Thread(target=self._protocol_loop, name="grbl-sim-protocol", daemon=True)
+        self._stepper_thread = threading.Thread(target=self._stepper_loop, name="grbl-sim-stepper", daemon=True)
+        self._protocol_thread.start()
+        self._stepper_thread.start()
+
+    # ---- serial.Serial 接口 ----
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+        with self._lock:
+            for byte in data:
+                char = chr(byte)
+                if char == '?':
+                    self._output.append(self._status_report())
+                elif char == '!':
+                    self._hold = True
+                elif char == '~':
+                    self._hold = False
+                elif char == '\x18':
+                    self._reset()
+                elif len(self._rx) < self.rx_buffer_size:
+                    self._rx.append(byte)
+                    self.max_rx_used = max(self.max_rx_used, len(self._rx))
+                else:
+                    self.overflow_bytes += 1
+            self._lock.notify_all()
+        return len(data)
+
+    def readline(self) -> bytes:
+        deadline = time.time() + (self.timeout if self.timeout is not None else 1e9)
+        with self._lock:
+            while not self._output:
+                if not self.is_open:
+                    raise serial.SerialException("Attempting to use a port that is not open")
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return b""
+                self._lock.wait(remaining)
+            return (self._output.popleft() + "\r\n").encode('utf-8')
+
+    @property
+    def in_waiting(self) -> int:
+        with self._lock:
+            return sum(len(line) + 2 for line in self._output)
+
+    def flushInput(self):
+        with self._lock:
+            self._output.clear()
+
+    reset_input_buffer = flushInput
+
+    def flushOutput(self):
+        pass
+
+    reset_output_buffer = flushOutput
+
+    def close(self):
+        with self._lock:
+            self.is_open = False
+            self._lock.notify_all()
+
+    # ---- 模拟 ----
+
+    def _reset(self):
+        """软复位（调用时已持有锁）"""
+        self._rx.clear()
+        self._planner.clear()
+        self._output.clear()
+        self._hold = False
+        self._executing = None  # 正在执行的块被中止，执行线程醒来后不再更新位置
+        self._planned_position = list(self._position)
+        self._reset_count += 1
+        self._output.append(WELCOME_MESSAGE)
+
+    def _status_report(self) -> str:
+        """状态报告（调用时已持有锁）"""
+        if self._hold and (self._planner or self._executing):
+            state = "Hold:0"
+        elif self._planner or self._executing:
+            state = "Run"
+        else:
+            state = "Idle"
+        x, y, z = self._position
+        planner_free = self.planner_blocks - len(self._planner)
+        rx_free = self.rx_buffer_size - len(self._rx)
+        return f"<{state}|MPos:{x:.3f},{y:.3f},{z:.3f}|Bf:{planner_free},{rx_free}|FS:{self._feed:g},0>"
+
+    def _reply(self, message: str):
+        with self._lock:
+            self._output.append(message)
+            self._lock.notify_all()
+
+    def _wait_planner_empty(self, reset_count: int) -> bool:
+        """等待规划缓冲区执行完，期间发生复位时返回 False"""
+        with self._lock:
+            while (self._planner or self._executing) and self.is_open and self._reset_count == reset_count:
+                self._lock.wait(0.05)
+            return self.is_open and self._reset_count == reset_count
+
+    def _execute_system_command(self, line: str) -> str:
+        """$ 命令，返回最后的回复"""
+        if line == '$$':
+            for key in sorted(self.settings):
+                self._reply(f"${key}={self.settings[key]:g}" if isinstance(self.settings[key], int)
+                            else f"${key}={self.settings[key]:.3f}")
+            return "ok"
+        if line in ('$X', '$H', '$SLP', '$C', '$#', '$I', '$N'):
+            return "ok"
+        if line == '$G':
+            self._reply(f"[GC:G0 G54 G17 G21 {'G90' if self._absolute else 'G91'} G94 M5 M9 T0 F{self._feed:g} S0]")
+            return "ok"
+        if '=' in line:
+            key, _, value = line[1:].partition('=')
+            try:
+                self.settings[int(key)] = float(value)
+            except ValueError:
+                return "error:3"
+            return "ok"
+        return "error:3"
+
+    def _plan_line(self, line: str):
+        """解析一行 G-code，返回 (回复, 要放入规划缓冲区的块或 None, 是否为同步指令)"""
+        if line in self.error_lines:
+            return "error:20", None, False
+        gcodes, words = parse_words(line)
+        letters = {c for c in line.upper() if c.isalpha()}
+        if letters - _SUPPORTED_LETTERS or (not gcodes and not words):
+            return "error:20", None, False
+        sync = bool(_SYNC_GCODES & set(gcodes))
+        for code in gcodes:
+            if code == 90.0:
+                self._absolute = True
+            elif code == 91.0:
+                self._absolute = False
+        if 'F' in words:
+            self._feed = words['F']
+        if not ('X' in words or 'Y' in words or 'Z' in words) or 92.0 in gcodes:
+            if 92.0 in gcodes:
+                with self._lock:
+                    for k, axis in enumerate('XYZ'):
+                        if axis in words:
+                            self._position[k] = self._planned_position[k] = words[axis]
+            if 4.0 in gcodes:
+                return "ok", (line, None), True
+            return "ok", None, sync
+        target = list(self._planned_position)
+        for k, axis in enumerate('XYZ'):
+            if axis in words:
+                target[k] = words[axis] if self._absolute else target[k] + words[axis]
+        self._planned_position = target
+        return "ok", (line, tuple(target)), sync
+
+    def _protocol_loop(self):
+        """主循环：逐行读取接收缓冲区，规划后回复"""
+        while True:
+            with self._lock:
+                while self.is_open and b'\n' not in self._rx:
+                    self._lock.wait(0.05)
+                if not self.is_open:
+                    return
+                index = self._rx.index(b'\n')
+                raw = bytes(self._rx[:index])
+                del self._rx[:index + 1]
+                reset_count = self._reset_count
+                self.lines_received += 1
+            line = raw.decode('utf-8', errors='ignore').strip()
+            if not line:
+                self._reply("ok")
+                continue
+            if line.startswith('$'):
+                if not self._wait_planner_empty(reset_count):
+                    continue
+                self._reply(self._execute_system_command(line))
+                continue
+            reply, block, sync = self._plan_line(line)
+            if sync and not self._wait_planner_empty(reset_count):
+                continue
+            if block is not None:
+                with self._lock:
+                    # 规划缓冲区满时暂停读取，直到执行完一块
+                    while len(self._planner) >= self.planner_blocks and self.is_open and self._reset_count == reset_count:
+                        self._lock.wait(0.05)
+                    if self._reset_count != reset_count:
+                        continue
+                    self._planner.append(block)
+                    self._lock.notify_all()
+            if sync and block is not None and not self._wait_planner_empty(reset_count):
+                continue
+            self._reply(reply)
+
+    def _stepper_loop(self):
+        """执行规划缓冲区中的块"""
+        while True:
+            with self._lock:
+                while self.is_open and (not self._planner or self._hold):
+                    self._lock.wait(0.05)
+                if not self.is_open:
+                    return
+                line, target = self._planner.popleft()
+                self._executing = line
+                reset_count = self._reset_count
+                self._lock.notify_all()
+            duration = self.exec_time(line) if callable(self.exec_time) else self.exec_time
+            if target is None and line:
+                # G4 暂停
+                duration = parse_words(line)[1].get('P', 0.0)
+            time.sleep(duration)
+            with self._lock:
+                while self._hold and self.is_open and self._reset_count == reset_count:
+                    self._lock.wait(0.05)
+                if self._reset_count == reset_count and target is not None:
+                    self._position = list(target)
+                    self.executed.append((line, target))
+                self._executing = None
+                self.blocks_executed += 1
+                if not self._planner:
+                    self.planner_starved += 1
+                self._lock.notify_all()
+
+
+def simulated_serial_factory(**options) -> Callable[..., SimulatedGrbl]:
+    """
+    返回可以传给 GRBLController(serial_factory=...) 的工厂函数
+
+    参数:
+        options: 传给 SimulatedGrbl 的参数，例如 exec_time、error_lines
+    """
+    def factory(port, baudrate=115200, timeout=1):
+        return SimulatedGrbl(port, baudrate, timeout, **options)
+    return factory
+
+
+def _benchmark(lines: int = 2000, exec_time: float = 0.001):
+    """对比逐行等待 ok 和字符计数流式发送的吞吐量"""
+    from app.core.grbl_controller import GRBLController
+
+    program = ["G21", "G90"] + [f"G1 X{(i % 100) * 0.5:.3f} Y{(i // 100) * 0.5:.3f} F3000" for i in range(lines)]
+    for streaming in (False, True):
+        # 逐行发送每行之后固定等待 0.05 秒，只取前 200 行测试
+        job = program if streaming else program[:200]
+        controller = GRBLController(serial_factory=simulated_serial_factory(exec_time=exec_time), auto_connect=False)
+        controller.status_poll_hz = 0
+        controller.set_xy_movable_range(-1000, 1000, -1000, 1000)
+        controller.connect("SIM")
+        device = controller.ser
+        started = time.perf_counter()
+        if streaming:
+            success = controller.stream_gcode(job)['success']
+        else:
+            success = controller.execute_gcode(job)
+        elapsed = time.perf_counter() - started
+        mode = "流式发送" if streaming else "逐行发送"
+        print(f"{mode}: {len(job)} 行，用时 {elapsed:.2f} 秒，{len(job) / elapsed:.0f} 行/秒，"
+              f"成功: {success}，规划缓冲区空转 {device.planner_starved} 次，"
+              f"接收缓冲区最多占用 {device.max_rx_used} 字节，溢出 {device.overflow_bytes} 字节")
+        controller.disconnect()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="GRBL模拟器：测试G-code发送的吞吐量")
+    parser.add_argument("--lines", type=int, default=2000, help="测试的G-code行数")
+    parser.add_argument("--exec-time", type=float, default=0.001, help="每块的执行时间（秒）")
+    args = parser.parse_args()
+    _benchmark(args.lines, args.exec_time)
@@ -0,0 +1,59 @@
+import string
+
+# 字符类别
+CHAR_OTHER = 0        # 英文字母、数字及其它字符
+CHAR_CHINESE = 1      # 中文字符
+CHAR_PUNCTUATION = 2  # 中英文标点符号
+
+# 额外按符号处理的字符（常见的全角引号、书名号、括号、破折号等）
+EXTRA_PUNCTUATION = "“”‘’\"「」『』《》（）【】—–-…"
+
+
+def _build_bmp_table() -> bytearray:
+    """构建基本多文种平面 (BMP) 内所有字符的类别表，每个字符占一个字节"""
+    table = bytearray(0x10000)
+    # 中文字符范围
+    table[0x4E00:0xA000] = bytes([CHAR_CHINESE]) * (0xA000 - 0x4E00)
+    # 中文标点符号范围（CJK 符号和标点、全角 ASCII 及半角片假名等）
+    table[0x3000:0x3040] = bytes([CHAR_PUNCTUATION]) * (0x3040 - 0x3000)
+    table[0xFF00:0xFFF0] = bytes([CHAR_PUNCTUATION]) * (0xFFF0 - 0xFF00)
+    # 英文标点符号及额外的符号
+    for char in string.punctuation + EXTRA_PUNCTUATION:
+        table[ord(char)] = CHAR_PUNCTUATION
+    return table
+
+
+# 模块导入时构建一次，之后所有查询都是 O(1) 的字节索引
+_BMP_CLASS_TABLE = _build_bmp_table()
+
+
+def char_class(char: str) -> int:
+    """
+    返回单个字符的类别：CHAR_OTHER、CHAR_CHINESE 或 CHAR_PUNCTUATION
+
+    BMP 之外的字符（例如表情符号、扩展区汉字）按 CHAR_OTHER 处理
+    """
+    code = ord(char)
+    if code < 0x10000:
+        return _BMP_CLASS_TABLE[code]
+    return CHAR_OTHER
+
+
+def is_chinese(char: str) -> bool:
+    """判断字符是否为中文字符（不包括中文标点符号）"""
+    return char_class(char) == CHAR_CHINESE
+
+
+def is_punctuation(char: str) -> bool:
+    """判断字符是否为中英文标点符号"""
+    return char_class(char) == CHAR_PUNCTUATION
+
+
+def classify_text(text: str) -> bytes:
+    """
+    返回文本中每个字符的类别，结果的第 i 个字节对应 text[i]
+
+    适合需要对整段文本做多次类别判断的排版代码
+    """
+    table = _BMP_CLASS_TABLE
+    return bytes(table[code] if code < 0x10000 else CHAR_OTHER for code in map(ord, text))
@@ -0,0 +1,70 @@
+import numpy as np
+from PIL import Image
+
+
+def glyph_to_alpha(glyph: Image.Image) -> np.ndarray:
+    """
+    将 handright 渲染出的 RGBA 字形转换为 uint8 透明度蒙版
+
+    手写字只有一种墨水颜色，因此只需要保留 alpha 通道
+    """
+    if glyph.mode != "RGBA":
+        glyph = glyph.convert("RGBA")
+    return np.asarray(glyph.getchannel("A"), dtype=np.uint8)
+
+
+def new_ink_layer(height: int, width: int) -> np.ndarray:
+    """创建一个空的墨迹层（单通道 uint8 透明度）"""
+    return np.zeros((height, width), dtype=np.uint8)
+
+
+def composite_alpha(ink: np.ndarray, alpha: np.ndarray, x: int, y: int) -> None:
+    """
+    把一个字形（或图块）的透明度蒙版按 "over" 规则叠加到墨迹层上，原地修改 ink
+
+    a = a_ink + a_glyph * (1 - a_ink)，超出墨迹层边界的部分会被裁掉
+
+    参数:
+        ink: 墨迹层，形状为 (高, 宽)
+        alpha: 字形透明度蒙版
+        x, y: 字形左上角在墨迹层中的坐标，可以为负
+    """
+    h, w = alpha.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, ink.shape[1]), min(y + h, ink.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+    src = alpha[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.uint16)
+    dst = ink[y0:y1, x0:x1]
+    blended = dst + (src * (255 - dst.astype(np.uint16)) + 127) // 255
+    dst[...] = blended.astype(np.uint8)
+
+
+def apply_ink(image_bgr: np.ndarray, ink: np.ndarray, color=(0, 0, 0), inplace: bool = False) -> np.ndarray:
+    """
+    使用墨迹层给 BGR 图片上色：out = img * (1 - a) + color * a
+
+    只处理墨迹层中有内容的矩形区域，使用整数运算，避免整图转换为浮点或 PIL 图像
+
+    参数:
+        image_bgr: OpenCV 格式的 BGR 图片
+        ink: 与图片同尺寸的墨迹层
+        color: 墨水颜色 (B, G, R)
+        inplace: 是否直接修改传入的图片
+
+    返回:
+        上色后的图片
+    """
+    result = image_bgr if inplace else image_bgr.copy()
+    rows = np.flatnonzero(ink.any(axis=1))
+    if rows.size == 0:
+        return result
+    cols = np.flatnonzero(ink.any(axis=0))
+    y0, y1 = rows[0], rows[-1] + 1
+    x0, x1 = cols[0], cols[-1] + 1
+
+    a = ink[y0:y1, x0:x1, None].astype(np.uint16)
+    region = result[y0:y1, x0:x1]
+    ink_color = np.asarray(color, dtype=np.uint16)
+    region[...] = ((region * (255 - a) + ink_color * a + 127) // 255).astype(np.uint8)
+    return result
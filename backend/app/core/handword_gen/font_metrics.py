@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+from typing import Dict, Iterable, Tuple
+from app.core.handword_gen.template_registry import get_template_registry
+
+# 字宽缓存文件的默认存放目录
+FONT_METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "font_metrics")
+
+# 测量字宽时使用的字号，字号越大测量结果越精确，结果再按比例缩放到目标字号
+MEASURE_FONT_SIZE = 256
+
+# 手写字形在目标字号下的实际字身大小（渲染时字号与画布比例为 12:13）
+GLYPH_EM_RATIO = 12 / 13
+
+
+class AdvanceWidthCache:
+    """
+    某个字体在某个字号下的字符步进宽度缓存
+
+    字宽在第一次用到时从字体中测量，之后直接查表；可以保存到磁盘，
+    下次启动时直接加载，字体文件变化时自动失效。
+    """
+
+    def __init__(self, font_path: str, font_size: int, cache_dir: str = FONT_METRICS_DIR):
+        """
+        参数:
+            font_path: 字体文件路径
+            font_size: 排版使用的字号（像素），与 calculate_text_positions_with_wrap 的 font_size 一致
+            cache_dir: 字宽缓存文件目录，为 None 时不持久化
+        """
+        self.font_path = font_path
+        self.font_size = font_size
+        self.cache_dir = cache_dir
+        self._widths: Dict[str, float] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._scale = font_size * GLYPH_EM_RATIO / MEASURE_FONT_SIZE
+        self.load()
+
+    def _cache_file(self) -> str:
+        name = os.path.splitext(os.path.basename(self.font_path))[0]
+        return os.path.join(self.cache_dir, f"{name}_{self.font_size}.json")
+
+    def _font_signature(self) -> Tuple[float, int]:
+        stat = os.stat(self.font_path)
+        return stat.st_mtime, stat.st_size
+
+    def width(self, char: str) -> float:
+        """返回单个字符的步进宽度（像素）"""
+        width = self._widths.get(char)
+        if width is None:
+            font = get_template_registry().get_font(self.font_path, MEASURE_FONT_SIZE)
+            width = font.getlength(char) * self._scale
+            with self._lock:
+                self._widths[char] = width
+                self._dirty = True
+        return width
+
+    def widths_for(self, text: Iterable[str]) -> Dict[str, float]:
+        """返回文本中所有不同字符的字宽表"""
+        return {char: self.width(char) for char in set(text) if char != '\n'}
+
+    def load(self) -> bool:
+        """从磁盘加载字宽缓存，字体文件发生变化时忽略旧缓存"""
+        if not self.cache_dir:
+            return False
+        path = self._cache_file()
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if list(self._font_signature()) != data.get("font_signature"):
+                return False
+            with self._lock:
+                self._widths.update(data.get("widths", {}))
+            return True
+        except (OSError, ValueError) as e:
+            print(f"加载字宽缓存失败: {e}")
+            return False
+
+    def save(self, force: bool = False) -> bool:
+        """把字宽缓存写入磁盘，没有新测量的字符时不写"""
+        if not self.cache_dir or not (self._dirty or force):
+            return False
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with self._lock:
+                data = {
+                    "font_path": self.font_path,
+                    "font_size": self.font_size,
+                    "font_signature": list(self._font_signature()),
+                    "widths": dict(self._widths),
+                }
+                self._dirty = False
+            path = self._cache_file()
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)  # 原子替换，避免多个进程同时写出半个文件
+            return True
+        except OSError as e:
+            print(f"保存字宽缓存失败: {e}")
+            return False
+
+
+class FontMetricsRegistry:
+    """按 (字体, 字号) 管理 AdvanceWidthCache 实例"""
+
+    def __init__(self, cache_dir: str = FONT_METRICS_DIR):
+        self.cache_dir = cache_dir
+        self._caches: Dict[Tuple[str, int], AdvanceWidthCache] = {}
+        self._lock = threading.Lock()
+
+    def get(self, font_path: str, font_size: int) -> AdvanceWidthCache:
+        """获取指定字体和字号的字宽缓存"""
+        key = (font_path, int(font_size))
+        with self._lock:
+            cache = self._caches.get(key)
+            if cache is None:
+                cache = AdvanceWidthCache(font_path, int(font_size), self.cache_dir)
+                self._caches[key] = cache
+            return cache
+
+    def save_all(self) -> None:
+        """保存所有有新测量结果的字宽缓存"""
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            cache.save()
+
+
+# 创建默认字宽缓存注册表实例
+default_font_metrics = FontMetricsRegistry()
+
+def get_font_metrics() -> FontMetricsRegistry:
+    """获取默认字宽缓存注册表实例"""
+    return default_font_metrics
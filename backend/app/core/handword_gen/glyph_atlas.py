@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# 字形图集的默认存放目录
+GLYPH_ATLAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "glyph_atlas")
+
+# 常用中文标点
+COMMON_PUNCTUATION = "，。、；：？！“”‘’（）《》【】「」『』—…·～"
+
+
+def gb2312_level1_chars() -> str:
+    """返回 GB2312 一级汉字（3755 个常用汉字）"""
+    chars = []
+    for high in range(0xB0, 0xD8):
+        # 0xD7 区只到 0xF9
+        last = 0xF9 if high == 0xD7 else 0xFE
+        for low in range(0xA1, last + 1):
+            chars.append(bytes([high, low]).decode("gb2312"))
+    return "".join(chars)
+
+
+def default_charset() -> str:
+    """图集默认包含的字符：可打印 ASCII、常用中文标点和 GB2312 一级汉字"""
+    ascii_chars = "".join(chr(code) for code in range(0x21, 0x7F))
+    return ascii_chars + COMMON_PUNCTUATION + gb2312_level1_chars()
+
+
+def atlas_name(font_path: str, font_size: int, quality: str) -> str:
+    """图集文件名（不含扩展名），由字体、字号和渲染质量决定"""
+    font_name = os.path.splitext(os.path.basename(font_path))[0]
+    return f"{font_name}_{font_size}_{quality}"
+
+
+def font_fingerprint(font_path: str) -> Optional[str]:
+    """字体文件内容的 SHA-256，用于判断图集是否由当前字体生成；读取失败时返回 None"""
+    digest = hashlib.sha256()
+    try:
+        with open(font_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class GlyphAtlas:
+    """
+    预渲染的手写字形图集（只读）
+
+    图集由两个文件组成:
+        <name>.npy  -- 形状为 (字形数, 字号, 字号) 的 uint8 透明度数组，以内存映射方式打开
+        <name>.json -- 索引，记录字体、字体文件的 SHA-256、字号、渲染质量以及每个字符的 [起始下标, 变体数]
+    读取字形时直接返回内存映射数组的切片，不复制数据；多个进程打开同一个图集时共享操作系统的页缓存。
+    """
+
+    def __init__(self, path: str):
+        """
+        参数:
+            path: 图集路径（不含扩展名）
+        """
+        with open(f"{path}.json", "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.path = path
+        self.font_path = index["font_path"]
+        self.font_sha256 = index.get("font_sha256")  # 旧版本的图集没有记录
+        self.font_size = index["font_size"]
+        self.quality = index["quality"]
+        self.variants = index["variants"]
+        self._offsets: Dict[str, Tuple[int, int]] = {char: tuple(entry) for char, entry in index["chars"].items()}
+        self.glyphs = np.load(f"{path}.npy", mmap_mode="r")
+
+    def __contains__(self, char: str) -> bool:
+        return char in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def get(self, char: str, variant: int = None) -> Optional[np.ndarray]:
+        """
+        获取字符的一个变体，图集中没有该字符时返回 None
+
+        参数:
+            char: 字符
+            variant: 变体编号，默认随机选择
+        """
+        entry = self._offsets.get(char)
+        if entry is None:
+            return None
+        offset, count = entry
+        if variant is None:
+            variant = random.randrange(count)
+        return self.glyphs[offset + variant % count]
+
+
+# 已打开的图集，按 (字体, 字号, 渲染质量) 缓存；找不到图集文件时缓存 None，避免重复检查磁盘
+_atlases: Dict[Tuple[str, int, str], Optional[GlyphAtlas]] = {}
+_atlases_lock = threading.Lock()
+
+def get_glyph_atlas(font_path: str, font_size: int, quality: str, atlas_dir: str = GLYPH_ATLAS_DIR) -> Optional[GlyphAtlas]:
+    """
+    获取与字体、字号、渲染质量匹配的图集，没有构建过图集时返回 None
+
+    图集文件名只由字体文件名决定，同名字体文件被替换后，记录的字体哈希不再一致，此时忽略旧图集（返回 None，
+    改为逐字渲染），需要重新运行 build_glyph_atlas 构建
+    """
+    key = (font_path, font_size, quality)
+    with _atlases_lock:
+        if key in _atlases:
+            return _atlases[key]
+        atlas = None
+        path = os.path.join(atlas_dir, atlas_name(font_path, font_size, quality))
+        if os.path.exists(f"{path}.json") and os.path.exists(f"{path}.npy"):
+            try:
+                atlas = GlyphAtlas(path)
+                if (atlas.font_size, atlas.quality) != (font_size, quality):
+                    print(f"字形图集 {path} 的字号或渲染质量不匹配，已忽略")
+                    atlas = None
+                elif atlas.font_sha256 != font_fingerprint(font_path):
+                    print(f"字形图集 {path} 不是由当前字体文件生成的，已忽略，请重新构建: "
+                          f"python -m app.core.handword_gen.glyph_atlas --font {font_path} --size {font_size} --quality {quality}")
+                    atlas = None
+            except (OSError, ValueError, KeyError) as e:
+                print(f"加载字形图集失败: {e}")
+                atlas = None
+        _atlases[key] = atlas
+        return atlas
+
+
+def _render_atlas_chunk(args) -> List[np.ndarray]:
+    """渲染一批字符的所有变体（可在子进程中执行）"""
+    # 延迟导入，避免与 hw_converter 循环导入
+    from app.core.handword_gen.glyph_cache import GlyphCache
+    from app.core.handword_gen.hw_converter import QUALITY_TIERS, _get_glyph_template, _render_glyph
+    from app.core.handword_gen.template_registry import get_template_registry
+
+    chars, font_path, font_size, quality, variants = args
+    template = _get_glyph_template(get_template_registry(), font_path, font_size, quality)
+    resample = QUALITY_TIERS[quality]['resample']
+    glyphs = []
+    for char in chars:
+        for variant in range(variants):
+            seed = GlyphCache.variant_seed(char, variant)
+            glyphs.append(_render_glyph(char, template, font_size, resample, seed))
+    return glyphs
+
+
+def build_glyph_atlas(font_path: str, font_size: int = 16, quality: str = "high", variants: int = 3,
+                      charset: Iterable[str] = None, atlas_dir: str = GLYPH_ATLAS_DIR, workers: int = None) -> str:
+    """
+    离线构建字形图集
+
+    参数:
+        font_path: 手写字体文件路径
+        font_size: 目标字号，需要与 gen_handwriter_image 使用的字号一致
+        quality: 渲染质量档位
+        variants: 每个字符的随机变体数量
+        charset: 要预渲染的字符，默认为 default_charset()
+        atlas_dir: 图集输出目录
+        workers: 并行渲染的进程数，默认使用全部 CPU
+
+    返回:
+        图集路径（不含扩展名）
+    """
+    chars = list(dict.fromkeys(c for c in (charset if charset is not None else default_charset()) if not c.isspace()))
+    os.makedirs(atlas_dir, exist_ok=True)
+    path = os.path.join(atlas_dir, atlas_name(font_path, font_size, quality))
+
+    glyphs = np.lib.format.open_memmap(
+        f"{path}.npy.tmp", mode="w+", dtype=np.uint8, shape=(len(chars) * variants, font_size, font_size)
+    )
+    chunk_size = 64
+    chunks = [(chars[i:i + chunk_size], font_path, font_size, quality, variants) for i in range(0, len(chars), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        position = 0
+        for i, chunk_glyphs in enumerate(executor.map(_render_atlas_chunk, chunks)):
+            for glyph in chunk_glyphs:
+                glyphs[position] = glyph
+                position += 1
+            print(f"已渲染 {min((i + 1) * chunk_size, len(chars))}/{len(chars)} 个字符")
+    glyphs.flush()
+    del glyphs
+
+    index = {
+        "font_path": font_path,
+        "font_sha256": font_fingerprint(font_path),
+        "font_size": font_size,
+        "quality": quality,
+        "variants": variants,
+        "chars": {char: [i * variants, variants] for i, char in enumerate(chars)},
+    }
+    os.replace(f"{path}.npy.tmp", f"{path}.npy")
+    with open(f"{path}.json", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    print(f"字形图集已保存到: {path}.npy / {path}.json，共 {len(chars)} 个字符")
+    return path
+
+
+if __name__ == "__main__":
+    # 在 backend 目录下运行: python -m app.core.handword_gen.glyph_atlas
+    from app.core.handword_gen.hw_converter import FONT_PATH, DEFAULT_QUALITY
+
+    parser = argparse.ArgumentParser(description="预渲染手写字形图集")
+    parser.add_argument("--font", default=FONT_PATH, help="手写字体文件路径")
+    parser.add_argument("--size", type=int, default=16, help="目标字号")
+    parser.add_argument("--quality", default=DEFAULT_QUALITY, help="渲染质量档位: draft / normal / high")
+    parser.add_argument("--variants", type=int, default=3, help="每个字符的随机变体数量")
+    parser.add_argument("--workers", type=int, default=None, help="并行渲染的进程数")
+    parser.add_argument("--output", default=GLYPH_ATLAS_DIR, help="图集输出目录")
+    args = parser.parse_args()
+
+    build_glyph_atlas(args.font, args.size, args.quality, args.variants, atlas_dir=args.output, workers=args.workers)
@@ -0,0 +1,119 @@
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+
+class GlyphCache:
+    """
+    手写字形缓存（进程内，有界 LRU）
+
+    以 (字符, 字体, 字号, 风格变体) 为键缓存已渲染好的单字图像。
+    每个字符最多保留 variants_per_char 个随机变体，重复出现的字符
+    （数字、常用汉字、标点）直接从缓存中随机取一个变体，避免重复调用 handright。
+    """
+
+    def __init__(self, max_size: int = 4096, variants_per_char: int = 3):
+        """
+        初始化字形缓存
+
+        参数:
+            max_size: 最多缓存的字形数量，超过后按最近最少使用淘汰
+            variants_per_char: 每个字符的随机变体数量，变体越多越自然，但首次渲染越慢
+        """
+        self.max_size = max(1, int(max_size))
+        self.variants_per_char = max(1, int(variants_per_char))
+        self._glyphs: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def variant_seed(char: str, variant: int) -> int:
+        """
+        返回某个字符某个变体对应的 handright 随机种子
+
+        使用整数而不是字符串，保证不同进程中 hash 结果一致
+        """
+        return (ord(char[0]) if char else 0) * 65536 + variant
+
+    def pick_variant(self) -> int:
+        """随机选择一个变体编号"""
+        return random.randrange(self.variants_per_char)
+
+    def get(self, char: str, font_path: str, font_size: int,
+            render_func: Callable[[int], Any], variant: int = None, style: Hashable = None) -> Any:
+        """
+        获取字形，未命中时调用 render_func 渲染并写入缓存
+
+        参数:
+            char: 要渲染的字符
+            font_path: 字体文件路径
+            font_size: 目标字号（像素）
+            render_func: 渲染函数，参数为随机种子，返回渲染好的字形
+            variant: 变体编号，默认随机选择
+            style: 其它影响字形外观的参数（例如渲染质量），参与缓存键
+
+        返回:
+            渲染好的字形
+        """
+        if variant is None:
+            variant = self.pick_variant()
+        key = (char, font_path, font_size, style, variant)
+
+        with self._lock:
+            glyph = self._glyphs.get(key)
+            if glyph is not None:
+                self._glyphs.move_to_end(key)
+                self.hits += 1
+                return glyph
+
+        # 渲染放在锁外，避免阻塞其它线程读取缓存
+        glyph = render_func(self.variant_seed(char, variant))
+
+        with self._lock:
+            self.misses += 1
+            self._glyphs[key] = glyph
+            self._glyphs.move_to_end(key)
+            while len(self._glyphs) > self.max_size:
+                self._glyphs.popitem(last=False)
+        return glyph
+
+    def configure(self, max_size: int = None, variants_per_char: int = None) -> None:
+        """
+        修改缓存容量或变体数量，变体数量变化时清空已缓存的字形
+        """
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max(1, int(max_size))
+                while len(self._glyphs) > self.max_size:
+                    self._glyphs.popitem(last=False)
+            if variants_per_char is not None and int(variants_per_char) != self.variants_per_char:
+                self.variants_per_char = max(1, int(variants_per_char))
+                self._glyphs.clear()
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._glyphs.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                "size": len(self._glyphs),
+                "max_size": self.max_size,
+                "variants_per_char": self.variants_per_char,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# 创建默认字形缓存实例
+default_glyph_cache = GlyphCache()
+
+def get_glyph_cache() -> GlyphCache:
+    """获取默认字形缓存实例"""
+    return default_glyph_cache
@@ -1,11 +1,134 @@
-from handright import Template, handwrite
-import string
-from PIL import Image, ImageDraw, ImageFont  # 新增Pillow导入
+from handright import handwrite, Feature
+from PIL import Image
 import json
 import cv2
-import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.core.handword_gen.glyph_cache import get_glyph_cache
+from app.core.handword_gen.glyph_atlas import get_glyph_atlas
+from app.core.handword_gen.template_registry import get_template_registry
+from app.core.handword_gen.font_metrics import get_font_metrics
+from app.core.handword_gen.char_class import char_class, CHAR_CHINESE, CHAR_PUNCTUATION
+from app.core.handword_gen.compositor import glyph_to_alpha, new_ink_layer, composite_alpha, apply_ink
+from app.core.handword_gen.strokes import glyph_strokes, offset_strokes
 
-def calculate_text_positions_with_wrap(cell_points, text, font_size, h_align='left', v_align='top', cn_char_spacing=0, en_char_spacing=0, line_spacing=5, margin=3):
+# 手写字体文件路径
+FONT_PATH = "F:/typewriter/Handright-master/Handright-master/tests/fonts/font.ttf"
+
+# 墨水颜色 (B, G, R)
+INK_COLOR = (0, 0, 0)
+
+# 并行渲染单元格的默认进程数
+DEFAULT_RENDER_WORKERS = os.cpu_count() or 1
+# 需要渲染的单元格少于该数量时直接串行渲染，避免进程间通信开销大于收益
+PARALLEL_MIN_CELLS = 8
+
+# 渲染质量档位
+# supersample: 单字画布边长是目标字号的多少倍，渲染后再缩小到目标尺寸
+# resample: 缩小时使用的重采样滤波器
+# draft 直接按接近目标尺寸渲染，用于预览；high 与原来 12 倍字号、13 倍画布的效果一致，用于最终输出
+QUALITY_TIERS = {
+    'draft': {'supersample': 1, 'resample': Image.Resampling.BILINEAR},
+    'normal': {'supersample': 4, 'resample': Image.Resampling.BICUBIC},
+    'high': {'supersample': 13, 'resample': Image.Resampling.LANCZOS},
+}
+DEFAULT_QUALITY = 'high'
+# 提取笔画时使用的渲染质量；骨架需要足够的分辨率，因此不随预览的质量档位降低
+STROKE_QUALITY = 'high'
+
+def _glyph_geometry(fs, quality):
+    """
+    根据质量档位计算单字画布尺寸、渲染字号、行距和重采样滤波器
+
+    字号与画布的比例固定为 12:13，与原来 scale_factor = 12 时的字形大小保持一致
+    """
+    tier = QUALITY_TIERS.get(quality)
+    if tier is None:
+        raise ValueError(f"未知的渲染质量: {quality}，可选值: {', '.join(QUALITY_TIERS)}")
+    canvas_size = fs * tier['supersample']
+    font_size = max(1, round(canvas_size * 12 / 13))
+    # 原来在 13 倍画布上字形顶部留白 4 像素，按画布比例缩放
+    line_spacing = font_size + round(4 * tier['supersample'] / 13)
+    return canvas_size, font_size, line_spacing, tier['resample']
+
+def _get_glyph_template(template_registry, font_path, fs, quality):
+    """获取逐字渲染使用的单字模板"""
+    canvas_size, font_size, line_spacing, _ = _glyph_geometry(fs, quality)
+    return template_registry.get_template(
+        font_path,
+        font_size,
+        (canvas_size, canvas_size),
+        line_spacing=line_spacing,
+        fill=(0, 0, 0)
+    )
+
+def _render_glyph(char, template, fs, resample=Image.Resampling.LANCZOS, seed=None):
+    """
+    使用 handright 渲染单个字符，并缩小到 fs x fs 的目标尺寸
+
+    返回字形的 uint8 透明度蒙版
+    """
+    handwritten = list(handwrite(char, template, seed=seed))[0]
+    if handwritten.size != (fs, fs):
+        # 缩小到目标尺寸
+        handwritten = handwritten.resize((fs, fs), resample)
+    return glyph_to_alpha(handwritten)
+
+def _render_glyph_hires(char, template, seed=None):
+    """使用 handright 渲染单个字符，不缩小，返回单字画布大小的 uint8 透明度蒙版"""
+    return glyph_to_alpha(list(handwrite(char, template, seed=seed))[0])
+
+def _render_line_glyphs(line_chars, fs, quality, font_path, template_registry, seed=None):
+    """
+    一次 handwrite 调用渲染一整行文字，再按格子切分成 fs x fs 的单字图像
+
+    使用 handright 的网格排版 (GRID_LAYOUT)，每个字符占据与逐字渲染时单字画布相同宽度的固定格子，
+    因此切分后的字形可以直接按 calculate_text_positions_with_wrap 计算出的坐标粘贴，位置不受影响。
+
+    参数:
+    line_chars -- 同一行的字符列表
+    fs -- 目标字号
+    quality -- 渲染质量档位，见 QUALITY_TIERS
+    font_path -- 字体文件路径
+    template_registry -- 模板注册表
+    seed -- 随机种子
+
+    返回:
+    每个字符对应的 fs x fs 手写字透明度蒙版列表
+    """
+    cell_size, font_size, line_spacing, resample = _glyph_geometry(fs, quality)
+    template = template_registry.get_template(
+        font_path,
+        font_size,
+        (cell_size * len(line_chars), cell_size),
+        line_spacing=line_spacing,
+        fill=(0, 0, 0),
+        word_spacing=cell_size - font_size,  # 格子宽度 = 字号 + 字间距
+        word_spacing_sigma=0,                # 不随机扰动字间距，保证格子位置固定
+        features=frozenset({Feature.GRID_LAYOUT})
+    )
+    line_image = list(handwrite("".join(line_chars), template, seed=seed))[0]
+
+    glyphs = []
+    for i in range(len(line_chars)):
+        glyph = line_image.crop((i * cell_size, 0, (i + 1) * cell_size, cell_size))
+        if cell_size != fs:
+            glyph = glyph.resize((fs, fs), resample)
+        glyphs.append(glyph_to_alpha(glyph))
+    return glyphs
+
+def _group_positions_by_line(text_positions):
+    """将 calculate_text_positions_with_wrap 的结果按行（相同 y 坐标）分组"""
+    lines = []
+    for position in text_positions:
+        if lines and lines[-1][0][1] == position[1]:
+            lines[-1].append(position)
+        else:
+            lines.append([position])
+    return lines
+
+def calculate_text_positions_with_wrap(cell_points, text, font_size, h_align='left', v_align='top', cn_char_spacing=0, en_char_spacing=0, line_spacing=5, margin=3, char_widths=None):
     """
     计算单元格中每个字符的左上角坐标，支持自动换行
     
@@ -20,6 +143,8 @@ def calculate_text_positions_with_wrap(cell_points, text, font_size, h_align='le
     en_char_spacing -- 英文和数字字符间距，默认为0
     line_spacing -- 行间距，默认为5
     margin -- 文本与单元格边界的边距，默认为3
+    char_widths -- 可选的字宽表 {字符: 宽度}，通常来自手写字体的真实步进宽度（见 font_metrics 模块），
+                   不在表中的字符仍按固定宽度估算（中文0.8倍字号，符号1倍字号，其它0.5倍字号）
     返回:
     positions -- 每个字符的左上角坐标列表，格式为 [(x1, y1, char), ...]
     """
@@ -33,105 +158,85 @@ def calculate_text_positions_with_wrap(cell_points, text, font_size, h_align='le
         abs(cell_points[1]['y'] - cell_points[2]['y'])   # 右边
     )
     
-    # 判断字符是否为符号的函数
-    def is_punctuation(char):
-        if char in ['“','”']:
-            #print(char,"true")
-            return True
-
-        # 特殊处理一些可能被遗漏的符号
-        if char in ['“','”','"', '"', '"', ''', ''', '「', '」', '『', '』', '《', '》', '（', '）', '【', '】', '—', '–', '-', '…']:
-            #print(char,"true")
-            return True
-
-        # 中文标点符号范围（扩展范围以确保包含所有中文标点）
-        if '\u3000' <= char <= '\u303f' or '\uff00' <= char <= '\uffef':
-            #print(char,"true")
-            return True
-        
-        # 英文标点符号
-        #print(char, char in string.punctuation)
-        return char in string.punctuation
-    
-    # 判断字符是否为中文的函数
-    def is_chinese(char):
-        # 中文字符范围
-        if '\u4e00' <= char <= '\u9fff':
-            return True
-        # 不将中文标点符号视为中文字符，而是作为独立的符号处理
-        return False
-    
-    # 计算一行文本的实际宽度
-    def calculate_line_width(line):
-        width = 0
-        for i, char in enumerate(line):
+    # 每个字符的 (是否中文, 是否符号, 字符宽度) 查找表，同一字符只计算一次
+    # 字符类别来自 char_class 模块在导入时构建好的类别表
+    char_info_table = {}
+
+    def char_info(char):
+        info = char_info_table.get(char)
+        if info is None:
+            category = char_class(char)
+            chinese = category == CHAR_CHINESE
+            punctuation = category == CHAR_PUNCTUATION
             # 计算字符宽度
-            if is_chinese(char):
+            if char_widths is not None and char in char_widths:
+                char_width = char_widths[char]
+            elif chinese:
                 char_width = font_size * 0.8
-            elif is_punctuation(char):
+            elif punctuation:
                 char_width = font_size
             else:
                 char_width = font_size * 0.5
-            
-            # 所有符号前面都加间距（除非是行首）
-            if i > 0 and is_punctuation(char):
-                width += 2  # 符号前增加2px间距
-            
-            width += char_width
-            
-            # 所有符号后面都加间距（除非是行尾）
-            if is_punctuation(char) and i < len(line) - 1:
-                width += -1  # 符号后增加2px间距
-            # 如果不是最后一个字符，添加正常字间距
-            elif i < len(line) - 1:
-                next_char = line[i + 1]
-                # 如果下一个字符是符号，不添加额外间距（因为符号前会添加间距）
-                if not is_punctuation(next_char):
-                    if is_chinese(char) == is_chinese(next_char):
-                        # 同类型字符之间使用对应的间距
-                        width += cn_char_spacing if is_chinese(char) else en_char_spacing
-                    else:
-                        # 中英文之间使用较大的间距
-                        width += max(cn_char_spacing, en_char_spacing)
-        return width
-
-    # 计算每行可容纳的最大字符数（考虑边距）
-    test_line = "测" * 100  # 使用中文测试，因为中文字符宽度较大
+            info = (chinese, punctuation, char_width)
+            char_info_table[char] = info
+        return info
+
+    # 相邻两个字符之间的间距（前一个字符不是行尾时才会加上）
+    def spacing_after(prev_info, next_info):
+        prev_chinese, prev_punctuation, _ = prev_info
+        next_chinese, next_punctuation, _ = next_info
+        # 所有符号后面都加间距（除非是行尾）
+        if prev_punctuation:
+            return -1  # 符号后增加-1px间距
+        # 如果下一个字符是符号，不添加额外间距（因为符号前会添加间距）
+        if next_punctuation:
+            return 0
+        if prev_chinese == next_chinese:
+            # 同类型字符之间使用对应的间距
+            return cn_char_spacing if prev_chinese else en_char_spacing
+        # 中英文之间使用较大的间距
+        return max(cn_char_spacing, en_char_spacing)
+
     max_width = width - 2 * margin
-    max_chars_per_line = 1
-    current_width = 0
-    
-    while current_width < max_width and max_chars_per_line < len(test_line):
-        current_width = calculate_line_width(test_line[:max_chars_per_line])
-        if current_width < max_width:
-            max_chars_per_line += 1
-        else:
-            break
-    
-    # 分行处理文本
-    lines = []
-    current_line = ""
+
+    # 分行处理文本，逐字符累加行宽，每个字符只计算一次，整体为线性时间
+    # 累加顺序与逐行从头计算时完全一致，保证浮点结果相同
+    lines = []          # 每项为 (行文本, 行宽)
+    current_chars = []
     current_width = 0
-    
+    last_info = None
+
     for char in text:
         if char == '\n':  # 处理换行符
-            lines.append(current_line)
-            current_line = ""
+            lines.append(("".join(current_chars), current_width))
+            current_chars = []
             current_width = 0
+            last_info = None
+            continue
+
+        info = char_info(char)
+        # 计算添加当前字符后的宽度
+        if last_info is None:
+            test_width = current_width + info[2]
         else:
-            # 计算添加当前字符后的宽度
-            test_width = calculate_line_width(current_line + char)
-            if test_width <= max_width:
-                current_line += char
-                current_width = test_width
-            else:
-                lines.append(current_line)
-                current_line = char
-                current_width = calculate_line_width(char)
-    
+            test_width = current_width + spacing_after(last_info, info)
+            # 所有符号前面都加间距（除非是行首）
+            if info[1]:
+                test_width += 2  # 符号前增加2px间距
+            test_width += info[2]
+
+        if test_width <= max_width:
+            current_chars.append(char)
+            current_width = test_width
+        else:
+            lines.append(("".join(current_chars), current_width))
+            current_chars = [char]
+            current_width = 0 + info[2]
+        last_info = info
+
     # 添加最后一行
-    if current_line:
-        lines.append(current_line)
+    if current_chars:
+        lines.append(("".join(current_chars), current_width))
 
     # 计算文本总高度
     total_text_height = len(lines) * font_size + (len(lines) - 1) * line_spacing
@@ -146,10 +251,7 @@ def calculate_text_positions_with_wrap(cell_points, text, font_size, h_align='le
     
     # 计算每个字符的位置
     positions = []
-    for line_idx, line in enumerate(lines):
-        # 计算当前行的宽度
-        line_width = calculate_line_width(line)
-        
+    for line_idx, (line, line_width) in enumerate(lines):
         # 根据水平对齐方式计算起始 x 坐标
         if h_align == 'left':
             start_x = cell_points[0]['x'] + margin
@@ -163,123 +265,377 @@ def calculate_text_positions_with_wrap(cell_points, text, font_size, h_align='le
         
         # 计算当前行每个字符的位置
         current_x = start_x
-        for i, char in enumerate(line):
-            # 所有符号前面都加间距（除非是行首）
-            if i > 0 and is_punctuation(char):
-                current_x += 2  # 符号前增加2px间距
-                
+        prev_info = None
+        for char in line:
+            info = char_info(char)
+            if prev_info is not None:
+                current_x += spacing_after(prev_info, info)
+                # 所有符号前面都加间距（除非是行首）
+                if info[1]:
+                    current_x += 2  # 符号前增加2px间距
+
             positions.append([int(current_x), int(y), char])
-            
-            # 计算字符宽度
-            if is_chinese(char):
-                char_width = font_size * 0.8
-            elif is_punctuation(char):
-                char_width = font_size
-            else:
-                char_width = font_size * 0.5
-            
-            current_x += char_width
-            # 所有符号后面都加间距（除非是行尾）
-            if is_punctuation(char) and i < len(line) - 1:
-                current_x += -1  # 符号后增加1px间距
-            # 如果不是最后一个字符，添加正常字间距
-            elif i < len(line) - 1:
-                next_char = line[i + 1]
-                # 如果下一个字符是符号，不添加额外间距（因为符号前会添加间距）
-                if not is_punctuation(next_char):
-                    if is_chinese(char) == is_chinese(next_char):
-                        # 同类型字符之间使用对应的间距
-                        current_x += cn_char_spacing if is_chinese(char) else en_char_spacing
-                    else:
-                        # 中英文之间使用较大的间距
-                        current_x += max(cn_char_spacing, en_char_spacing)
+            current_x += info[2]
+            prev_info = info
     
     return positions
 
-def gen_handwriter_image(tr_tables_info, tr_word_info, input_table_info, tr_img_cv2):
+def _render_cell_tile(task):
     """
-     tr_tables_info: data['data']['prism_tablesInfo'][0]['cellInfos']  已经经过透视变换
-     tr_word_info: data['data']['prism_wordInfo']  已经经过透视变换
-     input_table_info: 前端传入的tableInfo
-     tr_img_cv2: 透视变换后的图片
+    渲染单个单元格的手写字图块，可在子进程中执行
+
+    参数:
+    task -- 单元格渲染任务，包含 points、text、h_align、v_align、fs、render_mode、with_strokes 等字段
+
+    返回:
+    (x0, y0, tile, strokes) -- 图块左上角在整张图片中的坐标、uint8 透明度图块和笔画折线列表；
+                               没有可绘制的字符时 tile 为 None，未要求提取笔画时 strokes 为 None
     """
+    fs = task['fs']
+    render_mode = task['render_mode']
+    with_strokes = task.get('with_strokes', False)
+    glyph_cache = get_glyph_cache()
+    template_registry = get_template_registry()
 
-    fs = 16
-    cv2_image_rgb = cv2.cvtColor(tr_img_cv2, cv2.COLOR_BGR2RGB)
-    pil_image = Image.fromarray(cv2_image_rgb)
+    # 计算文字位置
+    text_positions = calculate_text_positions_with_wrap(
+        task['points'],
+        task['text'],
+        fs,  # 字体大小
+        h_align=task['h_align'],
+        v_align=task['v_align'],
+        cn_char_spacing=0,  # 中文字符间距
+        en_char_spacing=0,  # 英文字符间距（中英文之间会使用2）
+        line_spacing=2,
+        margin=5,
+        char_widths=task.get('char_widths')
+    )
+    text_positions = [position for position in text_positions if position[2] != '\n']
+    if not text_positions:
+        return 0, 0, None, [] if with_strokes else None
+
+    # 为每个字符创建手写效果，字体与模板由注册表统一加载并复用
+    font_path = task['font_path']
+    quality = task['quality']
+
+    glyphs = []
+    strokes = [] if with_strokes else None
+    if render_mode == 'line' and not with_strokes:
+        # 整行渲染，handwrite 调用次数与行数成正比
+        for line in _group_positions_by_line(text_positions):
+            line_glyphs = _render_line_glyphs(
+                [char for _, _, char in line], fs, quality, font_path, template_registry
+            )
+            glyphs.extend((x, y, handwritten) for [x, y, _], handwritten in zip(line, line_glyphs))
+    else:
+        # 提取笔画时总是逐字渲染，栅格字形与笔画使用同一个变体和同一个质量档位的模板：
+        # handright 按随机种子对每一笔做扰动，模板不同时相同的种子也会得到不同的字形，预览图就与笔画对不上
+        if with_strokes:
+            quality = STROKE_QUALITY
+        template = _get_glyph_template(template_registry, font_path, fs, quality)
+        resample = QUALITY_TIERS[quality]['resample']
+        if with_strokes:
+            stroke_template = _get_glyph_template(template_registry, font_path, fs, STROKE_QUALITY)
+        # 优先从预渲染的字形图集中读取（零拷贝），图集中没有的字符再走字形缓存和实时渲染
+        atlas = get_glyph_atlas(font_path, fs, quality)
+        for [x, y, char] in text_positions:
+            variant = None
+            if with_strokes:
+                variant = glyph_cache.pick_variant()
+                if atlas is not None and char in atlas:
+                    variant %= atlas.variants
+            handwritten = atlas.get(char, variant) if atlas is not None else None
+            if handwritten is None:
+                # 相同字符的字形从缓存中获取，不再逐个重新渲染
+                handwritten = glyph_cache.get(
+                    char, font_path, fs,
+                    lambda seed, char=char: _render_glyph(char, template, fs, resample, seed),
+                    variant=variant, style=quality
+                )
+            glyphs.append((x, y, handwritten))
+            if with_strokes:
+                char_strokes = glyph_strokes(
+                    char, font_path, fs, STROKE_QUALITY, variant,
+                    lambda seed, char=char: _render_glyph_hires(char, stroke_template, seed)
+                )
+                strokes.extend(offset_strokes(char_strokes, x, y))
+
+    # 把本单元格的所有字形合成到一个透明度图块上
+    x0 = min(x for x, _, _ in glyphs)
+    y0 = min(y for _, y, _ in glyphs)
+    x1 = max(x + g.shape[1] for x, _, g in glyphs)
+    y1 = max(y + g.shape[0] for _, y, g in glyphs)
+    tile = new_ink_layer(y1 - y0, x1 - x0)
+    for x, y, handwritten in glyphs:
+        composite_alpha(tile, handwritten, x - x0, y - y0)
+    return x0, y0, tile, strokes
+
+# 按进程数缓存的进程池，在多个请求之间复用，避免每次请求都重新启动子进程
+_render_executors = {}
+
+def _get_render_executor(workers):
+    executor = _render_executors.get(workers)
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        _render_executors[workers] = executor
+    return executor
+
+def _render_cell_tiles(tasks, workers):
+    """
+    渲染所有单元格图块，单元格数量足够多时使用进程池并行渲染
+    """
+    if workers is None:
+        workers = DEFAULT_RENDER_WORKERS
+    workers = min(int(workers), len(tasks))
+    if workers <= 1 or len(tasks) < PARALLEL_MIN_CELLS:
+        return [_render_cell_tile(task) for task in tasks]
+
+    try:
+        executor = _get_render_executor(workers)
+        return list(executor.map(_render_cell_tile, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    except BrokenProcessPool as e:
+        # 子进程异常退出，丢弃进程池并在当前进程中串行渲染
+        print(f"并行渲染失败，改为串行渲染: {e}")
+        _render_executors.pop(workers, None)
+        return [_render_cell_tile(task) for task in tasks]
+
+def _index_input_cells(input_table_info):
+    """
+    按 tableCellId 索引前端传入的单元格，只保留有效且填写了文字的单元格
+
+    合并单元格在二维表格中会出现多次，保留按行优先顺序遇到的第一个
+    """
+    cells = {}
+    for row in input_table_info:
+        for item in row:
+            if item.get('isValid') and item.get('text'):
+                cells.setdefault(item['tableCellId'], item)
+    return cells
 
+def _index_words(tr_word_info):
+    """按 tableCellId 索引识别出的文字块，保留每个单元格的第一个文字块"""
+    words = {}
+    for word in tr_word_info:
+        if 'tableCellId' in word:
+            words.setdefault(word['tableCellId'], word)
+    return words
+
+def _build_cell_tasks(tr_tables_info, tr_word_info, input_table_info, fs, render_mode, quality, metrics, with_strokes=False):
+    """
+    为每个填写了文字的单元格生成渲染任务
+
+    返回:
+    {tableCellId: task} 字典，按 tr_tables_info 中单元格的顺序排列
+    """
+    # 预先按 tableCellId 建立索引，每个单元格的查找都是 O(1)
+    input_cells = _index_input_cells(input_table_info)
+    cell_words = _index_words(tr_word_info)
+
+    tasks = {}
      # 遍历每个单元格
     for cell in tr_tables_info:
         # 获取单元格ID
         cell_id = cell['tableCellId']
         
         # 在text_data中查找对应的文本内容和对齐方式
-        text_content = None
-        text_align = None
-        v_align = None
-        for row in input_table_info:
-            for item in row:
-                if item['tableCellId'] == cell_id and item['isValid'] and item['text']:
-                    
-                    text_content = item['text']
-                    text_align = item['textAlign'].split()[0]  # 获取水平对齐方式
-                    v_align = item['textAlign'].split()[1] if len(item['textAlign'].split()) > 1 else 'middle'  # 获取垂直对齐方式
-                    break
-            if text_content:
-                break
-
-        if text_content:
-            
-            points = cell['pos']
+        item = input_cells.get(cell_id)
+        if item:
+            text_content = item['text']
+            align = item['textAlign'].split()
+            text_align = align[0]  # 获取水平对齐方式
+            v_align = align[1] if len(align) > 1 else 'middle'  # 获取垂直对齐方式
+
+            # 复制顶点坐标，避免修改传入的表格信息
+            points = [dict(point) for point in cell['pos']]
             
             if cell["word"]:
                 word_height = 8
-                for word in tr_word_info:
-                    if word['tableCellId'] == cell_id:
-                        word_height += word["width"]
-                        break
+                word = cell_words.get(cell_id)
+                if word is not None:
+                    word_height += word["width"]
 
                 points[0]["y"],points[1]["y"] = points[0]["y"]+word_height , points[1]["y"]+word_height  #空出word的位置
-            
-            # 计算文字位置
-            text_positions = calculate_text_positions_with_wrap(
-                points,
-                text_content,
-                fs,  # 字体大小
-                h_align=text_align,
-                v_align=v_align,
-                cn_char_spacing=0,  # 中文字符间距
-                en_char_spacing=0,  # 英文字符间距（中英文之间会使用2）
-                line_spacing=2,
-                margin=5
-            )
 
-            # 为每个字符创建手写效果
-            font_path = "F:/typewriter/Handright-master/Handright-master/tests/fonts/font.ttf"
-            # 放大倍数
-            scale_factor = 12
-            template = Template(
-                background=Image.new(mode="RGBA", size=(fs*(scale_factor+1), fs*(scale_factor+1)), color=(0, 0, 0, 0)),
-                font=ImageFont.truetype(font_path, size=fs*scale_factor),
-                line_spacing=fs*scale_factor + 4,
-                fill=(0, 0, 0)
-            )
-            
-            # 绘制文字
-            for [x, y, char] in text_positions:
-                if char != '\n':
-                    handwritten = list(handwrite(char, template))[0]
-                    # 缩小到目标尺寸
-                    handwritten = handwritten.resize(
-                        (fs, fs), 
-                        Image.Resampling.LANCZOS  # 高质量缩小
-                    )
-                    pil_image.paste(handwritten, (x, y), handwritten)
-
-    # 将PIL图像转换回OpenCV格式
-    transformed_img = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+            tasks[cell_id] = {
+                'points': points,
+                'text': text_content,
+                'h_align': text_align,
+                'v_align': v_align,
+                'fs': fs,
+                'render_mode': render_mode,
+                'font_path': FONT_PATH,
+                'quality': quality,
+                'with_strokes': with_strokes,
+                # 字宽在主进程中查好再交给子进程，字宽缓存只在一个进程里维护
+                'char_widths': metrics.widths_for(text_content) if metrics else None,
+            }
+    return tasks
+
+def _boxes_overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def render_handwriting_ink(tr_tables_info, tr_word_info, input_table_info, image_shape, render_mode='glyph', workers=None, quality=DEFAULT_QUALITY, use_font_metrics=False, previous=None, with_strokes=False):
+    """
+    渲染手写字墨迹层，支持基于上一次结果的增量渲染
+
+    参数:
+    tr_tables_info, tr_word_info, input_table_info -- 同 gen_handwriter_image
+    image_shape -- 透视变换后图片的尺寸 (高, 宽, ...)
+    render_mode, workers, quality, use_font_metrics -- 同 gen_handwriter_image
+    previous -- 上一次调用返回的渲染状态；渲染参数和图片尺寸都没变时，只重绘文字发生变化的单元格
+    with_strokes -- 是否同时提取每个单元格的笔画折线（用于生成 G-code），提取笔画时总是逐字渲染，
+                    并且栅格字形按 STROKE_QUALITY 渲染（忽略 quality），使预览图与笔画一致
+
+    返回:
+    渲染状态字典:
+        {
+            'ink': 墨迹层 (uint8, 高 x 宽),
+            'cell_boxes': {tableCellId: [x0, y0, x1, y1]} 每个单元格墨迹所占的矩形,
+            'input_table_info': 本次使用的 tdtr_cells,
+            'options': 渲染参数,
+            'rendered_cells': 本次实际重绘的单元格数量,
+            'strokes': {tableCellId: [[(x, y), ...], ...]} 每个单元格的笔画折线（透视变换后图片的像素坐标），
+                       仅在 with_strokes 为 True 时返回
+        }
+    """
+    fs = 16
+    # 提前校验质量档位，避免在子进程中才报错
+    _glyph_geometry(fs, quality)
+    metrics = get_font_metrics().get(FONT_PATH, fs) if use_font_metrics else None
+    height, width = image_shape[0], image_shape[1]
+    options = {
+        'fs': fs,
+        'font_path': FONT_PATH,
+        'render_mode': render_mode,
+        'quality': quality,
+        'use_font_metrics': use_font_metrics,
+        'with_strokes': with_strokes,
+    }
+
+    tasks = _build_cell_tasks(tr_tables_info, tr_word_info, input_table_info, fs, render_mode, quality, metrics, with_strokes)
+
+    reuse = (
+        previous is not None
+        and previous.get('options') == options
+        and previous.get('ink') is not None
+        and previous['ink'].shape == (height, width)
+        and (not with_strokes or previous.get('strokes') is not None)
+    )
+    if reuse:
+        ink = previous['ink'].copy()
+        cell_boxes = dict(previous['cell_boxes'])
+        cell_strokes = dict(previous['strokes']) if with_strokes else None
+        old_tasks = _build_cell_tasks(tr_tables_info, tr_word_info, previous['input_table_info'], fs, render_mode, quality, metrics, with_strokes)
+        redraw = {cell_id for cell_id in set(tasks) | set(old_tasks) if tasks.get(cell_id) != old_tasks.get(cell_id)}
+
+        # 清除需要重绘的单元格的旧墨迹；与清除区域重叠的其它单元格也要一并重绘，直到不再扩大
+        pending = list(redraw)
+        while pending:
+            cell_id = pending.pop()
+            if with_strokes:
+                cell_strokes.pop(cell_id, None)
+            box = cell_boxes.pop(cell_id, None)
+            if box is None:
+                continue
+            ink[box[1]:box[3], box[0]:box[2]] = 0
+            for cell_id, other in cell_boxes.items():
+                if cell_id not in redraw and _boxes_overlap(box, other):
+                    redraw.add(cell_id)
+                    pending.append(cell_id)
+    else:
+        ink = new_ink_layer(height, width)
+        cell_boxes = {}
+        cell_strokes = {} if with_strokes else None
+        redraw = set(tasks)
+
+    if metrics:
+        metrics.save()
+
+    # 各单元格相互独立，先分别渲染成图块，再在主进程中叠加到同一个墨迹层上
+    redraw_ids = [cell_id for cell_id in tasks if cell_id in redraw]
+    tiles = _render_cell_tiles([tasks[cell_id] for cell_id in redraw_ids], workers)
+    for cell_id, (x0, y0, tile, strokes) in zip(redraw_ids, tiles):
+        if with_strokes:
+            cell_strokes[cell_id] = strokes
+        if tile is None:
+            continue
+        composite_alpha(ink, tile, x0, y0)
+        box = [max(x0, 0), max(y0, 0), min(x0 + tile.shape[1], width), min(y0 + tile.shape[0], height)]
+        if box[0] < box[2] and box[1] < box[3]:
+            cell_boxes[cell_id] = box
+
+    state = {
+        'ink': ink,
+        'cell_boxes': cell_boxes,
+        'input_table_info': input_table_info,
+        'options': options,
+        'rendered_cells': len(redraw_ids),
+    }
+    if with_strokes:
+        state['strokes'] = cell_strokes
+    return state
+
+def gen_handwriter_image(tr_tables_info, tr_word_info, input_table_info, tr_img_cv2, render_mode='glyph', workers=None, quality=DEFAULT_QUALITY, use_font_metrics=False):
+    """
+     tr_tables_info: data['data']['prism_tablesInfo'][0]['cellInfos']  已经经过透视变换
+     tr_word_info: data['data']['prism_wordInfo']  已经经过透视变换
+     input_table_info: 前端传入的tableInfo
+     tr_img_cv2: 透视变换后的图片
+     render_mode: 渲染模式，'glyph' 逐字渲染（使用字形缓存），'line' 每行调用一次 handwrite
+     workers: 并行渲染单元格的进程数，默认使用 DEFAULT_RENDER_WORKERS，1 表示在当前进程中串行渲染
+     quality: 渲染质量档位，'draft' 用于快速预览，'normal' 折中，'high' 用于最终输出
+     use_font_metrics: 是否按手写字体的真实字宽排版，排版更紧凑，换行更少
+    """
+    state = render_handwriting_ink(
+        tr_tables_info, tr_word_info, input_table_info, tr_img_cv2.shape,
+        render_mode=render_mode, workers=workers, quality=quality, use_font_metrics=use_font_metrics
+    )
+
+    # 直接在 BGR 图片上按墨迹层上色，不再经过 PIL 和两次整图颜色转换
+    transformed_img = apply_ink(tr_img_cv2, state['ink'], INK_COLOR)
     return transformed_img
 
+def gen_handwriter_strokes(tr_tables_info, tr_word_info, input_table_info, image_shape, workers=None, quality=DEFAULT_QUALITY, use_font_metrics=False):
+    """
+    生成手写字的笔画折线，用于驱动笔式绘图仪
+
+    排版与 gen_handwriter_image 完全相同，每个字形的笔画由高分辨率字形骨架化后追踪得到，并按字形缓存。
+    需要同时得到预览图时，直接调用 render_handwriting_ink(..., with_strokes=True)，预览图与笔画使用同一套排版和字形变体。
+
+     tr_tables_info, tr_word_info, input_table_info: 同 gen_handwriter_image
+     image_shape: 透视变换后图片的尺寸 (高, 宽, ...)
+     workers, quality, use_font_metrics: 同 gen_handwriter_image；提取笔画时字形总是按 STROKE_QUALITY 渲染，
+                                         quality 不影响结果
+
+    返回:
+     {tableCellId: [[(x, y), ...], ...]}，坐标为透视变换后图片的像素坐标，按 tr_tables_info 中单元格的顺序排列
+    """
+    state = render_handwriting_ink(
+        tr_tables_info, tr_word_info, input_table_info, image_shape,
+        workers=workers, quality=quality, use_font_metrics=use_font_metrics, with_strokes=True
+    )
+    return state['strokes']
+
+def iter_handwriter_strokes(tr_tables_info, tr_word_info, input_table_info, quality=DEFAULT_QUALITY, use_font_metrics=False):
+    """
+    逐个单元格生成手写字笔画，渲染完一个单元格就产出一个，适合边生成边发送 G-code
+
+    参数同 gen_handwriter_strokes（不需要图片尺寸）。与 render_handwriting_ink 分别调用时字形变体是各自随机选择的，
+    需要与预览图完全一致时，请使用 render_handwriting_ink(..., with_strokes=True) 返回的 strokes。
+
+    产出:
+     (tableCellId, [[(x, y), ...], ...])，按 tr_tables_info 中单元格的顺序
+    """
+    fs = 16
+    _glyph_geometry(fs, quality)
+    metrics = get_font_metrics().get(FONT_PATH, fs) if use_font_metrics else None
+    tasks = _build_cell_tasks(tr_tables_info, tr_word_info, input_table_info, fs, 'glyph', quality, metrics, with_strokes=True)
+    if metrics:
+        metrics.save()
+    for cell_id, task in tasks.items():
+        _, _, _, strokes = _render_cell_tile(task)
+        yield cell_id, strokes
+
 
 if __name__ == "__main__":
     corrected_image_path = r"F:\typewriter\AutoWriter\corrected_img.jpg"
@@ -0,0 +1,211 @@
+from typing import Callable, List, Set, Tuple
+import cv2
+import numpy as np
+from app.core.handword_gen.glyph_cache import GlyphCache
+
+# 一条笔画: [(x, y), ...]，坐标单位为像素
+Stroke = List[Tuple[float, float]]
+
+
+def skeletonize(alpha: np.ndarray, threshold: int = 128) -> np.ndarray:
+    """
+    Zhang-Suen 细化算法，把字形蒙版细化为单像素宽的骨架
+
+    参数:
+        alpha: uint8 透明度蒙版
+        threshold: 二值化阈值
+
+    返回:
+        bool 类型的骨架图，与 alpha 同尺寸
+    """
+    mask = (alpha >= threshold).astype(np.uint8)
+    # 先做一次闭运算，填掉笔画内部的针孔，否则骨架会在针孔处绕出小环
+    kernel_size = max(3, alpha.shape[0] // 50) | 1
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size)))
+    img = np.pad(mask, 1)
+    while True:
+        changed = False
+        for step in (0, 1):
+            # 8 邻域，P2 为正上方，顺时针排列
+            p2 = img[:-2, 1:-1]
+            p3 = img[:-2, 2:]
+            p4 = img[1:-1, 2:]
+            p5 = img[2:, 2:]
+            p6 = img[2:, 1:-1]
+            p7 = img[2:, :-2]
+            p8 = img[1:-1, :-2]
+            p9 = img[:-2, :-2]
+            sequence = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+            neighbours = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
+            transitions = sum(((sequence[i] == 0) & (sequence[i + 1] == 1)).astype(np.uint8) for i in range(8))
+            remove = (img[1:-1, 1:-1] == 1) & (neighbours >= 2) & (neighbours <= 6) & (transitions == 1)
+            if step == 0:
+                remove &= (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                remove &= (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            if remove.any():
+                img[1:-1, 1:-1][remove] = 0
+                changed = True
+        if not changed:
+            return img[1:-1, 1:-1].astype(bool)
+
+
+def _neighbours(pixels: Set[Tuple[int, int]], x: int, y: int) -> List[Tuple[int, int]]:
+    """
+    骨架像素的相邻像素；斜向相邻且能通过共同的上下左右邻居连通时不算相邻，避免产生小三角形
+    """
+    result = [(x + dx, y + dy) for dx, dy in ((0, -1), (1, 0), (0, 1), (-1, 0)) if (x + dx, y + dy) in pixels]
+    for dx, dy in ((1, -1), (1, 1), (-1, 1), (-1, -1)):
+        if (x + dx, y + dy) in pixels and (x + dx, y) not in pixels and (x, y + dy) not in pixels:
+            result.append((x + dx, y + dy))
+    return result
+
+
+def trace_skeleton(skeleton: np.ndarray, min_spur_length: int = 0) -> List[List[Tuple[int, int]]]:
+    """
+    把骨架图追踪为折线
+
+    从端点和分叉点出发沿骨架行走，每条边只走一次；剩下的闭合环单独追踪。
+    孤立的单个像素作为只有一个点的笔画（例如句号）。
+    分叉点附近相邻分叉像素之间的短边和长度小于 min_spur_length 的毛刺会被丢弃，
+    之后端点恰好两两相接的折线合并为一条，减少抬笔次数。
+
+    返回:
+        折线列表，每条折线为像素坐标 [(x, y), ...]
+    """
+    ys, xs = np.nonzero(skeleton)
+    pixels = set(zip(xs.tolist(), ys.tolist()))
+    adjacency = {p: _neighbours(pixels, *p) for p in pixels}
+    visited_edges = set()
+    polylines = []
+
+    def walk(start, nxt):
+        path = [start, nxt]
+        visited_edges.add((start, nxt))
+        visited_edges.add((nxt, start))
+        prev, current = start, nxt
+        while len(adjacency[current]) == 2:
+            candidates = [p for p in adjacency[current] if p != prev and (current, p) not in visited_edges]
+            if not candidates:
+                break
+            prev, current = current, candidates[0]
+            visited_edges.add((prev, current))
+            visited_edges.add((current, prev))
+            path.append(current)
+        return path
+
+    # 先从端点和分叉点出发
+    for pixel in sorted(pixels):
+        neighbours = adjacency[pixel]
+        if not neighbours:
+            polylines.append([pixel])
+            continue
+        if len(neighbours) != 2:
+            for nxt in neighbours:
+                if (pixel, nxt) not in visited_edges:
+                    polylines.append(walk(pixel, nxt))
+
+    # 剩下的都是闭合环
+    for pixel in sorted(pixels):
+        for nxt in adjacency[pixel]:
+            if (pixel, nxt) not in visited_edges:
+                polylines.append(walk(pixel, nxt))
+
+    def is_junction(pixel):
+        return len(adjacency[pixel]) > 2
+
+    kept = []
+    for polyline in polylines:
+        if len(polyline) == 2 and is_junction(polyline[0]) and is_junction(polyline[-1]):
+            continue  # 分叉点内部的连接
+        degrees = sorted((len(adjacency[polyline[0]]), len(adjacency[polyline[-1]])))
+        if len(polyline) < min_spur_length and degrees[0] == 1 and degrees[1] > 2:
+            continue  # 一端悬空、一端连在分叉点上的短毛刺
+        kept.append(polyline)
+    return _join_polylines(kept)
+
+
+def _join_polylines(polylines: List[List[Tuple[int, int]]], max_gap: int = 2) -> List[List[Tuple[int, int]]]:
+    """
+    合并端点相接的折线：某个端点附近（切比雪夫距离不超过 max_gap）恰好只有另一条折线的端点时，两条折线首尾相连
+    """
+    polylines = [list(polyline) for polyline in polylines]
+    merged = True
+    while merged:
+        merged = False
+        ends = [(i, end) for i, polyline in enumerate(polylines) if len(polyline) > 1 for end in (0, -1)]
+        for i, end in ends:
+            point = polylines[i][end]
+            matches = [
+                (j, other_end) for j, other_end in ends
+                if (j, other_end) != (i, end)
+                and max(abs(polylines[j][other_end][0] - point[0]), abs(polylines[j][other_end][1] - point[1])) <= max_gap
+            ]
+            if len(matches) != 1 or matches[0][0] == i:
+                continue
+            j, other_end = matches[0]
+            first = polylines[i] if end == -1 else polylines[i][::-1]
+            second = polylines[j] if other_end == 0 else polylines[j][::-1]
+            polylines[i] = first + second
+            del polylines[j]
+            merged = True
+            break
+    return polylines
+
+
+def extract_strokes(alpha: np.ndarray, scale: float = 1.0, threshold: int = 128, min_spur_length: int = None) -> List[Stroke]:
+    """
+    从字形蒙版中提取笔画折线
+
+    参数:
+        alpha: uint8 透明度蒙版
+        scale: 坐标缩放比例，例如高分辨率渲染时为 目标字号 / 画布边长
+        threshold: 二值化阈值
+        min_spur_length: 丢弃短于该像素数的毛刺，默认为蒙版边长的 1/25
+
+    返回:
+        笔画列表，坐标为像素中心乘以 scale
+    """
+    if min_spur_length is None:
+        min_spur_length = max(2, alpha.shape[0] // 25)
+    strokes = []
+    for polyline in trace_skeleton(skeletonize(alpha, threshold), min_spur_length):
+        strokes.append([((x + 0.5) * scale, (y + 0.5) * scale) for x, y in polyline])
+    return strokes
+
+
+# 笔画缓存，与字形缓存使用相同的键 (字符, 字体, 字号, 渲染质量, 变体)
+default_stroke_cache = GlyphCache(max_size=4096)
+
+def get_stroke_cache() -> GlyphCache:
+    """获取默认笔画缓存实例"""
+    return default_stroke_cache
+
+
+def glyph_strokes(char: str, font_path: str, font_size: int, quality: str, variant: int,
+                  render_hires: Callable[[int], np.ndarray]) -> List[Stroke]:
+    """
+    获取单个字形的笔画，结果按字形缓存
+
+    参数:
+        char: 字符
+        font_path: 字体文件路径
+        font_size: 目标字号
+        quality: 渲染质量档位
+        variant: 变体编号，与栅格字形使用相同的变体才能保证预览图与笔画一致
+        render_hires: 渲染函数，参数为随机种子，返回未缩小的高分辨率透明度蒙版
+
+    返回:
+        字形局部坐标系（目标字号下，左上角为原点）中的笔画列表
+    """
+    def render(seed):
+        alpha = render_hires(seed)
+        return extract_strokes(alpha, scale=font_size / alpha.shape[1])
+
+    return get_stroke_cache().get(char, font_path, font_size, render, variant=variant, style=quality)
+
+
+def offset_strokes(strokes: List[Stroke], x: float, y: float) -> List[Stroke]:
+    """把字形局部坐标的笔画平移到图片坐标"""
+    return [[(px + x, py + y) for px, py in stroke] for stroke in strokes]
+
@@ -0,0 +1,102 @@
+import io
+import threading
+from typing import Dict, Hashable, Tuple
+from handright import Template
+from PIL import Image, ImageFont
+
+
+class TemplateRegistry:
+    """
+    handright 模板与 TrueType 字体的注册表（进程内共享）
+
+    字体文件在第一次使用时解析一次，之后按 (字体, 字号) 复用；
+    模板按 (字体, 字号, 画布尺寸, 行距, 颜色, 其它风格参数) 复用，
+    避免每个单元格都重新解析字体、重新分配透明背景。
+    handright 在渲染时会复制模板，因此同一个模板可以在多个请求间安全共享。
+    """
+
+    def __init__(self):
+        self._font_files: Dict[str, bytes] = {}
+        self._fonts: Dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+        self._templates: Dict[Tuple, Template] = {}
+        self._lock = threading.Lock()
+
+    def get_font(self, font_path: str, size: int) -> ImageFont.FreeTypeFont:
+        """
+        获取指定字号的字体，同一字体文件只从磁盘解析一次
+
+        参数:
+            font_path: 字体文件路径
+            size: 字号（像素）
+
+        返回:
+            Pillow 字体对象
+        """
+        key = (font_path, int(size))
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                return font
+            # 字体文件内容只读一次，不同字号共用同一份字节数据
+            font_bytes = self._font_files.get(font_path)
+            if font_bytes is None:
+                with open(font_path, "rb") as f:
+                    font_bytes = f.read()
+                self._font_files[font_path] = font_bytes
+            font = ImageFont.truetype(io.BytesIO(font_bytes), size=int(size))
+            self._fonts[key] = font
+            return font
+
+    def get_template(self, font_path: str, font_size: int, canvas_size: Tuple[int, int],
+                     line_spacing: int, fill=(0, 0, 0), **style: Hashable) -> Template:
+        """
+        获取渲染用的 handright 模板
+
+        参数:
+            font_path: 字体文件路径
+            font_size: 渲染字号（像素）
+            canvas_size: 透明背景画布尺寸 (宽, 高)
+            line_spacing: 行距
+            fill: 字体颜色
+            style: 传给 Template 的其它参数（例如 word_spacing、features），参与缓存键
+
+        返回:
+            handright 模板
+        """
+        canvas_size = (int(canvas_size[0]), int(canvas_size[1]))
+        key = (font_path, int(font_size), canvas_size, line_spacing, fill, tuple(sorted(style.items())))
+        with self._lock:
+            template = self._templates.get(key)
+        if template is not None:
+            return template
+
+        font = self.get_font(font_path, font_size)
+        template = Template(
+            background=Image.new(mode="RGBA", size=canvas_size, color=(0, 0, 0, 0)),
+            font=font,
+            line_spacing=line_spacing,
+            fill=fill,
+            **style
+        )
+        with self._lock:
+            return self._templates.setdefault(key, template)
+
+    def preload(self, font_path: str, sizes) -> None:
+        """在启动时预先加载字体，避免第一个请求承担解析字体的开销"""
+        for size in sizes:
+            self.get_font(font_path, size)
+
+    def clear(self) -> None:
+        """清空已加载的字体和模板"""
+        with self._lock:
+            self._font_files.clear()
+            self._fonts.clear()
+            self._templates.clear()
+
+
+# 创建默认模板注册表实例
+default_template_registry = TemplateRegistry()
+
+def get_template_registry() -> TemplateRegistry:
+    """获取默认模板注册表实例"""
+    return default_template_registry
@@ -0,0 +1,311 @@
+import time
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
+from app.core.cache import CacheSystem, get_cache
+from app.core.gcode.estimator import DEFAULT_PLANNER_BLOCKS
+from app.core.gcode.parser import GCodeBlock, ParsedProgram, parse_gcode
+from app.core.gcode.text_to_gcode import CELL_COMMENT_PATTERN, DEFAULT_Z_PEN_DOWN, DEFAULT_Z_PEN_UP
+
+if TYPE_CHECKING:
+    # 导入 grbl_controller 会创建默认实例并尝试打开串口，只在用到默认控制器时才导入
+    from app.core.grbl_controller import GRBLController
+
+# 任务在缓存中保留的时间（秒）
+JOB_EXPIRE_SECONDS = 7 * 24 * 60 * 60
+# 默认每确认多少行或经过多少秒保存一次进度
+DEFAULT_CHECKPOINT_LINES = 200
+DEFAULT_CHECKPOINT_SECONDS = 2.0
+
+# 任务状态
+JOB_RUNNING = 'running'
+JOB_INTERRUPTED = 'interrupted'
+JOB_COMPLETED = 'completed'
+
+
+def _program_key(job_id: str) -> str:
+    return f"plot_job:{job_id}:program"
+
+
+def _checkpoint_key(job_id: str) -> str:
+    return f"plot_job:{job_id}:checkpoint"
+
+
+class ModalState:
+    """执行到程序某一行之后的模态状态，用于保存进度和恢复执行"""
+
+    def __init__(self, start=(0.0, 0.0, 0.0)):
+        self.units = 'G21'           # G20 / G21
+        self.distance = 'G90'        # G90 / G91
+        self.feed = None             # 最近一次的 F 字（程序单位）
+        self.position = tuple(start) # 当前位置 (mm)
+        self.cell = None             # 所在的单元格 (tableCellId)
+
+    def apply(self, block: GCodeBlock):
+        """执行一行之后更新状态"""
+        for code in block.gcodes:
+            if code == 20.0:
+                self.units = 'G20'
+            elif code == 21.0:
+                self.units = 'G21'
+            elif code == 90.0:
+                self.distance = 'G90'
+            elif code == 91.0:
+                self.distance = 'G91'
+        if 'F' in block.words:
+            self.feed = block.words['F']
+        if block.end is not None:
+            self.position = block.end
+        elif 92.0 in block.gcodes:
+            self.position = tuple(
+                block.words[axis] * (25.4 if self.units == 'G20' else 1.0) if axis in block.words else self.position[k]
+                for k, axis in enumerate('XYZ')
+            )
+
+    def is_pen_down(self, z_pen_down: float, z_pen_up: float) -> bool:
+        z = self.position[2]
+        return abs(z - z_pen_down) < abs(z - z_pen_up)
+
+    def to_dict(self, z_pen_down: float, z_pen_up: float) -> dict:
+        return {
+            'units': self.units,
+            'distance': self.distance,
+            'feed': self.feed,
+            'position': list(self.position),
+            'pen_down': self.is_pen_down(z_pen_down, z_pen_up),
+            'cell': self.cell,
+        }
+
+
+class PlotJobRunner:
+    """
+    可恢复的写字任务
+
+    任务的 G-code 和执行进度保存在缓存 (diskcache) 中：执行时每确认一定数量的行就保存一次
+    已确认的行号和模态状态（单位、坐标模式、进给速度、落笔状态）。串口出错、报警或程序重启后，
+    重新连接写字机并调用 resume_job，从最后确认的位置继续执行，已经写完的单元格不会重写。
+
+    GRBL 回复 ok 只表示该行进入了规划缓冲区，中断时缓冲区里的行可能还没有执行，
+    因此恢复时从最后确认的行再往前退 planner_blocks 行，并退到所在笔画的起点（抬笔处），
+    只重写被中断的那一笔。
+    """
+
+    def __init__(self, controller: "GRBLController" = None, cache: CacheSystem = None,
+                 checkpoint_lines: int = DEFAULT_CHECKPOINT_LINES,
+                 checkpoint_seconds: float = DEFAULT_CHECKPOINT_SECONDS,
+                 planner_blocks: int = DEFAULT_PLANNER_BLOCKS):
+        """
+        参数:
+            controller: 写字机控制器，默认为 get_default_grbl()
+            cache: 保存任务的缓存，默认为 get_cache()
+            checkpoint_lines: 每确认多少行保存一次进度
+            checkpoint_seconds: 距离上次保存超过多少秒时保存一次进度
+            planner_blocks: GRBL规划缓冲区的块数，恢复时往前退的行数
+        """
+        if controller is None:
+            from app.core.grbl_controller import get_default_grbl
+            controller = get_default_grbl()
+        self.controller = controller
+        self.cache = cache or get_cache()
+        self.checkpoint_lines = checkpoint_lines
+        self.checkpoint_seconds = checkpoint_seconds
+        self.planner_blocks = planner_blocks
+
+    # ---- 任务存取 ----
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """
+        获取任务进度
+
+        返回:
+            {'job_id', 'status', 'index': 已确认的行数, 'total': 总行数, 'line_number': 最后确认的行号,
+             'modal': 模态状态, 'error', 'updated_at'}，任务不存在时返回 None
+        """
+        return self.cache.get(_checkpoint_key(job_id))
+
+    def delete_job(self, job_id: str) -> None:
+        self.cache.delete(_program_key(job_id))
+        self.cache.delete(_checkpoint_key(job_id))
+
+    def _load_program(self, job_id: str):
+        """读取保存的程序，返回 (ParsedProgram, 每行所属的单元格, (落笔 Z, 抬笔 Z))"""
+        record = self.cache.get(_program_key(job_id))
+        if record is None:
+            return None, None, None
+        program = parse_gcode(record['lines'], start=tuple(record['start']))
+        pen = (record.get('z_pen_down', DEFAULT_Z_PEN_DOWN), record.get('z_pen_up', DEFAULT_Z_PEN_UP))
+        return program, self._block_cells(record['lines'], program), pen
+
+    @staticmethod
+    def _block_cells(lines: List[str], program: ParsedProgram) -> List:
+        """根据 "(cell N)" 注释求出每一行所属的单元格"""
+        cell_at_line = {}
+        cell = None
+        for line_number, raw in enumerate(lines, start=1):
+            match = CELL_COMMENT_PATTERN.match(raw.strip())
+            if match:
+                cell = match.group(1)
+            cell_at_line[line_number] = cell
+        return [cell_at_line[block.line_number] for block in program.blocks]
+
+    def _save_checkpoint(self, job_id: str, program: ParsedProgram, cells: List, pen: Tuple[float, float],
+                         index: int, state: ModalState, status: str, error: str = None) -> dict:
+        state.cell = cells[index - 1] if index > 0 else None
+        checkpoint = {
+            'job_id': job_id,
+            'status': status,
+            'index': index,
+            'total': len(program),
+            'line_number': program.blocks[index - 1].line_number if index > 0 else 0,
+            'modal': state.to_dict(*pen),
+            'error': error,
+            'updated_at': time.time(),
+        }
+        self.cache.set(_checkpoint_key(job_id), checkpoint, expire=JOB_EXPIRE_SECONDS)
+        return checkpoint
+
+    # ---- 执行 ----
+
+    def start_job(self, job_id: str, gcode, progress_callback: Callable = None,
+                  z_pen_down: float = DEFAULT_Z_PEN_DOWN, z_pen_up: float = DEFAULT_Z_PEN_UP) -> dict:
+        """
+        保存并开始执行一个写字任务
+
+        参数:
+            job_id: 任务ID，之后用它查询进度或恢复执行
+            gcode: G-code 字符串或行列表（保留 "(cell N)" 注释，恢复时据此报告所在单元格）
+            progress_callback: 进度回调 callback(已确认行数, 总行数, 行号)
+            z_pen_down, z_pen_up: 生成程序时使用的落笔/抬笔 Z 值 (mm)，恢复时据此判断落笔状态
+
+        返回:
+            最后保存的进度（见 get_job），另外包含 'success' 表示是否全部执行完成
+        """
+        lines = gcode.strip().split('\n') if isinstance(gcode, str) else list(gcode)
+        start = (self.controller.current_x, self.controller.current_y, self.controller.current_z)
+        program = parse_gcode(lines, start=start)
+        if not self.controller._check_gcode_bounds(program):
+            print("写字任务未执行，因超出可移动范围。")
+            return {'success': False, 'job_id': job_id, 'status': None, 'error': "超出可移动范围"}
+        record = {'lines': lines, 'start': list(start), 'z_pen_down': z_pen_down, 'z_pen_up': z_pen_up}
+        self.cache.set(_program_key(job_id), record, expire=JOB_EXPIRE_SECONDS)
+        cells = self._block_cells(lines, program)
+        pen = (z_pen_down, z_pen_up)
+        state = ModalState(start)
+        self._save_checkpoint(job_id, program, cells, pen, 0, state, JOB_RUNNING)
+        return self._run(job_id, program, cells, pen, 0, state, progress_callback)
+
+    def resume_job(self, job_id: str, port: str = None, progress_callback: Callable = None) -> dict:
+        """
+        从最后确认的位置继续执行中断的任务
+
+        设备未连接时先连接 port（默认为控制器的默认串口）；处于报警状态时先解锁。
+        然后抬笔、移动到恢复位置，恢复单位、坐标模式、进给速度和落笔状态后继续发送。
+
+        返回:
+            同 start_job
+        """
+        checkpoint = self.get_job(job_id)
+        program, cells, pen = self._load_program(job_id)
+        if checkpoint is None or program is None:
+            print(f"错误：找不到写字任务 {job_id}。")
+            return {'success': False, 'job_id': job_id, 'status': None, 'error': "任务不存在"}
+        if checkpoint['status'] == JOB_COMPLETED:
+            print(f"写字任务 {job_id} 已经完成。")
+            return dict(checkpoint, success=True)
+
+        controller = self.controller
+        if not controller.connected and not controller.connect(port or controller.port):
+            return dict(checkpoint, success=False, error="无法连接写字机")
+        status = controller.get_status()
+        if status is not None and status.state == 'Alarm':
+            controller._send_grbl_command("$X")
+
+        index = self._resume_index(program, checkpoint['index'], pen)
+        state = ModalState(program.start)
+        for block in program.blocks[:index]:
+            state.apply(block)
+        print(f"从第 {program.blocks[index].line_number if index < len(program) else '-'} 行恢复写字任务 {job_id}"
+              f"（已确认 {checkpoint['index']}/{len(program)} 行）")
+        if not self._restore_state(state, pen):
+            error = "恢复写字机状态失败"
+            return dict(self._save_checkpoint(job_id, program, cells, pen, index, state, JOB_INTERRUPTED, error),
+                        success=False)
+        return self._run(job_id, program, cells, pen, index, state, progress_callback)
+
+    def _resume_index(self, program: ParsedProgram, acked: int, pen: Tuple[float, float]) -> int:
+        """恢复执行的位置：往前退出规划缓冲区中可能未执行的行，再退到笔画起点"""
+        index = max(0, acked - self.planner_blocks)
+        state = ModalState(program.start)
+        pen_down = []  # pen_down[i]: 执行第 i 行之前是否落笔
+        for block in program.blocks[:index]:
+            pen_down.append(state.is_pen_down(*pen))
+            state.apply(block)
+        pen_down.append(state.is_pen_down(*pen))
+        while index > 0 and pen_down[index]:
+            index -= 1
+        return index
+
+    def _restore_state(self, state: ModalState, pen: Tuple[float, float]) -> bool:
+        """抬笔移动到恢复位置，恢复模态状态和落笔状态"""
+        controller = self.controller
+        x, y, z = state.position
+        z_pen_up = pen[1]
+        commands = [
+            "G21",
+            "G90",
+            f"G0 Z{z_pen_up:.3f}",
+            f"G0 X{x:.3f} Y{y:.3f}",
+            state.units,
+            state.distance,
+        ]
+        if state.feed is not None:
+            commands.append(f"F{state.feed:g}")
+        if abs(z - z_pen_up) > 1e-6:
+            # 程序在这里是落笔（或其它 Z 高度），按程序单位恢复
+            scale = 25.4 if state.units == 'G20' else 1.0
+            commands += ["G90", f"G0 Z{z / scale:.4f}", state.distance]
+        for cmd in commands:
+            response = controller._send_grbl_command(cmd, quiet=True)
+            if not response or response[-1] != 'ok':
+                print(f"错误：恢复状态时命令 '{cmd}' 执行失败。响应: {response}")
+                return False
+        return True
+
+    def _run(self, job_id: str, program: ParsedProgram, cells: List, pen: Tuple[float, float], index: int,
+             state: ModalState, progress_callback: Callable = None) -> dict:
+        """从第 index 行开始流式发送，并定期保存进度"""
+        blocks = program.blocks
+        # 剩余部分从恢复位置开始（state 为执行到第 index 行之前的状态）
+        remaining = ParsedProgram(blocks[index:], tuple(state.position), program.end, None, [])
+        progress = {'index': index, 'saved_index': index, 'saved_at': time.time()}
+
+        def on_progress(acked, total, line_number):
+            confirmed = index + acked
+            # 模态状态随确认的行前进
+            for block in blocks[progress['index']:confirmed]:
+                state.apply(block)
+            progress['index'] = confirmed
+            now = time.time()
+            if confirmed - progress['saved_index'] >= self.checkpoint_lines \
+                    or now - progress['saved_at'] >= self.checkpoint_seconds:
+                self._save_checkpoint(job_id, program, cells, pen, confirmed, state, JOB_RUNNING)
+                progress['saved_index'] = confirmed
+                progress['saved_at'] = now
+            if progress_callback:
+                progress_callback(confirmed, len(program), line_number)
+
+        result = self.controller.stream_gcode(remaining, progress_callback=on_progress, check_bounds=False)
+        confirmed = index + result['acked']
+        if result['errors']:
+            # 出错的行没有执行，进度停在它之前
+            first_error = result['errors'][0]['line_number']
+            confirmed = min(confirmed, next(i for i in range(index, len(blocks)) if blocks[i].line_number == first_error))
+        state = ModalState(program.start)
+        for block in blocks[:confirmed]:
+            state.apply(block)
+        if result['success']:
+            checkpoint = self._save_checkpoint(job_id, program, cells, pen, len(blocks), state, JOB_COMPLETED)
+            print(f"写字任务 {job_id} 完成。")
+        else:
+            error = result['error'] or "部分行执行失败"
+            checkpoint = self._save_checkpoint(job_id, program, cells, pen, confirmed, state, JOB_INTERRUPTED, error)
+            print(f"写字任务 {job_id} 中断：{error}，已确认 {confirmed}/{len(blocks)} 行，可调用 resume_job 继续。")
+        return dict(checkpoint, success=result['success'])
@@ -28,6 +28,12 @@ class ImageIndex(BaseModel):
     
     # 手写字图片存储的键值
     handwriting_image_key: Optional[str] = None
+
+    # 手写字墨迹层存储的键值（用于增量渲染）
+    handwriting_ink_key: Optional[str] = None
+
+    # 上一次手写字渲染状态存储的键值（单元格内容、墨迹区域、渲染参数）
+    handwriting_state_key: Optional[str] = None
     
     class Config:
         """Pydantic配置类"""
@@ -39,6 +45,8 @@ class ImageIndex(BaseModel):
                 "corrected_table_json_key": "table_12345abcde",
                 "web_tdtr_data_key": "web_tdtr_12345abcde",
                 "drawed_image_key": "drawed_12345abcde.jpg",
-                "handwriting_image_key": "handwriting_12345abcde.jpg"
+                "handwriting_image_key": "handwriting_12345abcde.jpg",
+                "handwriting_ink_key": "handwriting_ink_12345abcde",
+                "handwriting_state_key": "handwriting_state_12345abcde"
             }
         }
\ No newline at end of file
@@ -1,8 +1,14 @@
 from pydantic import BaseModel
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Literal
 # 定义请求体模型
 class HWTableDataRequest(BaseModel):
     rows: int
     cols: int
     tdtr_cells: List[List[Dict[str, Any]]]
     img_index_key: str
+    # 渲染模式: 'glyph' 逐字渲染（使用字形缓存），'line' 每行调用一次 handwrite
+    render_mode: Literal["glyph", "line"] = "glyph"
+    # 渲染质量: 'draft' 快速预览, 'normal' 折中, 'high' 最终输出
+    quality: Literal["draft", "normal", "high"] = "high"
+    # 是否按手写字体的真实字宽排版
+    use_font_metrics: bool = False
@@ -8,7 +8,8 @@ from app.core.table_detect import TableDetect
 from app.core.sheet_model.single_table import SingleTable
 from app.core.cache import get_cache
 from app.schemas.image_index import ImageIndex
-from app.core.handword_gen.hw_converter import gen_handwriter_image
+from app.core.handword_gen.hw_converter import render_handwriting_ink, INK_COLOR
+from app.core.handword_gen.compositor import apply_ink
 class TableService:
     """
     处理表格图片相关的业务逻辑，包括表格识别、图像校正等
@@ -182,10 +183,38 @@ class TableService:
             print("输入的表格数据格式正确")
             input_table_info = table_data["tdtr_cells"]
             
-            # 调用 gen_handwriter_image 生成手写字图片
-            
-            hw_image = gen_handwriter_image(tr_tables_info, tr_word_info, input_table_info, corrected_image)
-            print("生成手写字图片成功")
+            # 读取上一次的渲染状态，只重绘内容发生变化的单元格
+            previous_state = None
+            if img_index.handwriting_state_key and img_index.handwriting_ink_key:
+                previous_state = cache.get_json(img_index.handwriting_state_key)
+                previous_ink = cache.get_ndarray(img_index.handwriting_ink_key)
+                if previous_state and previous_ink is not None:
+                    previous_state = dict(previous_state, ink=previous_ink)
+                else:
+                    previous_state = None
+
+            # 生成手写字墨迹层
+            hw_state = render_handwriting_ink(
+                tr_tables_info, tr_word_info, input_table_info, corrected_image.shape,
+                render_mode=table_data.get("render_mode", "glyph"),
+                quality=table_data.get("quality", "high"),
+                use_font_metrics=table_data.get("use_font_metrics", False),
+                previous=previous_state
+            )
+            hw_image = apply_ink(corrected_image, hw_state["ink"], INK_COLOR, inplace=True)
+            print(f"生成手写字图片成功，重绘单元格数: {hw_state['rendered_cells']}")
+
+            # 保存本次的墨迹层和渲染状态，供下次增量渲染使用
+            if not img_index.handwriting_ink_key:
+                img_index.handwriting_ink_key = uuid.uuid4().hex
+            if not img_index.handwriting_state_key:
+                img_index.handwriting_state_key = uuid.uuid4().hex
+            cache.save_ndarray(img_index.handwriting_ink_key, hw_state["ink"])
+            cache.save_json(img_index.handwriting_state_key, {
+                "cell_boxes": hw_state["cell_boxes"],
+                "input_table_info": hw_state["input_table_info"],
+                "options": hw_state["options"],
+            })
             # 保存生成的手写字图片到缓存
             img_index.handwriting_image_key = uuid.uuid4().hex
             cache.save_image_cv2(img_index.handwriting_image_key, hw_image)
@@ -0,0 +1,79 @@
+from app.core.gcode.compact import compact_gcode, merge_pen_lifts, optimize_pen_lifts
+from app.core.gcode.parser import parse_gcode
+
+
+def _path(lines):
+    """实际产生位移的移动 [(运动模式, 终点, 进给速度)]，单位 mm"""
+    path = []
+    for block in parse_gcode(lines).motions():
+        if block.end == block.start and block.motion in ('G0', 'G1'):
+            continue
+        end = tuple(round(value, 6) for value in block.end)
+        path.append((block.motion, end, block.feed if block.motion != 'G0' else None))
+    return path
+
+
+def _stroke(x, y, lift=True):
+    lines = [f"G0 X{x:.3f} Y{y:.3f}", "G90 G0 Z-2.000", f"G1 X{x + 5:.3f} Y{y:.3f} F1000", f"G1 X{x + 5:.3f} Y{y + 5:.3f}"]
+    return lines + (["G90 G0 Z0.000"] if lift else [])
+
+
+def test_short_gap_pen_lift_is_merged():
+    program = ["G21", "G90", "G90 G0 Z0.000"] + _stroke(0, 0) + ["(cell 2)"] + _stroke(5.1, 5) + _stroke(40, 0)
+    stats = {}
+    out = list(merge_pen_lifts(program, max_gap=0.3, stats=stats))
+
+    assert stats['pen_lifts_removed'] == 1
+    # 第一笔终点 (5, 5) 到第二笔起点 (5.1, 5) 直接画过去，注释保留；到第三笔的 35mm 空程仍然抬笔
+    index = out.index("G1 X5.100 Y5.000")
+    assert out[index - 1] == "(cell 2)"
+    assert out[index - 2] == "G1 X5.000 Y5.000"
+    assert out.count("G90 G0 Z0.000") == 3
+
+
+def test_long_gap_keeps_pen_lift():
+    program = ["G21", "G90", "G90 G0 Z0.000"] + _stroke(0, 0) + _stroke(6, 5)
+    assert list(merge_pen_lifts(program, max_gap=0.3)) == program
+
+
+def test_gap_is_measured_in_mm_for_inch_programs():
+    # 0.1 英寸 = 2.54mm，超过 0.3mm，不能直接画过去
+    program = ["G20", "G90", "G0 Z0", "G0 X0 Y0", "G0 Z-0.0787", "G1 X1 Y0 F40",
+               "G0 Z0", "G0 X1.1 Y0", "G0 Z-0.0787", "G1 X2 Y0"]
+    stats = {}
+    assert list(merge_pen_lifts(program, max_gap=0.3, stats=stats)) == program
+    assert stats['pen_lifts_removed'] == 0
+
+
+def test_redundant_words_are_removed():
+    program = ["G21", "G90", "G90 G0 Z0.000", "G0 Z0.000", "G0 X1.000 Y1.000", "G90 G0 Z-2.000",
+               "G1 X2.000 Y1.000 F1000", "G1 X3.000 Y1.000 F1000", "G1 X3.000 Y1.000"]
+    stats = {}
+    out = list(compact_gcode(program, stats))
+    assert out == ["G21", "G90", "G0 Z0.000", "X1.000 Y1.000", "Z-2.000", "G1 X2.000 F1000", "X3.000"]
+    assert stats['words_removed'] == 13
+
+
+def test_unit_change_resets_known_position():
+    out = list(compact_gcode(["G21", "G90", "G0 X1 Y1", "G20", "G0 X1 Y1", "G0 X0"]))
+    assert out == ["G21", "G90", "G0 X1 Y1", "G20", "X1 Y1", "X0"]
+
+
+def test_compacted_program_keeps_machine_path():
+    program = ["G21", "G90", "G90 G0 Z0.000"]
+    for k in range(20):
+        program += _stroke(k * 7.0, (k % 3) * 4.0)
+    program += ["G2 X10.000 Y10.000 I5.000 J0.000", "G91", "G1 X1 Y0 F500", "G1 X0 Y0", "G90",
+                "G20", "G0 X1 Y1", "G1 X1 Y1 F20", "G1 X2 Y1", "G21", "G0 X0.000 Y0.000"]
+    out = list(compact_gcode(program))
+    assert len(out) < len(program)
+    assert _path(out) == _path(program)
+
+
+def test_report_counts_saved_round_trips():
+    program = ["G21", "G90", "G90 G0 Z0.000"] + _stroke(0, 0) + _stroke(5.1, 5)
+    out, report = optimize_pen_lifts(program)
+    assert report['pen_lifts_removed'] == 1
+    assert report['lines_in'] == len(program)
+    assert report['lines_out'] == len(out)
+    assert report['round_trips_saved'] == report['lines_saved'] == len(program) - len(out)
@@ -0,0 +1,51 @@
+import pytest
+from app.core.grbl_controller import GRBLController
+from app.core.grbl_simulator import RX_BUFFER_SIZE, SimulatedGrbl, simulated_serial_factory
+
+
+@pytest.fixture
+def controller():
+    controller = GRBLController(serial_factory=simulated_serial_factory(exec_time=0.0005), auto_connect=False)
+    controller.status_poll_hz = 0
+    controller.set_xy_movable_range(-1000, 1000, -1000, 1000)
+    assert controller.connect("SIM")
+    yield controller
+    controller.disconnect()
+
+
+def test_stream_never_overflows_rx_buffer(controller):
+    job = ["G21", "G90"] + [f"G1 X{(i % 100) * 0.5:.3f} Y{(i // 100) * 0.5:.3f} F3000" for i in range(1000)]
+    device = controller.ser
+    result = controller.stream_gcode(job)
+
+    assert result['success']
+    assert result['sent'] == result['acked'] == len(job)
+    assert device.overflow_bytes == 0
+    assert device.max_rx_used <= RX_BUFFER_SIZE
+    assert device.lines_received >= len(job)
+
+
+def test_stream_reports_error_lines():
+    factory = simulated_serial_factory(exec_time=0.0005, error_lines=["G1 X5.000 Y0.000 F3000"])
+    controller = GRBLController(serial_factory=factory, auto_connect=False)
+    controller.status_poll_hz = 0
+    controller.set_xy_movable_range(-1000, 1000, -1000, 1000)
+    assert controller.connect("SIM")
+    try:
+        job = [f"G1 X{i:.3f} Y0.000 F3000" for i in range(10)]
+        result = controller.stream_gcode(job, stop_on_error=False)
+        assert not result['success']
+        assert [error['line_number'] for error in result['errors']] == [6]
+        assert result['acked'] == len(job) - 1
+    finally:
+        controller.disconnect()
+
+
+def test_unthrottled_writes_overflow():
+    # 不做流量控制直接写入时，模拟器能发现接收缓冲区溢出
+    device = SimulatedGrbl(exec_time=0.05)
+    try:
+        device.write(("G1 X1.000 Y1.000 F3000\n" * 20).encode('utf-8'))
+        assert device.overflow_bytes > 0
+    finally:
+        device.close()
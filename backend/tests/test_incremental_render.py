@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pytest
+
+hw_converter = pytest.importorskip("app.core.handword_gen.hw_converter")
+from app.core.handword_gen.glyph_cache import get_glyph_cache
+
+# 仓库里的默认字体是开发机上的绝对路径，其它环境可以通过环境变量指定一个 TrueType 字体
+FONT = os.environ.get("AUTOWRITER_TEST_FONT", hw_converter.FONT_PATH)
+IMAGE_SHAPE = (120, 320, 3)
+
+
+def _cell(cell_id, x0, x1):
+    return {'tableCellId': cell_id, 'word': '',
+            'pos': [{'x': x0, 'y': 10}, {'x': x1, 'y': 10}, {'x': x1, 'y': 60}, {'x': x0, 'y': 60}]}
+
+
+# 单元格 0 和 1 的区域重叠，单元格 2 与它们都不相交
+TABLE = [_cell(0, 0, 110), _cell(1, 100, 200), _cell(2, 230, 310)]
+
+
+def _input(texts):
+    return [[{'tableCellId': cell_id, 'isValid': True, 'text': text, 'textAlign': 'left top'}
+             for cell_id, text in enumerate(texts)]]
+
+
+@pytest.fixture
+def fixed_glyphs(monkeypatch):
+    if not os.path.exists(FONT):
+        pytest.skip("找不到测试字体，设置 AUTOWRITER_TEST_FONT 后运行")
+    monkeypatch.setattr(hw_converter, "FONT_PATH", FONT)
+    cache = get_glyph_cache()
+    previous_variants = cache.variants_per_char
+    # 每个字符只有一个变体，字形由固定的种子决定，两次渲染的结果可以逐像素比较
+    cache.configure(variants_per_char=1)
+    cache.clear()
+    yield
+    cache.configure(variants_per_char=previous_variants)
+    cache.clear()
+
+
+def _render(texts, previous=None):
+    return hw_converter.render_handwriting_ink(TABLE, [], _input(texts), IMAGE_SHAPE, workers=1,
+                                               quality='draft', previous=previous)
+
+
+def test_incremental_render_matches_full_render(fixed_glyphs):
+    before = _render(["ABCDEFGHIJKLMN", "abcdefgh", "xyz"])
+    assert before['rendered_cells'] == 3
+    # 单元格 0 的墨迹延伸到单元格 1 的区域，修改它时单元格 1 也要重绘
+    assert hw_converter._boxes_overlap(before['cell_boxes'][0], before['cell_boxes'][1])
+
+    texts = ["HELLO WORLD AB", "abcdefgh", "xyz"]
+    incremental = _render(texts, previous=before)
+    full = _render(texts)
+
+    assert incremental['rendered_cells'] == 2
+    assert incremental['cell_boxes'] == full['cell_boxes']
+    assert np.array_equal(incremental['ink'], full['ink'])
+
+
+def test_unchanged_input_renders_nothing(fixed_glyphs):
+    before = _render(["abc", "def", "ghi"])
+    again = _render(["abc", "def", "ghi"], previous=before)
+    assert again['rendered_cells'] == 0
+    assert np.array_equal(again['ink'], before['ink'])
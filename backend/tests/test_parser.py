@@ -0,0 +1,73 @@
+import math
+import pytest
+from app.core.gcode.parser import arc_center, arc_extents, parse_gcode
+
+
+def _approx(actual, expected):
+    return all(math.isclose(a, e, abs_tol=1e-9) for a, e in zip(actual, expected))
+
+
+def test_relative_moves_accumulate():
+    program = parse_gcode(["G90", "G0 X10 Y10", "G91", "G1 X5 Y-2 F100", "G1 X5", "G90", "G0 X1"])
+    assert [block.end for block in program.motions()] == [
+        (10.0, 10.0, 0.0), (15.0, 8.0, 0.0), (20.0, 8.0, 0.0), (1.0, 8.0, 0.0)
+    ]
+
+
+def test_inch_units_are_converted_to_mm():
+    program = parse_gcode(["G20", "G90", "G1 X1 Y2 F10", "G21", "G1 X1"])
+    blocks = list(program.motions())
+    assert _approx(blocks[0].end, (25.4, 50.8, 0.0))
+    assert blocks[0].feed == pytest.approx(254.0)
+    assert _approx(blocks[1].end, (1.0, 50.8, 0.0))
+    assert program.extents == pytest.approx((0.0, 0.0, 25.4, 50.8))
+
+
+def test_g92_sets_current_position():
+    program = parse_gcode(["G90", "G0 X10 Y10", "G92 X0 Y0", "G0 X5"], start=(0, 0, 0))
+    blocks = list(program.motions())
+    assert len(blocks) == 2
+    # G92 之后 X5 相对新的坐标系，位置按新坐标记录
+    assert blocks[1].start == (0.0, 0.0, 0.0)
+    assert blocks[1].end == (5.0, 0.0, 0.0)
+
+
+def test_non_motion_axis_words_are_not_moves():
+    program = parse_gcode(["G90", "G4 P0.5", "G28 X50 Y50", "G10 L20 P1 X0", "G0 X1"])
+    assert [block.end for block in program.motions()] == [(1.0, 0.0, 0.0)]
+    assert program.extents == (0.0, 0.0, 1.0, 0.0)
+
+
+def test_r_form_arc_centers():
+    start, end = (0.0, 0.0), (10.0, 0.0)
+    # 小于半圆：顺时针时圆心在弦的右侧（下方）
+    assert _approx(arc_center(start, end, {'R': 5.0 * math.sqrt(2)}, clockwise=True), (5.0, -5.0))
+    assert _approx(arc_center(start, end, {'R': 5.0 * math.sqrt(2)}, clockwise=False), (5.0, 5.0))
+    # 负 R 表示大于半圆，圆心换到另一侧
+    assert _approx(arc_center(start, end, {'R': -5.0 * math.sqrt(2)}, clockwise=True), (5.0, 5.0))
+    # 半径不足以连接两点
+    assert arc_center(start, end, {'R': 4.0}, clockwise=True) is None
+
+
+def test_arc_extents_cross_quadrants():
+    # 从 (10, 0) 逆时针到 (-10, 0)，经过最高点 (0, 10)
+    assert _approx(arc_extents((10.0, 0.0), (-10.0, 0.0), (0.0, 0.0), clockwise=False), (-10.0, 0.0, 10.0, 10.0))
+    # 同样的端点顺时针，经过最低点 (0, -10)
+    assert _approx(arc_extents((10.0, 0.0), (-10.0, 0.0), (0.0, 0.0), clockwise=True), (-10.0, -10.0, 10.0, 0.0))
+    # 起点与终点重合为整圆
+    assert _approx(arc_extents((10.0, 0.0), (10.0, 0.0), (0.0, 0.0), clockwise=True), (-10.0, -10.0, 10.0, 10.0))
+
+
+def test_program_extents_include_arc_bulge():
+    # 起点和终点都在 Y=0，负 R 的顺时针圆弧大于半圆，经过圆的最左、最上和最右点
+    radius = 5 * math.sqrt(2)
+    program = parse_gcode(["G90", "G0 X0 Y0", f"G2 X10 Y0 R{-radius:.6f} F100"])
+    (arc,) = [block for block in program.motions() if block.motion == 'G2']
+    assert arc.center == pytest.approx((5.0, 5.0), abs=1e-5)
+    assert program.extents == pytest.approx((5.0 - radius, 0.0, 5.0 + radius, 5.0 + radius), abs=1e-5)
+    assert not program.errors
+
+
+def test_invalid_r_arc_is_reported():
+    program = parse_gcode(["G90", "G0 X0 Y0", "G2 X10 Y0 R1 F100"])
+    assert program.errors and program.errors[0][0] == 3
@@ -0,0 +1,92 @@
+import pytest
+from app.core.cache import CacheSystem
+from app.core.gcode.parser import parse_gcode
+from app.core.grbl_controller import GRBLController
+from app.core.grbl_simulator import simulated_serial_factory
+from app.core.plot_job import JOB_COMPLETED, JOB_INTERRUPTED, PlotJobRunner
+
+# 与控制器默认值 (-2, 0) 不同的落笔/抬笔高度，恢复时必须使用任务自己的高度
+Z_DOWN, Z_UP = 3.0, 5.0
+
+
+def _program(strokes=12, points=30):
+    lines = ["G21", "G90", f"G0 Z{Z_UP:.3f}"]
+    for k in range(strokes):
+        lines.append(f"(cell {k // 4})")
+        lines.append(f"G0 X{k * 10:.3f} Y0.000")
+        lines.append(f"G0 Z{Z_DOWN:.3f}")
+        for i in range(1, points):
+            lines.append(f"G1 X{k * 10 + i * 0.2:.3f} Y{(i % 5) * 0.5:.3f} F3000")
+        lines.append(f"G0 Z{Z_UP:.3f}")
+    return lines
+
+
+def _segments(points):
+    """相邻两点都在落笔高度的线段"""
+    drawn = set()
+    for a, b in zip(points, points[1:]):
+        if abs(a[2] - Z_DOWN) < 1e-6 and abs(b[2] - Z_DOWN) < 1e-6 and a[:2] != b[:2]:
+            drawn.add((tuple(round(v, 3) for v in a[:2]), tuple(round(v, 3) for v in b[:2])))
+    return drawn
+
+
+@pytest.fixture
+def controller():
+    controller = GRBLController(serial_factory=simulated_serial_factory(exec_time=0.002), auto_connect=False)
+    controller.status_poll_hz = 0
+    controller.set_xy_movable_range(-1000, 1000, -1000, 1000)
+    assert controller.connect("SIM")
+    yield controller
+    controller.disconnect()
+
+
+def test_resume_after_port_closed_mid_stroke(controller, tmp_path):
+    runner = PlotJobRunner(controller, CacheSystem(str(tmp_path)), checkpoint_lines=10)
+    program = _program()
+    devices = [controller.ser]
+
+    def close_port(acked, total, line_number):
+        if acked == 200 and controller.ser is not None:
+            controller.ser.close()
+
+    result = runner.start_job("job", program, close_port, z_pen_down=Z_DOWN, z_pen_up=Z_UP)
+    assert not result['success']
+    checkpoint = runner.get_job("job")
+    assert checkpoint['status'] == JOB_INTERRUPTED
+    assert 0 < checkpoint['index'] < checkpoint['total']
+
+    parsed, _, pen = runner._load_program("job")
+    assert pen == (Z_DOWN, Z_UP)
+    index = runner._resume_index(parsed, checkpoint['index'], pen)
+    assert index <= checkpoint['index'] - runner.planner_blocks
+    # 退到笔画起点：该行之前是抬笔状态
+    assert parsed.blocks[index - 1].end[2] == Z_UP
+
+    result = runner.resume_job("job", port="SIM")
+    devices.append(controller.ser)
+    assert result['success']
+    assert result['status'] == JOB_COMPLETED
+    assert result['index'] == result['total'] == len(parsed)
+    assert result['modal']['pen_down'] is False
+    # ok 只表示进入规划缓冲区，G4 等规划缓冲区执行完才回复
+    assert controller._send_grbl_command("G4 P0", quiet=True)[-1] == 'ok'
+
+    expected = _segments([block.start for block in parsed.motions()] + [parsed.end])
+    drawn = set()
+    for device in devices:
+        drawn |= _segments([(0.0, 0.0, 0.0)] + [target for _, target in device.executed])
+    assert drawn == expected
+
+
+def test_error_line_stops_progress_before_it(controller, tmp_path):
+    program = _program(strokes=3)
+    bad = program[20]
+    controller.disconnect()
+    controller.serial_factory = simulated_serial_factory(exec_time=0.001, error_lines=[bad])
+    assert controller.connect("SIM")
+    runner = PlotJobRunner(controller, CacheSystem(str(tmp_path)))
+
+    result = runner.start_job("job", program, z_pen_down=Z_DOWN, z_pen_up=Z_UP)
+    assert not result['success']
+    parsed = parse_gcode(program)
+    assert result['index'] == next(i for i, block in enumerate(parsed.blocks) if block.text == bad)
@@ -0,0 +1,43 @@
+import numpy as np
+from app.core.gcode.parser import parse_gcode
+from app.core.gcode.simplify import simplify_gcode, simplify_polyline
+
+
+def test_right_angle_corner_stays_linear():
+    gcode = ["G90", "G0 X0 Y0", "G0 Z-2", "G1 X10 Y0 F1000", "G1 X10 Y10", "G0 Z0"]
+    out = list(simplify_gcode(gcode))
+    assert "G1 X10.000 Y0.000 F1000" in out
+    assert "G1 X10.000 Y10.000" in out
+    assert not any(line.startswith(("G2", "G3")) for line in out)
+
+
+def test_u_shape_stays_linear():
+    points = np.array([(0, 0), (0, 10), (10, 10), (10, 0)], dtype=np.float64)
+    moves = simplify_polyline(points, 0.05)
+    assert [move[0] for move in moves] == ['G1', 'G1', 'G1']
+
+
+def test_densely_sampled_circle_becomes_arc():
+    angles = np.linspace(0, np.pi, 60)
+    points = np.column_stack([10 * np.cos(angles), 10 * np.sin(angles)])
+    moves = simplify_polyline(points, 0.05)
+    assert len(moves) == 1
+    assert moves[0][0] == 'G3'
+
+
+def test_inch_program_uses_converted_tolerance():
+    # 0.01 英寸 (0.254mm) 的偏差超过 0.05mm 容差，不能被简化掉
+    gcode = ["G20", "G90", "G0 X0 Y0", "G1 X1 Y0 F40", "G1 X2 Y0.01", "G1 X3 Y0"]
+    out = list(simplify_gcode(gcode))
+    assert "G1 X2.000 Y0.010" in out
+
+
+def test_z_move_after_arc_restores_modal_motion():
+    angles = np.linspace(0, np.pi, 40)
+    arc = [f"G1 X{10 * np.cos(a):.4f} Y{10 * np.sin(a):.4f}" for a in angles[1:]]
+    gcode = ["G21", "G90", "G0 X10 Y0", "G1 Z-2 F500"] + arc + ["Z0", "X20 Y20"]
+    out = list(simplify_gcode(gcode))
+    assert any(line.startswith("G3") for line in out)
+    assert "G1 Z0" in out
+    motions = [block.motion for block in parse_gcode(out).motions()]
+    assert motions[-2:] == ['G1', 'G1']
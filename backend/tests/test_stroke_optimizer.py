@@ -0,0 +1,65 @@
+import math
+from app.core.gcode.parser import parse_gcode
+from app.core.gcode.stroke_optimizer import optimize_stroke_order
+
+PROGRAM = [
+    "G21", "G90", "G90 G0 Z0.000",
+    "(cell 1)",
+    "G0 X25.000 Y30.000", "G90 G0 Z-2.000", "G3 X20.000 Y25.000 R5.000 F1000", "G1 X63.000 Y63.000", "G90 G0 Z0.000",
+    "G0 X10.000 Y5.000", "G90 G0 Z-2.000", "G2 X5.000 Y0.000 I-5.000 J0.000 F1000", "G1 X0.000 Y0.000", "G90 G0 Z0.000",
+    "G0 X12.000 Y6.000", "G90 G0 Z-2.000", "G1 X14.000 Y6.000 F1000", "G0 X60.000 Y60.000", "G90 G0 Z0.000",
+    "G0 X61.000 Y61.000", "G90 G0 Z-2.000", "G1 X62.000 Y62.000 F1000", "G90 G0 Z0.000",
+    "G0 X11.000 Y5.000", "G90 G0 Z-2.000", "G1 X11.000 Y1.000 F1000", "G90 G0 Z0.000",
+]
+
+
+def _key(point):
+    return tuple(round(value, 3) for value in point[:2])
+
+
+def _pen_down_segments(lines):
+    """落笔状态下的所有移动，与方向无关: 直线为 (G0/G1, 端点集合)，圆弧另外记录圆心和按端点顺序归一化后的方向"""
+    segments = []
+    for block in parse_gcode(lines).motions():
+        if block.start[2] > -1 or block.end[2] > -1 or block.start[:2] == block.end[:2]:
+            continue
+        a, b = _key(block.start), _key(block.end)
+        if block.motion in ('G2', 'G3'):
+            clockwise = block.motion == 'G2'
+            if a > b:
+                a, b, clockwise = b, a, not clockwise
+            segments.append(('arc', a, b, _key(block.center), clockwise))
+        else:
+            segments.append((block.motion, min(a, b), max(a, b)))
+    return sorted(segments)
+
+
+def _pen_up_travel(lines):
+    travel = 0.0
+    for block in parse_gcode(lines).motions():
+        if block.start[2] > -1 and block.end[2] > -1:
+            travel += math.hypot(block.end[0] - block.start[0], block.end[1] - block.start[1])
+    return travel
+
+
+def test_reordering_keeps_pen_down_segments():
+    output, report = optimize_stroke_order(PROGRAM)
+    assert report['strokes'] == 5
+    assert report['optimized']
+    assert _pen_down_segments(output) == _pen_down_segments(PROGRAM)
+    # 两种写法的圆弧都被反向书写
+    assert any(line.startswith("G2") and "R5.000" in line for line in output)
+    assert any(line.startswith("G3") and "I" in line for line in output)
+
+
+def test_report_matches_actual_travel():
+    output, report = optimize_stroke_order(PROGRAM)
+    assert math.isclose(report['travel_before_mm'], _pen_up_travel(PROGRAM), abs_tol=1e-6)
+    assert math.isclose(report['travel_after_mm'], _pen_up_travel(output), abs_tol=1e-6)
+
+
+def test_relative_program_is_left_unchanged():
+    program = ["G91", "G0 Z-2", "G1 X1 F100", "G0 Z2"]
+    output, report = optimize_stroke_order(program)
+    assert output == program
+    assert not report['optimized']